@@ -0,0 +1,67 @@
+"""Benchmark of fetching a deep page of queries ordered by id and by an indexed
+field, by slicing the whole result with an offset and by resuming from a
+cursor.
+
+Usage:
+    PYTHONPATH=. python benchmarks/fetch_page.py [number of objects]
+"""
+import sys
+import time
+
+import pydictdb
+
+
+PAGE_SIZE = 20
+
+
+def is_active(obj):
+    return obj['active']
+
+
+def measure(name, query, offset, ids_only):
+    # NOTE: the cursor after the previous pages, as a client sends back, and
+    # the first page of id order also builds the sorted ids, not measured
+    cursor = None
+    if offset:
+        _, cursor, _ = query.fetch_page(offset, ids_only=ids_only)
+    else:
+        query.fetch_page(1)
+
+    start = time.perf_counter()
+    expected = query.fetch(ids_only=ids_only, limit=PAGE_SIZE, offset=offset)
+    offset_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    results, _, _ = query.fetch_page(PAGE_SIZE, cursor, ids_only=ids_only)
+    cursor_seconds = time.perf_counter() - start
+    assert results == expected
+    print('%-12s page %-6d offset %8.2f ms  cursor %8.2f ms' % (name,
+            offset // PAGE_SIZE + 1, offset_seconds * 1000,
+            cursor_seconds * 1000))
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    database = pydictdb.Database(storage=pydictdb.MemoryStorage())
+    table = database.table('User')
+    table.create_index('score', ordered=True)
+    table.create_index('group')
+    # NOTE: inserted in the order of ids, so the offset of a query without
+    # order is the same as the order by id
+    table.update_or_insert_multi(['%08d' % i for i in range(size)],
+            [{'score': i * 7 % size, 'active': i % 3 != 0, 'group': i % 2}
+                for i in range(size)])
+
+    print('%d objects, pages of %d' % (size, PAGE_SIZE))
+    for page in (1, 100, size // PAGE_SIZE // 2):
+        offset = (page - 1) * PAGE_SIZE
+        measure('id', table.query(is_active), offset, True)
+        measure('score', table.query(is_active).order_by('score'), offset,
+                False)
+        # NOTE: the candidates of the hash index are half of the objects
+        measure('group', table.query().equal('group', 1), offset, True)
+        measure('group score', table.query().equal('group', 1).order_by('score'),
+                offset, True)
+
+
+if __name__ == '__main__':
+    main()
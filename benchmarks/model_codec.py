@@ -0,0 +1,87 @@
+"""Benchmark of putting and getting models of 20 attributes, and getting them
+again from a :py:class:`pydictdb.db.ModelCache`.
+
+Usage:
+    PYTHONPATH=. python benchmarks/model_codec.py [number of models]
+"""
+import datetime
+import sys
+import time
+
+import pydictdb
+from pydictdb import db
+
+
+def define_model(name, compact=False):
+    class Meta:
+        pass
+    Meta.compact = compact
+
+    return type(name, (db.Model,), dict(
+        Meta=Meta,
+        name=db.StringAttribute(),
+        email=db.StringAttribute(),
+        city=db.StringAttribute(),
+        country=db.StringAttribute(choices=['TW', 'JP', 'US']),
+        note=db.StringAttribute(),
+        age=db.IntegerAttribute(),
+        score=db.IntegerAttribute(),
+        level=db.IntegerAttribute(),
+        visits=db.IntegerAttribute(),
+        height=db.FloatAttribute(),
+        weight=db.FloatAttribute(),
+        balance=db.FloatAttribute(),
+        active=db.BooleanAttribute(),
+        verified=db.BooleanAttribute(),
+        extra=db.GenericAttribute(),
+        birth=db.DateAttribute(),
+        joined=db.DateAttribute(),
+        created=db.DatetimeAttribute(),
+        updated=db.DatetimeAttribute(),
+        tags=db.StringAttribute(repeated=True),
+    ))
+
+
+BenchmarkModel = define_model('BenchmarkModel')
+
+
+def make_models(size, model_class=BenchmarkModel):
+    now = datetime.datetime(2019, 1, 1, 12, 30, 45, 123456)
+    return [model_class(name='user%d' % i, email='user%d@example.com' % i,
+            city='Taipei', country='TW', note='', age=i % 90, score=i,
+            level=i % 10, visits=i * 3, height=170.5, weight=60.25,
+            balance=i / 3, active=True, verified=False, extra=i,
+            birth=datetime.date(1990, 1, 1 + i % 28),
+            joined=datetime.date(2018, 1, 1 + i % 28),
+            created=now, updated=now, tags=['a', 'b'])
+            for i in range(size)]
+
+
+def measure(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main(size):
+    db.register_database(pydictdb.Database(storage=pydictdb.MemoryStorage(),
+            auto_commit=False))
+    models = make_models(size)
+    results = [
+        ('put', measure(lambda: [model.put() for model in models])),
+        ('get', measure(lambda: [model.key.get() for model in models])),
+        ('put_multi', measure(lambda: db.put_multi(models))),
+        ('get_multi', measure(
+                lambda: db.get_multi([model.key for model in models]))),
+    ]
+    db.set_cache(db.ModelCache(max_size=None))
+    keys = [model.key for model in models]
+    [key.get() for key in keys]
+    results.append(('get cached', measure(lambda: [key.get() for key in keys])))
+    db.set_cache(None)
+    for name, seconds in results:
+        print('%-10s %10.0f models/s' % (name, size / seconds))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,57 @@
+"""Benchmark of the memory and time to fetch models of 20 attributes, in the
+default and compact modes.
+
+Usage:
+    PYTHONPATH=. python benchmarks/model_memory.py [number of models]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+
+import pydictdb
+from pydictdb import db
+
+from model_codec import define_model
+from model_codec import make_models
+
+
+def measure(model_class, size):
+    db.put_multi(make_models(size, model_class))
+
+    start = time.perf_counter()
+    fetched = model_class.query().fetch()
+    seconds = time.perf_counter() - start
+    del fetched
+
+    gc.collect()
+    tracemalloc.start()
+    fetched = model_class.query().fetch()
+    size_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return len(fetched), size_bytes, instance_size(fetched[0]), seconds
+
+
+def instance_size(obj):
+    # NOTE: the model and its key, without the values
+    size = sys.getsizeof(obj) + sys.getsizeof(obj.key)
+    for _obj in (obj, obj.key):
+        if hasattr(_obj, '__dict__'):
+            size += sys.getsizeof(vars(_obj))
+
+    return size
+
+
+def main(size):
+    db.register_database(pydictdb.Database(storage=pydictdb.MemoryStorage(),
+            auto_commit=False))
+    for model_class in (define_model('BenchmarkModel'),
+            define_model('CompactBenchmarkModel', compact=True)):
+        count, size_bytes, instance_bytes, seconds = measure(model_class, size)
+        print('%-22s %6.0f bytes/model (%4d of instance) %10.0f models/s' % (
+                model_class.__name__, size_bytes / count, instance_bytes,
+                count / seconds))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
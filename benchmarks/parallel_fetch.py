@@ -0,0 +1,49 @@
+"""Benchmark of fetching with a CPU-heavy predicate, serially and on a process
+pool by the number of workers.
+
+The speedup is bounded by the number of cores, and the first parallel fetch
+of a number of workers also starts the processes, which is not measured.
+
+Usage:
+    PYTHONPATH=. python benchmarks/parallel_fetch.py [number of objects]
+"""
+import hashlib
+import os
+import sys
+import time
+
+import pydictdb
+
+
+def is_lucky(obj):
+    digest = obj['name'].encode()
+    for _ in range(50):
+        digest = hashlib.sha256(digest).digest()
+    return digest[0] < 16
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    database = pydictdb.Database(storage=pydictdb.MemoryStorage())
+    table = database.table('User')
+    table.update_or_insert_multi(list(range(size)),
+            [{'name': 'user%d' % i, 'score': i % 100} for i in range(size)])
+
+    print('%d objects, %d cores' % (size, os.cpu_count()))
+    start = time.perf_counter()
+    expected = table.query(is_lucky).fetch(ids_only=True)
+    serial_seconds = time.perf_counter() - start
+    print('%-10s %8.0f ms' % ('serial', serial_seconds * 1000))
+    for parallel in (2, 4, 8):
+        table.query(is_lucky).fetch(ids_only=True, parallel=parallel, limit=1)
+        start = time.perf_counter()
+        object_ids = table.query(is_lucky).fetch(ids_only=True,
+                parallel=parallel)
+        seconds = time.perf_counter() - start
+        assert object_ids == expected
+        print('%-10s %8.0f ms  %.2fx' % ('parallel=%d' % parallel,
+                seconds * 1000, serial_seconds / seconds))
+
+
+if __name__ == '__main__':
+    main()
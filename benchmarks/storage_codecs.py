@@ -0,0 +1,75 @@
+"""Benchmark of the codecs and compressions of the file storages, by the time
+to write and read a database of user-like objects and the file size.
+
+Usage:
+    PYTHONPATH=. python benchmarks/storage_codecs.py [number of objects]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pydictdb
+
+STORAGE_CLASSES = (pydictdb.JsonStorage, pydictdb.PickleStorage,
+        pydictdb.MarshalStorage)
+COMPRESSIONS = (None, 'zlib', 'bz2', 'lzma')
+
+
+def make_data(size, seed=0):
+    random_ = random.Random(seed)
+    words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta']
+    users = {}
+    for i in range(size):
+        users['%016x' % random_.getrandbits(64)] = {
+            'name': 'user%d' % i,
+            'email': 'user%d@example.com' % i,
+            'age': random_.randint(18, 80),
+            'score': round(random_.random() * 100, 2),
+            'active': random_.random() < 0.8,
+            'tags': random_.sample(words, 3),
+            'created': '2020-01-%02d 12:%02d:00' % (i % 28 + 1, i % 60),
+            'address': {'city': random_.choice(words).title(),
+                    'zip': '%05d' % random_.randint(0, 99999)},
+        }
+
+    return {'User': users}
+
+
+def measure(storage_class, compression, path, data, repeat=3):
+    storage = storage_class(path, compression=compression)
+    write_seconds = read_seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        storage.write(data)
+        write_seconds = min(write_seconds, time.perf_counter() - start)
+        start = time.perf_counter()
+        storage.read()
+        read_seconds = min(read_seconds, time.perf_counter() - start)
+
+    storage.close()
+    return write_seconds, read_seconds, os.path.getsize(path)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    data = make_data(size)
+    print('%d objects' % size)
+    print('%-16s %-6s %10s %10s %12s' % (
+            'storage', 'comp', 'write ms', 'read ms', 'size KiB'))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'storage')
+        for storage_class in STORAGE_CLASSES:
+            for compression in COMPRESSIONS:
+                write_seconds, read_seconds, file_size = measure(
+                        storage_class, compression, path, data)
+                print('%-16s %-6s %10.1f %10.1f %12.1f' % (
+                        storage_class.__name__, compression or '-',
+                        write_seconds * 1000, read_seconds * 1000,
+                        file_size / 1024))
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Benchmark of opening a database stored in a file and getting an object,
+by the storage and the number of objects.
+
+:py:class:`pydictdb.storages.JsonStorage` decodes the whole file when the
+database is opened, while :py:class:`pydictdb.storages.MmapStorage` maps the
+file and decodes the index of a kind on its first use and an object on its
+first get.
+
+Usage:
+    PYTHONPATH=. python benchmarks/storage_startup.py [number of objects]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import pydictdb
+
+
+def make_data(size):
+    return {'User': {str(i): {'name': 'user%d' % i, 'score': i % 100,
+            'tags': ['tag%d' % (i % 7)]} for i in range(size)}}
+
+
+def measure(storage_class, path, data):
+    storage_class(path).write(data)
+    start = time.perf_counter()
+    database = pydictdb.Database(storage=storage_class(path))
+    opened = time.perf_counter()
+    database.table('User').get('0')
+    got = time.perf_counter()
+    return opened - start, got - start
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    data = make_data(size)
+    with tempfile.TemporaryDirectory() as directory:
+        for storage_class in (pydictdb.JsonStorage, pydictdb.MmapStorage):
+            path = os.path.join(directory, storage_class.__name__)
+            open_seconds, get_seconds = measure(storage_class, path, data)
+            print('%-12s %d objects: open %8.2f ms, first get %8.2f ms' % (
+                    storage_class.__name__, size, open_seconds * 1000,
+                    get_seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
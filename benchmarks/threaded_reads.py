@@ -0,0 +1,75 @@
+"""Benchmark of the read throughput of a thread-safe database by the number of
+threads, where each thread gets objects and queries an index for a while.
+
+The readers hold the read lock together, so the throughput scales with the
+threads as far as the interpreter runs them in parallel, e.g. a build without
+the GIL; with the GIL, it shows the cost of locking instead.
+
+Usage:
+    PYTHONPATH=. python benchmarks/threaded_reads.py [seconds per run]
+"""
+import sys
+import threading
+import time
+
+import pydictdb
+
+
+def make_table(thread_safe, size=10000):
+    database = pydictdb.Database(storage=pydictdb.MemoryStorage(),
+            thread_safe=thread_safe)
+    table = database.table('User')
+    table.create_index('score', ordered=True)
+    table.update_or_insert_multi(list(range(size)),
+            [{'name': 'user%d' % i, 'score': i % 100} for i in range(size)])
+    return table
+
+
+def read(table, deadline, counts):
+    count = 0
+    object_id = 0
+    while time.perf_counter() < deadline:
+        table.get(object_id % 10000)
+        table.query().range('score', 10, 11).fetch(limit=10)
+        object_id += 7
+        count += 2
+
+    counts.append(count)
+
+
+def measure(table, threads_size, seconds, writing=False):
+    counts = []
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=read, args=(table, deadline, counts))
+            for _ in range(threads_size)]
+    if writing:
+        threads.append(threading.Thread(target=write, args=(table, deadline)))
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return sum(counts) / seconds
+
+
+def write(table, deadline):
+    while time.perf_counter() < deadline:
+        table.update_or_insert(0, {'name': 'user0', 'score': 0})
+        time.sleep(0.001)
+
+
+def main(seconds):
+    print('%-30s %12.0f reads/s' % ('1 thread, not thread-safe',
+            measure(make_table(False), 1, seconds)))
+    table = make_table(True)
+    for threads_size in (1, 2, 4, 8):
+        for writing in (False, True):
+            name = '%d threads%s' % (threads_size,
+                    ', 1 writer' if writing else '')
+            print('%-30s %12.0f reads/s' % (name,
+                    measure(table, threads_size, seconds, writing)))
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 1.0)
@@ -1,3 +1,4 @@
+from .core import ConflictError
 from .core import Database
 from .core import Table
 
@@ -11,12 +12,27 @@ from .db import FloatAttribute
 from .db import GenericAttribute
 from .db import IntegerAttribute
 from .db import KeyAttribute
+from .db import ModelCache
 from .db import StringAttribute
 from .db import delete_multi
+from .db import delete_multi_async
 from .db import get_multi
+from .db import get_multi_async
 from .db import put_multi
+from .db import put_multi_async
 from .db import register_database
+from .db import set_cache
 
+from .ids import CounterIdGenerator
+from .ids import SnowflakeIdGenerator
+from .ids import UuidIdGenerator
+
+from .storages import DirectoryStorage
 from .storages import FileStorage
+from .storages import JournalStorage
+from .storages import JsonLinesStorage
 from .storages import JsonStorage
+from .storages import MarshalStorage
 from .storages import MemoryStorage
+from .storages import MmapStorage
+from .storages import PickleStorage
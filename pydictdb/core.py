@@ -1,32 +1,624 @@
+import asyncio
+import base64
+import collections
+import collections.abc
+import concurrent.futures
+import contextlib
 import copy
-import datetime
+import functools
+import heapq
+import itertools
+import json
+import operator
+import pickle
+import threading
+from . import ids
+from . import indexes
+from . import locks
 from . import storages
 
 
+COPY_DEEP = 'deep'
+COPY_SHALLOW = 'shallow'
+COPY_READONLY = 'readonly'
+COPY_POLICIES = (COPY_DEEP, COPY_SHALLOW, COPY_READONLY)
+
+_default_id_generator = ids.CounterIdGenerator()
+# NOTE: the ids of the default generator are unique only in a process, so a
+# shared database generates ids unique across the processes by default
+_shared_id_generator = ids.SnowflakeIdGenerator()
+_null_lock = locks.NullLock()
+
+
+def _accept_all(obj):
+    return True
+
+
+class ConflictError(RuntimeError):
+    """This exception is raised when the changes not committed yet conflict
+    with the objects committed by another process sharing the storage, see
+    :py:meth:`Database.refresh`. The conflicting local changes are dropped
+    for the committed objects, and the others are kept.
+
+    Attributes:
+        conflicts (dict): The ids of the conflicting objects, as
+            ``{kind: [object_id]}``.
+    """
+    def __init__(self, conflicts):
+        super().__init__("objects changed by another process: %s" % ', '.join(
+                '%s %r' % (kind, object_id) for kind, object_ids
+                in conflicts.items() for object_id in object_ids))
+        self.conflicts = conflicts
+
+
+def _validate_copy_policy(copy_policy):
+    if copy_policy not in COPY_POLICIES:
+        raise ValueError("invalid copy_policy %s, must be one of %s" % (
+                repr(copy_policy), ', '.join(map(repr, COPY_POLICIES))))
+
+
+def _writes_changes(storage):
+    return (type(storage).write_changes
+            is not storages.Storage.write_changes)
+
+
+def _writes_kinds(storage):
+    return type(storage).write_kinds is not storages.Storage.write_kinds
+
+
+def _reads_kinds(storage):
+    return type(storage).read_kind is not storages.Storage.read_kind
+
+
+def _locks_processes(storage):
+    return type(storage).lock is not storages.Storage.lock
+
+
+def _versions_kinds(storage):
+    return (type(storage).kind_versions
+            is not storages.Storage.kind_versions)
+
+
+def _readonly(value):
+    if isinstance(value, dict):
+        return ReadOnlyDict(value)
+    elif isinstance(value, list):
+        return ReadOnlyList(value)
+
+    return value
+
+
+class ReadOnlyDict(collections.abc.Mapping):
+    # NOTE: nested dict and list are wrapped on access, not on creation
+    __slots__ = ('_dict',)
+
+    def __init__(self, dictionary):
+        self._dict = dictionary
+
+    def __getitem__(self, key):
+        return _readonly(self._dict[key])
+
+    def __iter__(self):
+        return iter(self._dict)
+
+    def __len__(self):
+        return len(self._dict)
+
+    def __contains__(self, key):
+        return key in self._dict
+
+    def __eq__(self, other):
+        if isinstance(other, ReadOnlyDict):
+            other = other._dict
+        return self._dict == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, repr(self._dict))
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self._dict, memo)
+
+
+class ReadOnlyList(collections.abc.Sequence):
+    __slots__ = ('_list',)
+
+    def __init__(self, _list):
+        self._list = _list
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ReadOnlyList(self._list[index])
+        return _readonly(self._list[index])
+
+    def __len__(self):
+        return len(self._list)
+
+    def __eq__(self, other):
+        if isinstance(other, ReadOnlyList):
+            other = other._list
+        elif isinstance(other, tuple):
+            other = list(other)
+        return self._list == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, repr(self._list))
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self._list, memo)
+
+
 class Database(object):
-    def __init__(self, storage=storages.MemoryStorage(), auto_commit=True):
+    def __init__(self, storage=storages.MemoryStorage(), auto_commit=True,
+            copy_policy=COPY_DEEP, id_generator=None, thread_safe=False,
+            commit_interval=None, commit_threshold=None, shared=False):
         self.storage = storage
-        if storage:
-            self._tables = storage.read()
-        else:
-            self._tables = {}
+        # NOTE: in the shared mode, the storage is shared by processes, and
+        # each commit reads the changes of the other processes before writing
+        # under the lock of the storage, see `_commit_shared`
+        self.shared = bool(shared)
+        if shared and not (storage and _locks_processes(storage)):
+            raise ValueError("storage %s can not be shared" % (
+                    type(storage).__name__))
+
+        # kinds in the storage which are not read yet, see `table`
+        self._unloaded_kinds = set()
+        # versions of the storage and its kinds as read, see `refresh`
+        self._version = None
+        self._kind_versions = {}
+        with storage.lock(shared=True) if shared else contextlib.nullcontext():
+            if storage and _reads_kinds(storage):
+                self._tables = {}
+                self._unloaded_kinds.update(storage.kinds())
+            elif storage:
+                self._tables = storage.read()
+            else:
+                self._tables = {}
+
+            if shared:
+                self._version = storage.version()
+                if _versions_kinds(storage):
+                    self._kind_versions = storage.kind_versions()
 
         self.auto_commit = auto_commit
+        _validate_copy_policy(copy_policy)
+        self.copy_policy = copy_policy
+        if shared and id_generator is None:
+            id_generator = _shared_id_generator
+        self.id_generator = id_generator
+        # changed object ids of each kind since the last commit, None if
+        # unknown, e.g. the tables may have been modified in place before the
+        # first commit, then all of the tables are written
+        self._changes = None
+        if shared:
+            # NOTE: the changes must be known to be kept on reading again
+            self._changes = {}
+        # objects as read before the changes not committed yet, to detect the
+        # conflicts with the other processes in the shared mode, see `_reload`
+        self._originals = {}
+        # stack of the original objects changed in each nested batch
+        self._undo_logs = []
+        # functions called with (kind, object_id) on each change, where
+        # object_id is None if any object of the kind may be changed
+        self._listeners = []
+        # NOTE: Table objects are kept for their indexes, and the tables are
+        # changed for them in the mutex, see `table`
+        self._table_objects = {}
+        self._table_mutex = threading.Lock()
+        # reads run in parallel, while writes, commits and batches are
+        # serialized, see `locks.ReadWriteLock`
+        self.thread_safe = bool(thread_safe)
+        self._lock = locks.ReadWriteLock() if thread_safe else _null_lock
+        # NOTE: the storage is written in a thread once committed in async, see
+        # `commit_async`, and then the commits are all written in order in it
+        self._executor = None
+        # future of the next commit shared by the waiting coroutines, and the
+        # task writing the commits
+        self._commit_waiter = None
+        self._flush_task = None
+        # NOTE: in the background commit mode, writes only mark the database
+        # dirty, and a flusher thread commits them every commit_interval
+        # seconds or once commit_threshold changes are pending
+        self.commit_interval = commit_interval
+        self.commit_threshold = commit_threshold
+        self._pending_changes = 0
+        self._flusher = None
+        if commit_interval is not None or commit_threshold is not None:
+            if commit_interval is not None and commit_interval <= 0:
+                raise ValueError("commit_interval must be positive")
+            if commit_threshold is not None and commit_threshold < 1:
+                raise ValueError("commit_threshold must be at least 1")
+
+            self.auto_commit = False
+            self.thread_safe = True
+            # NOTE: the changes are tracked from the start, so the flusher
+            # never rewrites the storage before any write
+            if self._changes is None:
+                self._changes = {}
+            if not thread_safe:
+                self._lock = locks.ReadWriteLock()
+            self._get_executor()
+            self._flush_event = threading.Event()
+            self._closing = False
+            self._flusher = threading.Thread(target=self._run_flusher,
+                    name='pydictdb-flusher', daemon=True)
+            self._flusher.start()
+
+    def _save_undo(self, kind, object_id, old_obj):
+        if self.shared:
+            self._originals.setdefault(kind, {}).setdefault(object_id, old_obj)
+        if self._undo_logs:
+            objects = self._undo_logs[-1].setdefault(kind, {})
+            objects.setdefault(object_id, old_obj)
+
+    def add_listener(self, listener):
+        # NOTE: replaced instead of modified, so never changed in iteration
+        self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        self._listeners = [func for func in self._listeners
+                if func != listener]
+
+    def _touch(self, kind, object_id=None):
+        for listener in self._listeners:
+            listener(kind, object_id)
+
+        if self._flusher is not None:
+            self._pending_changes += 1
+            if (self.commit_threshold is not None
+                    and self._pending_changes >= self.commit_threshold):
+                self._flush_event.set()
+
+        if self._changes is None:
+            return
+
+        object_ids = self._changes.setdefault(kind, set())
+        if object_id is not None:
+            object_ids.add(object_id)
+
+    def _pop_changes(self):
+        self._pending_changes = 0
+        changes, self._changes = self._changes, {}
+        if changes is None:
+            return None
+
+        changed_objects = {}
+        for kind, object_ids in changes.items():
+            dictionary = self._tables.get(kind, {})
+            changed_objects[kind] = {object_id: dictionary.get(object_id, None)
+                    for object_id in object_ids}
+
+        return changed_objects
+
+    def _snapshot(self, copy_tables=False):
+        changes = self._pop_changes()
+        tables = self._tables
+        if changes is not None and _writes_kinds(self.storage):
+            # NOTE: only the tables of the changed kinds are written
+            tables = {kind: self._tables[kind] for kind in changes}
+        if copy_tables and (changes is None or not _writes_changes(self.storage)):
+            # NOTE: the objects are replaced but not modified by writes
+            tables = {kind: copy.copy(dictionary)
+                    for kind, dictionary in tables.items()}
+
+        return changes, tables
+
+    def _write(self, changes, tables):
+        try:
+            if changes is not None:
+                try:
+                    self.storage.write_changes(changes)
+                    return
+                except NotImplementedError:
+                    pass
+
+            if _writes_kinds(self.storage):
+                self.storage.write_kinds(tables)
+            else:
+                self.storage.write(tables)
+        except BaseException:
+            # NOTE: the popped changes are lost, so write all next time
+            self._changes = None
+            raise
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='pydictdb-commit')
+
+        return self._executor
+
+    def _submit_commit(self):
+        # NOTE: the snapshot is taken and submitted in the write lock, so the
+        # commits are written in order
+        with self._lock.writer:
+            if self.shared:
+                # NOTE: written in the lock, as the tables may be read again
+                future = concurrent.futures.Future()
+                try:
+                    self._commit_shared()
+                except Exception as exception:
+                    future.set_exception(exception)
+                else:
+                    future.set_result(None)
+                return future
+
+            return self._get_executor().submit(
+                    self._write, *self._snapshot(copy_tables=True))
+
+    def _commit_shared(self):
+        with self.storage.lock():
+            self._reload()
+            changes = {kind: set(object_ids)
+                    for kind, object_ids in self._changes.items()}
+            try:
+                self._write(*self._snapshot())
+            except BaseException:
+                # NOTE: the tables are never written in whole when shared
+                self._changes = changes
+                raise
+
+            self._originals = {}
+            self._version = self.storage.version()
+            if _versions_kinds(self.storage):
+                self._kind_versions = self.storage.kind_versions()
+
+    def refresh(self):
+        """Read again the tables changed by the other processes sharing the
+        storage, while the changes not committed yet are kept.
+
+        Returns:
+            (bool) -- True if the storage was changed.
+
+        Raises:
+            ConflictError: If an object changed but not committed yet was
+                committed by another process, which is raised by
+                :py:meth:`commit` as well.
+        """
+        if not self.shared:
+            raise ValueError("database is not shared")
+
+        with self._lock.writer:
+            with self.storage.lock(shared=True):
+                return self._reload()
+
+    def _reload(self):
+        version = self.storage.version()
+        if version == self._version:
+            return False
+
+        tables = {}
+        if _versions_kinds(self.storage):
+            # NOTE: only the changed kinds which are loaded are read again
+            kind_versions = self.storage.kind_versions()
+            for kind, kind_version in kind_versions.items():
+                if self._kind_versions.get(kind, None) == kind_version:
+                    continue
+                if kind in self._tables:
+                    tables[kind] = self.storage.read_kind(kind)
+                else:
+                    self._unloaded_kinds.add(kind)
+            self._kind_versions = kind_versions
+        else:
+            tables = self.storage.read()
+
+        self._version = version
+        conflicts = {}
+        for kind, dictionary in tables.items():
+            dictionary_in_use = self._tables.get(kind, {})
+            originals = self._originals.get(kind, {})
+            changed_objects = {}
+            for object_id in sorted(self._changes.get(kind, ()),
+                    key=indexes._id_key):
+                obj = dictionary_in_use.get(object_id, None)
+                committed_obj = dictionary.get(object_id, None)
+                # NOTE: changed by the other process since it was read, then
+                # the committed object is kept instead of the local change
+                if (object_id in originals
+                        and committed_obj != originals[object_id]
+                        and committed_obj != obj):
+                    conflicts.setdefault(kind, []).append(object_id)
+                    self._changes[kind].discard(object_id)
+                    del originals[object_id]
+                else:
+                    changed_objects[object_id] = obj
+
+            self._tables[kind] = dictionary
+            table = self.table(kind)
+            for object_id, obj in changed_objects.items():
+                table._replace(object_id, obj)
+            for listener in self._listeners:
+                listener(kind, None)
+
+        if conflicts:
+            raise ConflictError(conflicts)
+
+        return True
 
     def commit(self):
-        self.storage.write(self._tables)
+        with self._lock.writer:
+            if self.shared:
+                self._commit_shared()
+                return
+
+            if self._executor is None:
+                self._write(*self._snapshot())
+                return
+
+            future = self._submit_commit()
+
+        future.result()
+
+    def flush(self):
+        """Commit the pending changes and wait until all of the commits are
+        written, as a barrier in the background commit mode.
+        """
+        self.commit()
+
+    def close(self):
+        """Stop the background flusher after committing the pending changes,
+        and close the storage if it can be closed.
+        """
+        flusher = self._flusher
+        if flusher is not None:
+            self._closing = True
+            self._flush_event.set()
+            flusher.join()
+            self._flusher = None
+            self.flush()
+
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+        close = getattr(self.storage, 'close', None)
+        if close is not None:
+            close()
+
+    def _run_flusher(self):
+        while not self._closing:
+            self._flush_event.wait(self.commit_interval)
+            self._flush_event.clear()
+            if self._closing or not (self._changes is None or self._changes):
+                continue
+
+            try:
+                self._submit_commit().result()
+            except Exception:
+                # NOTE: the failed changes are written in the next commit, see
+                # `_write`
+                pass
+
+    async def commit_async(self):
+        # NOTE: the coroutines committing during a write share the next one
+        loop = asyncio.get_running_loop()
+        if self._commit_waiter is None:
+            self._commit_waiter = loop.create_future()
+        waiter = self._commit_waiter
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_async())
+
+        await asyncio.shield(waiter)
+
+    async def _flush_async(self):
+        while self._commit_waiter is not None:
+            waiter, self._commit_waiter = self._commit_waiter, None
+            try:
+                await asyncio.wrap_future(self._submit_commit())
+            except asyncio.CancelledError:
+                waiter.cancel()
+                raise
+            except Exception as exception:
+                waiter.set_exception(exception)
+            else:
+                waiter.set_result(None)
+
+    async def _auto_commit_async(self):
+        if self.auto_commit and not self._undo_logs:
+            await self.commit_async()
+
+    @contextlib.contextmanager
+    def batch(self, commit=True):
+        # NOTE: writes of the other threads never join the batch
+        with self._lock.writer:
+            undo_log = {}
+            self._undo_logs.append(undo_log)
+            try:
+                yield self
+            except BaseException:
+                self._undo_logs.pop()
+                self._rollback(undo_log)
+                raise
+
+            self._undo_logs.pop()
+            if self._undo_logs:
+                # keep the original objects for the rollback of the outer batch
+                outer_undo_log = self._undo_logs[-1]
+                for kind, objects in undo_log.items():
+                    outer_objects = outer_undo_log.setdefault(kind, {})
+                    for object_id, obj in objects.items():
+                        outer_objects.setdefault(object_id, obj)
+            elif self.auto_commit and commit:
+                self.commit()
+
+    def _rollback(self, undo_log):
+        for kind, objects in undo_log.items():
+            table = self.table(kind)
+            for object_id, obj in objects.items():
+                table._replace(object_id, obj)
+                self._touch(kind, object_id)
 
     def table(self, kind):
-        if kind not in self._tables:
+        table = self._table_objects.get(kind, None)
+        if (table is not None
+                and table.dictionary is self._tables.get(kind, None)):
+            return table
+
+        if self._lock.holds_read():
+            # NOTE: no thread is writing while the read lock is held, e.g. in
+            # a query, so the tables are changed in the mutex instead of the
+            # write lock, which can not be acquired in the read lock
+            with self._table_mutex:
+                return self._load_table(kind)
+
+        with self._lock.writer:
+            with self._table_mutex:
+                return self._load_table(kind)
+
+    def _load_table(self, kind):
+        if kind in self._unloaded_kinds:
+            self._tables[kind] = self.storage.read_kind(kind)
+            self._unloaded_kinds.discard(kind)
+        elif kind not in self._tables:
             self._tables[kind] = {}
+            self._touch(kind)
+
+        dictionary = self._tables[kind]
+        table = self._table_objects.get(kind, None)
+        if table is None:
+            table = Table(kind, dictionary, self)
+            self._table_objects[kind] = table
+        elif table.dictionary is not dictionary:
+            table.dictionary = dictionary
 
-        table = Table(kind, self._tables[kind], self)
         return table
 
 
+def _write_async(method):
+    # NOTE: written in memory at once, then committed without blocking
+    @functools.wraps(method)
+    async def write_async(self, *args, **kwargs):
+        with self._batch(commit=False):
+            result = method(self, *args, **kwargs)
+
+        await self._auto_commit_async()
+        return result
+
+    write_async.__name__ = method.__name__ + '_async'
+    write_async.__qualname__ = method.__qualname__ + '_async'
+    return write_async
+
+
+def _read_async(method):
+    @functools.wraps(method)
+    async def read_async(self, *args, **kwargs):
+        return method(self, *args, **kwargs)
+
+    read_async.__name__ = method.__name__ + '_async'
+    read_async.__qualname__ = method.__qualname__ + '_async'
+    return read_async
+
+
 class Table(object):
-    def __init__(self, kind, dictionary=None, database=None):
+    def __init__(self, kind, dictionary=None, database=None, copy_policy=None,
+            id_generator=None):
         self.kind = kind
+        self.indexes = {}
+        # NOTE: the sorted ids for the pages of queries, see `Query.fetch_page`
+        self._id_index = indexes.IdIndex()
         if dictionary is None:
             self.dictionary = {}
         else:
@@ -34,24 +626,169 @@ class Table(object):
             self.dictionary = dictionary
 
         self.database = database
+        if copy_policy is not None:
+            _validate_copy_policy(copy_policy)
+        self._copy_policy = copy_policy
+        self._id_generator = id_generator
+
+    @property
+    def id_generator(self):
+        if self._id_generator is not None:
+            return self._id_generator
+        elif self.database and self.database.id_generator is not None:
+            return self.database.id_generator
+
+        return _default_id_generator
+
+    @property
+    def _lock(self):
+        if self.database:
+            return self.database._lock
+
+        return _null_lock
+
+    @property
+    def dictionary(self):
+        return self._dictionary
+
+    @dictionary.setter
+    def dictionary(self, dictionary):
+        self._dictionary = dictionary
+        self._id_index.reset()
+        for index in self.indexes.values():
+            index.build(dictionary)
+
+    def create_index(self, field, ordered=False, key=None):
+        index = self.indexes.get(field, None)
+        if ordered:
+            if (isinstance(index, indexes.OrderedIndex)
+                    and index.key is key):
+                return index
+            index = indexes.OrderedIndex(field, key=key)
+        else:
+            if isinstance(index, indexes.HashIndex):
+                return index
+            index = indexes.HashIndex(field)
+
+        with self._lock.writer:
+            index.build(self.dictionary)
+            self.indexes[field] = index
+
+        return index
+
+    def drop_index(self, field):
+        with self._lock.writer:
+            self.indexes.pop(field, None)
+
+    @property
+    def copy_policy(self):
+        if self._copy_policy is not None:
+            return self._copy_policy
+        elif self.database:
+            return self.database.copy_policy
+
+        return COPY_DEEP
+
+    def _copy_in(self, obj):
+        if self.copy_policy == COPY_SHALLOW:
+            return dict(obj)
+
+        # NOTE: read-only objects are still copied on write, or the caller can
+        # modify the stored one through its argument
+        return dict(copy.deepcopy(obj))
+
+    def _copy_out(self, obj):
+        copy_policy = self.copy_policy
+        if obj is None:
+            return None
+        elif copy_policy == COPY_DEEP:
+            return copy.deepcopy(obj)
+        elif copy_policy == COPY_SHALLOW:
+            return dict(obj)
+
+        return ReadOnlyDict(obj)
 
     def _auto_commit(self):
-        if self.database and self.database.auto_commit:
+        # NOTE: commit once when the outermost batch exits
+        if (self.database and self.database.auto_commit
+                and not self.database._undo_logs):
             self.database.commit()
 
+    def _batch(self, commit=True):
+        if self.database:
+            return self.database.batch(commit=commit)
+
+        return contextlib.nullcontext()
+
+    async def _auto_commit_async(self):
+        if self.database:
+            await self.database._auto_commit_async()
+
+    def _touch(self, object_id, old_obj):
+        if self.database:
+            self.database._save_undo(self.kind, object_id, old_obj)
+            self.database._touch(self.kind, object_id)
+
+    def _replace(self, object_id, obj):
+        dictionary = self.dictionary
+        old_obj = dictionary.get(object_id, None)
+        if self.indexes:
+            self._replace_indexed(object_id, obj, old_obj)
+
+        if obj is None:
+            dictionary.pop(object_id, None)
+        else:
+            dictionary[object_id] = obj
+        if old_obj is None:
+            if obj is not None:
+                self._id_index.add(object_id)
+        elif obj is None:
+            self._id_index.remove(object_id)
+
+        return old_obj
+
+    def _replace_indexed(self, object_id, obj, old_obj):
+        # NOTE: an index refuses an object, as an ordered index does a value
+        # incomparable with the others, then the indexes updated before are
+        # restored, and the dictionary is changed only if all of them succeed
+        removed, added = [], []
+        try:
+            for index in self.indexes.values():
+                if old_obj is not None:
+                    index.remove(object_id, old_obj)
+                    removed.append(index)
+                if obj is not None:
+                    index.add(object_id, obj)
+                    added.append(index)
+        except Exception:
+            for index in added:
+                index.remove(object_id, obj)
+            for index in removed:
+                index.add(object_id, old_obj)
+            raise
+
+    def _store_object(self, object_id, obj):
+        # NOTE: obj is stored as it is, and must not be referred by the caller
+        with self._lock.writer:
+            old_obj = self._replace(object_id, obj)
+            self._touch(object_id, old_obj)
+            self._auto_commit()
+
     def _set_object(self, object_id, obj):
-        self.dictionary[object_id] = dict(copy.deepcopy(obj))
-        self._auto_commit()
+        self._store_object(object_id, self._copy_in(obj))
 
     def _get_object(self, object_id):
-        return copy.deepcopy(self.dictionary.get(object_id, None))
+        with self._lock.reader:
+            return self._copy_out(self.dictionary.get(object_id, None))
 
     def _delete_object(self, object_id):
-        try:
-            del self.dictionary[object_id]
+        with self._lock.writer:
+            if object_id not in self.dictionary:
+                return
+
+            old_obj = self._replace(object_id, None)
+            self._touch(object_id, old_obj)
             self._auto_commit()
-        except KeyError:
-            pass
 
     def _do_validate_id(self, object_id):
         if object_id not in self.dictionary:
@@ -61,36 +798,60 @@ class Table(object):
 
     @classmethod
     def _next_id(cls):
-        return str(int(datetime.datetime.now().timestamp() * 1000000))
+        return _default_id_generator.next_id()
+
+    def _next_ids(self, size):
+        id_generator = self.id_generator
+        object_ids = id_generator.next_ids(size)
+        dictionary = self.dictionary
+        for i, object_id in enumerate(object_ids):
+            # NOTE: never overwrite, e.g. objects inserted by another generator
+            while object_id in dictionary:
+                object_id = id_generator.next_id()
+            object_ids[i] = object_id
+
+        return object_ids
 
     def insert(self, obj):
-        object_id = self.__class__._next_id()
-        self._set_object(object_id, obj)
+        with self._lock.writer:
+            object_id = self._next_ids(1)[0]
+            self._set_object(object_id, obj)
+
         return object_id
 
     def insert_multi(self, objects):
-        return [self.insert(obj) for obj in objects]
+        objects = list(objects)
+        with self._batch():
+            object_ids = self._next_ids(len(objects))
+            for object_id, obj in zip(object_ids, objects):
+                self._set_object(object_id, obj)
+
+        return object_ids
 
     def get(self, object_id):
         return self._get_object(object_id)
 
     def get_multi(self, object_ids):
-        return [self.get(object_id) for object_id in object_ids]
+        with self._lock.reader:
+            return [self.get(object_id) for object_id in object_ids]
 
     def update(self, object_id, obj):
-        self._do_validate_id(object_id)
-        self._set_object(object_id, obj)
+        with self._lock.writer:
+            self._do_validate_id(object_id)
+            self._set_object(object_id, obj)
+
         return object_id
 
     def update_multi(self, object_ids, objects):
         if len(object_ids) != len(objects):
             raise ValueError("size of object_ids and objects must be the same")
 
-        for object_id in object_ids:
-            self._do_validate_id(object_id)
+        with self._batch():
+            for object_id in object_ids:
+                self._do_validate_id(object_id)
 
-        for object_id, obj in zip(object_ids, objects):
-            self._set_object(object_id, obj)
+            for object_id, obj in zip(object_ids, objects):
+                self._set_object(object_id, obj)
 
         return object_ids
 
@@ -102,37 +863,703 @@ class Table(object):
         if len(object_ids) != len(objects):
             raise ValueError("size of object_ids and objects must be the same")
 
-        for object_id, obj in zip(object_ids, objects):
-            self._set_object(object_id, obj)
+        with self._batch():
+            for object_id, obj in zip(object_ids, objects):
+                self._set_object(object_id, obj)
 
         return object_ids
 
     def delete(self, object_id, ignore_exception=False):
-        if not ignore_exception:
-            self._do_validate_id(object_id)
+        with self._lock.writer:
+            if not ignore_exception:
+                self._do_validate_id(object_id)
 
-        self._delete_object(object_id)
+            self._delete_object(object_id)
 
     def delete_multi(self, object_ids):
-        for object_id in object_ids:
-            self._do_validate_id(object_id)
+        with self._batch():
+            for object_id in object_ids:
+                self._do_validate_id(object_id)
+
+            for object_id in object_ids:
+                self._delete_object(object_id)
+
+    insert_async = _write_async(insert)
+    insert_multi_async = _write_async(insert_multi)
+    get_async = _read_async(get)
+    get_multi_async = _read_async(get_multi)
+    update_async = _write_async(update)
+    update_multi_async = _write_async(update_multi)
+    update_or_insert_async = _write_async(update_or_insert)
+    update_or_insert_multi_async = _write_async(update_or_insert_multi)
+    delete_async = _write_async(delete)
+    delete_multi_async = _write_async(delete_multi)
+
+    def query(self, test_func=_accept_all):
+        lock = self._lock if self.database and self.database.thread_safe else None
+        return Query(self.dictionary, test_func, copy_policy=self.copy_policy,
+                indexes=self.indexes, lock=lock, id_index=self._id_index)
+
+    def iter_export(self):
+        # NOTE: the items are listed in the lock, but the lines are encoded
+        # one by one out of it, see `storages.JsonLinesStorage`
+        with self._lock.reader:
+            items = list(self.dictionary.items())
+
+        encode_line = storages.JsonLinesStorage.encode_line
+        for object_id, obj in items:
+            yield encode_line(self.kind, object_id, obj)
+
+
+_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+_RANGE_OPERATORS = ('<', '<=', '>', '>=')
+# guessed fraction of the matched objects of each operator
+_SELECTIVITIES = {
+    '==': 0.1,
+    '!=': 0.9,
+    '<': 0.3,
+    '<=': 0.3,
+    '>': 0.3,
+    '>=': 0.3,
+}
+
+
+def _bounds(condition):
+    if condition.op in ('>', '>='):
+        return {'lower': condition.value,
+                'include_lower': condition.op == '>='}
+    return {'upper': condition.value, 'include_upper': condition.op == '<='}
+
+
+# NOTE: the objects are tested in chunks of at least this size, so that the
+# cost of pickling and scheduling a chunk is amortized over its objects
+_MIN_CHUNK_SIZE = 256
+# chunks per worker, for balancing the workers
+_CHUNKS_PER_WORKER = 4
+# executors of parallel queries, as {(is_process, max_workers): executor}
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _get_query_executor(is_process, max_workers):
+    with _executors_lock:
+        executor = _executors.get((is_process, max_workers), None)
+        if executor is None:
+            if is_process:
+                executor = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=max_workers)
+            else:
+                executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=max_workers,
+                        thread_name_prefix='pydictdb-query')
+            _executors[(is_process, max_workers)] = executor
+
+        return executor
 
-        for object_id in object_ids:
-            self._delete_object(object_id)
 
-    def query(self, test_func=lambda obj: True):
-        return Query(self.dictionary, test_func)
+def _picklable(value):
+    try:
+        pickle.dumps(value)
+    except Exception:
+        return False
+
+    return True
+
+
+def _test_chunk(test_funcs, convert, items):
+    # NOTE: run in a worker, and only the positions of matches are returned
+    positions = []
+    for position, item in enumerate(items):
+        value = convert(item)
+        if all(test_func(value) for test_func in test_funcs):
+            positions.append(position)
+
+    return positions
+
+
+def _copy_item(copy_func, item):
+    return copy_func(item[1])
+
+
+def _iter_positions_in_parallel(items, test_funcs, convert, parallel,
+        copied=False):
+    # NOTE: items are tested in a process pool if the functions can be
+    # pickled, otherwise in a thread pool, and the positions of the matches
+    # are yielded in order; a converting function which only copies the
+    # object or views it read-only is skipped in processes, where the objects
+    # are copies already
+    chunk_size = max(_MIN_CHUNK_SIZE,
+            -(-len(items) // (parallel * _CHUNKS_PER_WORKER)))
+    if len(items) <= chunk_size:
+        yield from _test_chunk(test_funcs, convert, items)
+        return
+
+    if copied:
+        process_convert = operator.itemgetter(1)
+    else:
+        process_convert = convert
+    if _picklable((test_funcs, process_convert)):
+        executor = _get_query_executor(True, parallel)
+        convert = process_convert
+    else:
+        executor = _get_query_executor(False, parallel)
+
+    starts = range(0, len(items), chunk_size)
+    futures = [executor.submit(_test_chunk, test_funcs, convert,
+            items[start:start + chunk_size]) for start in starts]
+    try:
+        for start, future in zip(starts, futures):
+            for position in future.result():
+                yield start + position
+    finally:
+        # NOTE: the chunks not started are cancelled once enough are matched
+        for future in futures:
+            future.cancel()
+
+
+def _encode_cursor(position):
+    # NOTE: opaque to users, but only the position of the last object is
+    # kept, so a cursor is valid after the objects are changed
+    data = json.dumps(position, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def _decode_cursor(cursor, size):
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (AttributeError, ValueError):
+        position = None
+    if not isinstance(position, list) or len(position) != size:
+        raise ValueError("invalid cursor %r" % (cursor,))
+
+    return position
+
+
+def _iter_by_id(dictionary, object_ids, start=None):
+    # NOTE: the candidate ids of an index after the start are heapified, and
+    # the objects are read when popped in order, so a page costs O(m)
+    # comparisons of the m candidates but O(k log m) reads and tests
+    heap = [(id_key, object_id) for id_key, object_id
+            in ((indexes._id_key(object_id), object_id)
+                for object_id in object_ids)
+            if start is None or id_key > start]
+    heapq.heapify(heap)
+    while heap:
+        object_id = heapq.heappop(heap)[1]
+        obj = dictionary.get(object_id, None)
+        if obj is not None:
+            yield object_id, obj
+
+
+# ids_func: callable to get the candidate ids
+# ordered_field: the field the candidate ids are ordered by, if any
+# condition: the condition all of the candidates match, if any
+_Plan = collections.namedtuple('_Plan',
+        ['estimate', 'ids_func', 'ordered_field', 'condition'])
+
+
+class Condition(object):
+    def __init__(self, field, op, value, key=None):
+        if op not in _OPERATORS:
+            raise ValueError("invalid operator '%s'" % op)
+        if op in _RANGE_OPERATORS and value is None:
+            raise ValueError("operator '%s' does not support None" % op)
+
+        self.field = field
+        self.op = op
+        self.value = value
+        self.key = key
+        self._func = _OPERATORS[op]
+        if key is None or value is None:
+            self._key_value = value
+        else:
+            self._key_value = key(value)
+
+    def __repr__(self):
+        return '<%s(%s %s %s)>' % (self.__class__.__name__, self.field,
+                self.op, repr(self.value))
+
+    def match(self, obj):
+        # NOTE: match any value of a repeated field
+        for value in indexes.field_values(obj, self.field):
+            if value is None:
+                if self.op in _RANGE_OPERATORS:
+                    continue
+                matched = self._func(value, self.value)
+            else:
+                if self.key is not None:
+                    value = self.key(value)
+                try:
+                    matched = self._func(value, self._key_value)
+                except TypeError:
+                    continue
+
+            if matched:
+                return True
+
+        return False
 
 
 class Query(object):
-    def __init__(self, dictionary, test_func=lambda obj: True):
+    def __init__(self, dictionary, test_func=_accept_all,
+            copy_policy=COPY_DEEP, indexes=None, lock=None, id_index=None):
         self.dictionary = dictionary
         self.test_func = test_func
+        _validate_copy_policy(copy_policy)
+        self.copy_policy = copy_policy
+        self.indexes = indexes or {}
+        self.conditions = []
+        # callables tested on the objects after the conditions
+        self.predicates = []
+        # (field, reverse, key) to order by
+        self.order = None
+        # read lock of the dictionary, see `locks.ReadWriteLock`
+        self.lock = lock
+        # sorted ids of the dictionary, see `indexes.IdIndex`
+        self.id_index = id_index
+        # ordered by id if not ordered by a field, and started after the
+        # position of a cursor, see `fetch_page`
+        self._paged = False
+        self._start = None
+        self._page_size = None
+
+    def filter(self, *conditions):
+        for condition in conditions:
+            if isinstance(condition, Condition):
+                self.conditions.append(condition)
+            elif callable(condition):
+                self.predicates.append(condition)
+            else:
+                raise TypeError("condition type '%s' is not allowed" % (
+                        type(condition).__name__))
+        return self
+
+    def equal(self, field, value, key=None):
+        self.conditions.append(Condition(field, '==', value, key=key))
+        return self
+
+    def range(self, field, lower=None, upper=None, include_lower=True,
+            include_upper=False, key=None):
+        if lower is not None:
+            op = '>=' if include_lower else '>'
+            self.conditions.append(Condition(field, op, lower, key=key))
+        if upper is not None:
+            op = '<=' if include_upper else '<'
+            self.conditions.append(Condition(field, op, upper, key=key))
+        return self
+
+    def order_by(self, field, reverse=False, key=None):
+        self.order = (field, reverse, key)
+        return self
+
+    def _copy_func(self):
+        if self.copy_policy == COPY_DEEP:
+            return copy.deepcopy
+        elif self.copy_policy == COPY_SHALLOW:
+            return dict
+
+        return ReadOnlyDict
+
+    def _estimate(self, condition):
+        # NOTE: estimated number of the matched objects, guessed by operator
+        # if the field is not indexed
+        index = self.indexes.get(condition.field, None)
+        size = len(self.dictionary)
+        if index is not None and not (condition.value is None
+                and isinstance(index, indexes.OrderedIndex)):
+            if condition.op == '==':
+                return index.count(condition.value)
+            elif condition.op == '!=':
+                return size - index.count(condition.value)
+            elif isinstance(index, indexes.OrderedIndex):
+                return index.count_range(**_bounds(condition))
 
-    def fetch(self, ids_only=False):
-        dictionary = copy.deepcopy(self.dictionary)
-        if ids_only:
-            return [object_id for object_id, obj in dictionary.items()
-                    if self.test_func(obj)]
+        return size * _SELECTIVITIES[condition.op]
+
+    def _plan(self):
+        # NOTE: candidate ids can be a superset, since the conditions not
+        # covered by the index are tested on the candidates, the fewest
+        # estimated ones win
+        order_field, reverse = None, False
+        if self.order is not None:
+            order_field, reverse = self.order[:2]
+
+        best = None
+        bounds_of_fields = {}
+        for condition in self.conditions:
+            index = self.indexes.get(condition.field, None)
+            if index is None:
+                continue
+
+            ordered = isinstance(index, indexes.OrderedIndex)
+            if condition.op == '==' and not (ordered and condition.value is None):
+                estimate = index.count(condition.value)
+                if best is None or estimate < best.estimate:
+                    best = _Plan(estimate, functools.partial(
+                            index.lookup, condition.value), None, condition)
+            elif ordered and condition.op in _RANGE_OPERATORS:
+                bounds_of_fields.setdefault(condition.field, {}).update(
+                        _bounds(condition))
+
+        index = self.indexes.get(order_field, None)
+        if (isinstance(index, indexes.OrderedIndex)
+                and order_field not in bounds_of_fields):
+            bounds_of_fields[order_field] = {}
+
+        for field, bounds in bounds_of_fields.items():
+            index = self.indexes[field]
+            estimate = index.count_range(**bounds)
+            if (best is None or estimate < best.estimate
+                    or (estimate == best.estimate and field == order_field)):
+                best = _Plan(estimate, functools.partial(index.range,
+                        reverse=(field == order_field and reverse), **bounds),
+                        field, None)
+
+        return best
+
+    def _iter_matches(self):
+        plan = self._plan()
+        if self._paged:
+            plan = self._paged_plan(plan)
+        dictionary = self.dictionary
+        if self._paged and self.order is None and plan is None:
+            id_index = self.id_index
+            if id_index is None:
+                id_index = indexes.IdIndex()
+            id_index.ensure_built(dictionary)
+            items = ((object_id, dictionary.get(object_id, None))
+                    for object_id in id_index.range(self._start))
+        elif self._paged and self.order is None:
+            items = _iter_by_id(dictionary, plan.ids_func(), self._start)
+        elif plan is None:
+            items = dictionary.items()
         else:
-            return [obj for obj in dictionary.values() if self.test_func(obj)]
+            items = ((object_id, dictionary.get(object_id, None))
+                    for object_id in plan.ids_func())
+
+        # NOTE: test the most selective conditions first
+        conditions = sorted((condition for condition in self.conditions
+                if plan is None or condition is not plan.condition),
+                key=self._estimate)
+        matches = ((object_id, obj) for object_id, obj in items
+                if obj is not None
+                and all(condition.match(obj) for condition in conditions))
+        if self.order is not None and (plan is None
+                or plan.ordered_field != self.order[0]):
+            matches = self._sort(matches)
+        if self._paged and self.order is not None and self._start is not None:
+            matches = self._iter_after(matches)
+
+        return matches
+
+    def _order_value(self, obj):
+        # NOTE: the sort key and the value to order an object by, the
+        # smallest one of a repeated field, or the largest one if reversed
+        field, reverse, key = self.order
+        values = [(value if key is None else key(value), value)
+                for value in indexes.field_values(obj, field)
+                if value is not None]
+        if not values:
+            return None
+
+        extreme = max if reverse else min
+        return extreme(values, key=operator.itemgetter(0))
+
+    def _iter_after(self, items):
+        reverse = self.order[1]
+        for object_id, obj in items:
+            position = (self._order_value(obj)[0], indexes._id_key(object_id))
+            if position < self._start if reverse else position > self._start:
+                yield object_id, obj
+
+    def _sort(self, items):
+        # NOTE: objects without any value of the field are excluded, as the
+        # ordered index does
+        reverse = self.order[1]
+        sortable_items = []
+        for object_id, obj in items:
+            order_value = self._order_value(obj)
+            if order_value is None:
+                continue
+
+            sortable_items.append((order_value[0], indexes._id_key(object_id),
+                    object_id, obj))
+
+        sortable_items.sort(key=lambda item: item[:2], reverse=reverse)
+        return ((object_id, obj) for _, _, object_id, obj in sortable_items)
+
+    def _test_funcs(self):
+        return [test_func for test_func in [self.test_func] + self.predicates
+                if test_func is not _accept_all]
+
+    def _iter_tested(self):
+        # NOTE: test_func gets a read-only view of the stored object, so that
+        # only the matches are copied, and the dictionary is never changed
+        test_funcs = self._test_funcs()
+        if not test_funcs:
+            yield from self._iter_matches()
+            return
+
+        for object_id, obj in self._iter_matches():
+            view = ReadOnlyDict(obj)
+            if all(test_func(view) for test_func in test_funcs):
+                yield object_id, obj
+
+    def _read_locked(self):
+        return (self.lock or _null_lock).reader
+
+    def _iter_locked(self, items):
+        if self.lock is None:
+            return items
+
+        # NOTE: iterated at once, so that the lock is never held by an
+        # unfinished iteration, and the stored objects are replaced but not
+        # modified by writes, so they are read out of the lock
+        with self.lock.reader:
+            return iter(list(items))
+
+    def _iter(self, ids_only):
+        copy_func = self._copy_func()
+        for object_id, obj in self._iter_tested():
+            yield object_id if ids_only else copy_func(obj)
+
+    def iter(self, ids_only=False):
+        return self._iter_locked(self._iter(ids_only))
+
+    def _iter_parallel(self, parallel, test_funcs, convert, copied=False):
+        # NOTE: the matches of the conditions are listed in the lock, then
+        # tested by the functions out of it
+        with self._read_locked():
+            items = list(self._iter_matches())
+
+        positions = _iter_positions_in_parallel(items, test_funcs, convert,
+                parallel, copied=copied)
+        try:
+            for position in positions:
+                yield items[position]
+        finally:
+            positions.close()
+
+    def fetch(self, ids_only=False, limit=None, offset=0, parallel=None):
+        stop = None if limit is None else offset + limit
+        test_funcs = self._test_funcs()
+        if parallel is not None and test_funcs:
+            copy_func = self._copy_func()
+            matches = self._iter_parallel(parallel, test_funcs,
+                    functools.partial(_copy_item, ReadOnlyDict), copied=True)
+            try:
+                return [object_id if ids_only else copy_func(obj)
+                        for object_id, obj
+                        in itertools.islice(matches, offset, stop)]
+            finally:
+                matches.close()
+
+        with self._read_locked():
+            return list(itertools.islice(self._iter(ids_only), offset, stop))
+
+    def _paged_plan(self, plan):
+        # NOTE: a page scans the sorted ids or the ordered index of the order
+        # from the cursor, testing about k * n / m objects for the m
+        # candidates of another index, unless sorting the m candidates costs
+        # less, so a page never costs more than O(sqrt(k * n))
+        if plan is None or (self.order is not None
+                and plan.ordered_field == self.order[0]):
+            return plan
+        elif plan.estimate ** 2 <= len(self.dictionary) * self._page_size:
+            return plan
+        elif self.order is None:
+            return None
+
+        field, reverse, _ = self.order
+        bounds = {}
+        for condition in self.conditions:
+            if condition.field == field and condition.op in _RANGE_OPERATORS:
+                bounds.update(_bounds(condition))
+        index = self.indexes[field]
+        return _Plan(index.count_range(**bounds), functools.partial(index.range,
+                reverse=reverse, **bounds), field, None)
+
+    def _paged_query(self, start_cursor, page_size):
+        if self.order is not None and not isinstance(
+                self.indexes.get(self.order[0], None), indexes.OrderedIndex):
+            raise ValueError("pages ordered by field '%s' need an ordered "
+                    "index of it" % self.order[0])
+
+        query = copy.copy(self)
+        query.conditions = list(self.conditions)
+        query._paged = True
+        query._page_size = page_size
+        if start_cursor is None:
+            return query
+
+        if self.order is None:
+            object_id, = _decode_cursor(start_cursor, 1)
+            query._start = indexes._id_key(object_id)
+            return query
+
+        field, reverse, key = self.order
+        value, object_id = _decode_cursor(start_cursor, 2)
+        query._start = (value if key is None else key(value),
+                indexes._id_key(object_id))
+        # NOTE: seek the index to the cursor, the objects of the same value
+        # before it are skipped by `_iter_after`
+        query.conditions.append(Condition(field, '<=' if reverse else '>=',
+                value, key=key))
+
+        return query
+
+    def _cursor(self, object_id, obj):
+        if self.order is None:
+            return _encode_cursor([object_id])
+
+        return _encode_cursor([self._order_value(obj)[1], object_id])
+
+    def fetch_page(self, page_size, start_cursor=None, ids_only=False):
+        query = self._paged_query(start_cursor, page_size + 1)
+        with self._read_locked():
+            items = list(itertools.islice(query._iter_tested(), page_size + 1))
+
+        more = len(items) > page_size
+        items = items[:page_size]
+        cursor = query._cursor(*items[-1][:2]) if items else None
+        copy_func = self._copy_func()
+        results = [object_id if ids_only else copy_func(obj)
+                for object_id, obj in items]
+        return results, cursor, more
+
+    def _extreme(self, field, key, reverse):
+        with self._read_locked():
+            return self._find_extreme(field, key, reverse)
+
+    def _find_extreme(self, field, key, reverse):
+        index = self.indexes.get(field, None)
+        ordered = isinstance(index, indexes.OrderedIndex)
+        if ordered:
+            if (not self.conditions and not self.predicates
+                    and self.test_func is _accept_all):
+                return index.max() if reverse else index.min()
+
+            # NOTE: the first object in order has the extreme value
+            query = copy.copy(self)
+            query.order_by(field, reverse=reverse, key=key)
+            objects = (obj for _, obj in query._iter_tested())
+        else:
+            objects = (obj for _, obj in self._iter_tested())
+
+        extreme_value, extreme_key = None, None
+        for obj in objects:
+            for value in indexes.field_values(obj, field):
+                if value is None:
+                    continue
+
+                value_key = value if key is None else key(value)
+                if (extreme_key is None
+                        or (value_key > extreme_key if reverse
+                            else value_key < extreme_key)):
+                    extreme_value, extreme_key = value, value_key
+
+            if ordered:
+                break
+
+        return extreme_value
+
+    def min(self, field, key=None):
+        return self._extreme(field, key, reverse=False)
+
+    def max(self, field, key=None):
+        return self._extreme(field, key, reverse=True)
+
+    def _iter_unordered(self):
+        # NOTE: the aggregates read the stored objects in place, in any order
+        query = copy.copy(self)
+        query.order = None
+        return (obj for _, obj in query._iter_tested())
+
+    def _count_by_index(self):
+        # NOTE: counted by the index only if it covers all of the conditions,
+        # and the counts of values are the numbers of objects
+        if not self.conditions or self._test_funcs():
+            return None
+
+        field = self.conditions[0].field
+        index = self.indexes.get(field, None)
+        if index is None or any(condition.field != field
+                for condition in self.conditions):
+            return None
+
+        ordered = isinstance(index, indexes.OrderedIndex)
+        if ordered and (index.multi_valued or any(condition.key != index.key
+                for condition in self.conditions)):
+            return None
+
+        if len(self.conditions) == 1 and self.conditions[0].op == '==':
+            value = self.conditions[0].value
+            if ordered and value is None:
+                return None
+            return index.count(value)
+
+        bounds = {}
+        for condition in self.conditions:
+            if not ordered or condition.op not in _RANGE_OPERATORS:
+                return None
+
+            condition_bounds = _bounds(condition)
+            if bounds.keys() & condition_bounds.keys():
+                return None
+            bounds.update(condition_bounds)
+
+        return index.count_range(**bounds)
+
+    def count(self):
+        with self._read_locked():
+            count = self._count_by_index()
+            if count is not None:
+                return count
+            elif not self.conditions and not self._test_funcs():
+                return len(self.dictionary)
+
+            return sum(1 for _ in self._iter_unordered())
+
+    def sum(self, field):
+        total = 0
+        with self._read_locked():
+            for obj in self._iter_unordered():
+                for value in indexes.field_values(obj, field):
+                    if value is not None:
+                        total += value
+
+        return total
+
+    def group_by(self, field):
+        return GroupBy(self, field)
+
+
+class GroupBy(object):
+    def __init__(self, query, field):
+        self.query = query
+        self.field = field
+
+    def count(self):
+        # NOTE: the numbers of objects of each value, where an object of a
+        # repeated field is counted once for each value it contains
+        query = self.query
+        with query._read_locked():
+            index = query.indexes.get(self.field, None)
+            if (isinstance(index, indexes.HashIndex) and not query.conditions
+                    and not query._test_funcs()):
+                return index.counts()
+
+            counts = {}
+            for obj in query._iter_unordered():
+                for value in {indexes._hashable(value) for value
+                        in indexes.field_values(obj, self.field)}:
+                    counts[value] = counts.get(value, 0) + 1
+
+            return counts
@@ -1,15 +1,42 @@
+import collections
 import copy
 import datetime
+import functools
+import itertools
+import threading
+import types
 from . import core
+from . import indexes
 
 
 _database_in_use = core.Database()
+# NOTE: the cache of models got by keys, see `set_cache`
+_model_cache = None
+# NOTE: the latest defined class of a kind, registered on class creation
+_model_classes = {}
+_MISSING = object()
+# NOTE: default values which are never mutated, so not copied
+_immutable_classes = (type(None), bool, int, float, str, datetime.date)
+
+
+def _accept_all(model):
+    return True
+
+
+def _owner(cls, name):
+    # NOTE: the class where the attribute is defined
+    for _class in cls.__mro__:
+        if name in vars(_class):
+            return _class
 
 
 class Attribute(object):
     _allowed_classes = []
+    # NOTE: values of an ordered attribute are indexed in order
+    _ordered = False
 
-    def __init__(self, choices=None, default=None, repeated=False, kept=True):
+    def __init__(self, choices=None, default=None, repeated=False, kept=True,
+            indexed=False):
         self.repeated = repeated
         # FIXME: prevent unneeded error when default is not provided if repeated
         if repeated and default is None:
@@ -33,8 +60,51 @@ class Attribute(object):
         self._do_validate_value(default)
         self.default = default
         self.kept = bool(kept)
+        self.indexed = bool(indexed)
+        # NOTE: set on the creation of the owner class
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        # NOTE: the value is not set or deleted in the instance
+        return self.get_default()
+
+    def _condition(self, op, value):
+        if self.name is None:
+            return NotImplemented
+
+        # NOTE: match any value of a repeated attribute
+        return core.Condition(self.name, op, self._post_encode(value),
+                key=self._get_order_key())
+
+    def __eq__(self, value):
+        return self._condition('==', value)
+
+    def __ne__(self, value):
+        return self._condition('!=', value)
+
+    def __lt__(self, value):
+        return self._condition('<', value)
+
+    def __le__(self, value):
+        return self._condition('<=', value)
+
+    def __gt__(self, value):
+        return self._condition('>', value)
+
+    def __ge__(self, value):
+        return self._condition('>=', value)
+
+    __hash__ = object.__hash__
 
     def get_default(self):
+        if not self.repeated and isinstance(self.default, _immutable_classes):
+            return self.default
         return copy.deepcopy(self.default)
 
     def validate_value(self, value):
@@ -62,6 +132,9 @@ class Attribute(object):
         else:
             self.validate_value(value)
 
+    def _get_order_key(self):
+        return None
+
     def _post_decode(self, generic_value):
         return generic_value
 
@@ -74,6 +147,18 @@ class Attribute(object):
     def _post_encode(self, value):
         return value
 
+    def _get_value_decoder(self):
+        # NOTE: None if the stored values are taken as they are
+        if _owner(type(self), '_post_decode') is Attribute:
+            return None
+        return self._post_decode
+
+    def _get_value_encoder(self):
+        # NOTE: None if the values are stored as they are
+        if _owner(type(self), '_post_encode') is Attribute:
+            return None
+        return self._post_encode
+
     def encode(self, value):
         if self.repeated:
             return [self._post_encode(val) for val in value]
@@ -91,6 +176,7 @@ class BooleanAttribute(Attribute):
 
 class IntegerAttribute(Attribute):
     _allowed_classes = [int]
+    _ordered = True
 
     def validate_value(self, value):
         # FIXME: isinstance(bool(), int) returns True
@@ -102,6 +188,7 @@ class IntegerAttribute(Attribute):
 
 class FloatAttribute(Attribute):
     _allowed_classes = [float]
+    _ordered = True
 
 
 class StringAttribute(Attribute):
@@ -111,11 +198,22 @@ class StringAttribute(Attribute):
 # NOTE: issubclass(datetime.datetime, datetime.date) returns True
 class DateAttribute(Attribute):
     _allowed_classes = [datetime.date]
+    _ordered = True
+    # formats whose encoded values are in the same order as the values
+    _sortable_formats = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f')
+    # formats converted by the ISO functions, as {format: (timespec, length)}
+    _iso_class = datetime.date
+    _iso_formats = {'%Y-%m-%d': (None, 10)}
 
     def __init__(self, fmt='%Y-%m-%d', **kwargs):
         super().__init__(**kwargs)
         self.fmt = fmt
 
+    def _get_order_key(self):
+        if self.fmt in self._sortable_formats:
+            return None
+        return self._post_decode
+
     def _post_decode(self, generic_value):
         if generic_value is None:
             return None
@@ -126,8 +224,64 @@ class DateAttribute(Attribute):
             return None
         return datetime.datetime.strftime(value, self.fmt)
 
+    def _is_iso_format(self, func_name):
+        # NOTE: the conversion is not overridden since the formats are defined
+        iso_owner = _owner(type(self), '_iso_formats')
+        func_owner = _owner(type(self), func_name)
+        return self.fmt in self._iso_formats and (func_owner is iso_owner
+                or not issubclass(func_owner, iso_owner))
+
+    def _get_value_decoder(self):
+        post_decode = self._post_decode
+        if not self._is_iso_format('_post_decode'):
+            return super()._get_value_decoder()
+
+        length = self._iso_formats[self.fmt][1]
+        fromisoformat = self._iso_class.fromisoformat
+
+        def decode(generic_value):
+            if generic_value.__class__ is str and len(generic_value) == length:
+                try:
+                    return fromisoformat(generic_value)
+                except ValueError:
+                    pass
+
+            return post_decode(generic_value)
+
+        return decode
+
+    def _get_value_encoder(self):
+        post_encode = self._post_encode
+        if not self._is_iso_format('_post_encode'):
+            return super()._get_value_encoder()
+
+        timespec = self._iso_formats[self.fmt][0]
+        iso_class = self._iso_class
+
+        # NOTE: strftime neither pads years before 1000 nor keeps time zone
+        def encode_date(value):
+            if value.__class__ is iso_class and value.year >= 1000:
+                return value.isoformat()
+
+            return post_encode(value)
+
+        def encode_datetime(value):
+            if (value.__class__ is iso_class and value.tzinfo is None
+                    and value.year >= 1000):
+                return value.isoformat(' ', timespec)
+
+            return post_encode(value)
+
+        return encode_date if timespec is None else encode_datetime
+
 
 class DatetimeAttribute(DateAttribute):
+    _iso_class = datetime.datetime
+    _iso_formats = {
+        '%Y-%m-%d %H:%M:%S': ('seconds', 19),
+        '%Y-%m-%d %H:%M:%S.%f': ('microseconds', 26),
+    }
+
     def __init__(self, fmt='%Y-%m-%d %H:%M:%S.%f', **kwargs):
         super().__init__(fmt=fmt, **kwargs)
 
@@ -138,12 +292,19 @@ class DatetimeAttribute(DateAttribute):
 
 
 class BaseObject(object):
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         for kw in kwargs:
             setattr(self, kw, kwargs[kw])
 
+    def _get_fields(self):
+        # NOTE: the fields set in the object, as {name: value}
+        return vars(self)
+
     def __eq__(self, other):
-        return type(self) == type(other) and self.__dict__ == other.__dict__
+        return (type(self) == type(other)
+                and self._get_fields() == other._get_fields())
 
     def __ne__(self, other):
         return (not self.__eq__(other))
@@ -152,7 +313,7 @@ class BaseObject(object):
         cls = self.__class__
         cls_str = '%s.%s' % (cls.__module__, cls.__name__)
 
-        self_dict = self.__dict__
+        self_dict = self._get_fields()
         prop_list = []
         keys = sorted(self_dict.keys())
         for k in keys:
@@ -166,7 +327,7 @@ class BaseObject(object):
         return '<%s(%s)>' % (cls_str, prop_str)
 
     def to_dict(self, include=None, exclude=None):
-        self_dict = self.__dict__
+        self_dict = self._get_fields()
         keywords = set(self_dict.keys())
         if include is not None:
             keywords = keywords & set(include)
@@ -177,22 +338,302 @@ class BaseObject(object):
         return {k: self_dict[k] for k in keywords}
 
 
-class Model(BaseObject):
+def _convert_expr(converter, repeated, value='value'):
+    if converter is None:
+        # NOTE: a new list, or the list is shared with the stored object
+        return 'list(%s)' % value if repeated else value
+    elif repeated:
+        return '[%s(val) for val in %s]' % (converter, value)
+
+    return '%s(%s)' % (converter, value)
+
+
+def _compile(lines, name, namespace):
+    source = '\n'.join(lines)
+    exec(compile(source, '<pydictdb.db %s>' % name, 'exec'), namespace)
+    return namespace[name]
+
+
+def _compile_encoder(attributes):
+    """Generate the function to encode the values of a model to the object
+    to be stored, as ``encode(values)``.
+    """
+    namespace = {'_MISSING': _MISSING}
+    exprs = {}
+    for i, (name, attr) in enumerate(attributes.items()):
+        namespace['attr_%d' % i] = attr
+        encoder = attr._get_value_encoder()
+        if encoder is not None:
+            namespace['encode_%d' % i] = encoder
+        exprs[name] = (i, encoder and 'encode_%d' % i, attr.repeated)
+
+    # NOTE: all of the values are set in a model unless deleted
+    lines = ['def encode(values):', '    try:', '        return {']
+    lines += ['            %r: %s,' % (name, _convert_expr(
+            converter, repeated, 'values[%r]' % name))
+            for name, (i, converter, repeated) in exprs.items()]
+    lines += ['        }', '    except KeyError:', '        pass', '    obj = {}']
+    for name, (i, converter, repeated) in exprs.items():
+        lines += [
+            '    value = values.get(%r, _MISSING)' % name,
+            '    if value is _MISSING:',
+            '        value = attr_%d.get_default()' % i,
+            '    obj[%r] = %s' % (name, _convert_expr(converter, repeated)),
+        ]
+
+    lines.append('    return obj')
+    return _compile(lines, 'encode', namespace)
+
+
+def _compile_decoder(attributes, kept_attributes, keep_unknown=True):
+    """Generate the function to decode a stored object to the values of a
+    model, as ``decode(obj)``. The stored object is never referred by the
+    values, so it is read without copy. Fields not in the schema are kept if
+    ``keep_unknown``.
+    """
+    namespace = {'_MISSING': _MISSING, '_deepcopy': copy.deepcopy}
+    exprs = {}
+    for i, (name, attr) in enumerate(attributes.items()):
+        namespace['attr_%d' % i] = attr
+        decoder = attr._get_value_decoder()
+        if decoder is not None:
+            namespace['decode_%d' % i] = decoder
+        exprs[name] = (i, decoder and 'decode_%d' % i, attr.repeated)
+
+    kept_exprs = {name: expr for name, expr in exprs.items()
+            if name in kept_attributes}
+    # NOTE: all of the kept values are stored unless the schema is changed
+    lines = ['def decode(obj):', '    try:', '        values = {']
+    lines += ['            %r: %s,' % (name, _convert_expr(
+            converter, repeated, 'obj[%r]' % name))
+            for name, (i, converter, repeated) in kept_exprs.items()]
+    lines += [
+        '        }',
+        '        found = %d' % len(kept_exprs),
+        '    except KeyError:',
+        '        values = {}',
+        '        found = 0',
+    ]
+    for name, (i, converter, repeated) in kept_exprs.items():
+        lines += [
+            '        value = obj.get(%r, _MISSING)' % name,
+            '        if value is _MISSING:',
+            '            values[%r] = attr_%d.get_default()' % (name, i),
+            '        else:',
+            '            found += 1',
+            '            values[%r] = %s' % (name, _convert_expr(
+                    converter, repeated)),
+        ]
+
+    lines += ['    values[%r] = attr_%d.get_default()' % (name, i)
+            for name, (i, converter, repeated) in exprs.items()
+            if name not in kept_exprs]
+    if keep_unknown:
+        lines += [
+            '    if found < len(obj):',
+            '        for name, value in obj.items():',
+            '            if name not in values:',
+            '                values[name] = _deepcopy(value)',
+        ]
+
+    lines.append('    return values')
+    return _compile(lines, 'decode', namespace)
+
+
+def _compile_slot_initializer(attributes, kept_attributes, setters, decode):
+    """Generate the function to set the key and the values decoded from a
+    stored object to the slots of a compact model, as
+    ``initialize(model, key, obj)``, without the values in a dict. A stored
+    object of missing fields is decoded by ``decode``.
+    """
+    namespace = {'set_key': setters['key'], 'decode': decode}
+    lines = ['def initialize(model, key, obj):', '    try:']
+    for i, (name, attr) in enumerate(attributes.items()):
+        namespace['attr_%d' % i] = attr
+        namespace['set_%d' % i] = setters[name]
+        decoder = attr._get_value_decoder()
+        if decoder is not None:
+            namespace['decode_%d' % i] = decoder
+        if name in kept_attributes:
+            lines.append('        value_%d = %s' % (i, _convert_expr(
+                    decoder and 'decode_%d' % i, attr.repeated,
+                    'obj[%r]' % name)))
+        else:
+            lines.append('        value_%d = attr_%d.get_default()' % (i, i))
+
+    lines += ['    except KeyError:', '        values = decode(obj)']
+    lines += ['        value_%d = values[%r]' % (i, name)
+            for i, name in enumerate(attributes)]
+    lines.append('    set_key(model, key)')
+    lines += ['    set_%d(model, value_%d)' % (i, i)
+            for i in range(len(attributes))]
+    return _compile(lines, 'initialize', namespace)
+
+
+def _find_member(classes, name):
+    # NOTE: the descriptor of the slot in the first class defining it
+    for _class in classes:
+        value = vars(_class).get(name, None)
+        if isinstance(value, _SlotAttribute):
+            return value.member
+        elif isinstance(value, types.MemberDescriptorType):
+            return value
+
+
+class _SlotAttribute(object):
+    """This class is to replace an attribute of a compact model with the
+    slot storing its value, where the attribute is still got from the class.
+
+    Args:
+        attribute (Attribute): The attribute.
+        member (member_descriptor): The slot of the attribute.
+    """
+    __slots__ = ('attribute', 'member')
+
+    def __init__(self, attribute, member):
+        self.attribute = attribute
+        self.member = member
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self.attribute
+
+        try:
+            return self.member.__get__(instance, owner)
+        except AttributeError:
+            # NOTE: the value is not set or deleted in the instance
+            return self.attribute.get_default()
+
+    def __set__(self, instance, value):
+        self.member.__set__(instance, value)
+
+    def __delete__(self, instance):
+        self.member.__delete__(instance)
+
+
+class _Schema(object):
+    """This class is to describe the attributes of a :py:class:`Model` class,
+    which is compiled once on the class creation and never changed.
+
+    Args:
+        model_class (type): The model class.
+        compact (bool): The values of model are stored in slots.
+
+    Attributes:
+        attributes (mappingproxy): All of the attributes including the
+            inherited ones, as ``{name: attribute}``.
+        kept_attributes (mappingproxy): The attributes kept in the database.
+        indexed_attributes (mappingproxy): The kept attributes to be indexed.
+        encode (callable): The generated function to encode the values of a
+            model to the stored object.
+        decode (callable): The generated function to decode a stored object
+            to the values of a model.
+        members (mappingproxy): The slots of the key and attributes as
+            ``{name: member_descriptor}`` if compact, else ``None``.
+        initialize (callable): The generated function to set the slots of a
+            model from a stored object, ``None`` unless all of the values are
+            in slots.
+    """
+    def __init__(self, model_class, compact=False):
+        attributes = {}
+        # NOTE: attributes of a subclass override the ones of its parents
+        for _class in reversed(model_class.__mro__):
+            for name, attr in vars(_class).items():
+                if isinstance(attr, _SlotAttribute):
+                    attr = attr.attribute
+                if isinstance(attr, Attribute):
+                    attributes[name] = attr
+                elif name in attributes:
+                    del attributes[name]
+
+        self.attributes = types.MappingProxyType(attributes)
+        self.kept_attributes = types.MappingProxyType({name: attr
+                for name, attr in attributes.items() if attr.kept})
+        self.indexed_attributes = types.MappingProxyType({name: attr
+                for name, attr in self.kept_attributes.items() if attr.indexed})
+        self.compact = bool(compact)
+        self.members = None
+        if self.compact:
+            members = ((name, _find_member(model_class.__mro__, name))
+                    for name in ('key',) + tuple(attributes))
+            self.members = types.MappingProxyType({name: member
+                    for name, member in members if member is not None})
+            self._setters = {name: member.__set__
+                    for name, member in self.members.items()}
+
+        self.encode = _compile_encoder(self.kept_attributes)
+        # NOTE: no slot for unknown fields
+        self.decode = _compile_decoder(self.attributes, self.kept_attributes,
+                keep_unknown=not self.compact)
+        self.initialize = None
+        if self.compact and len(self.members) == len(attributes) + 1:
+            self.initialize = _compile_slot_initializer(self.attributes,
+                    self.kept_attributes, self._setters, self.decode)
+
+
+class _ModelMeta(type):
+    def __new__(mcs, name, bases, namespace, **kwargs):
+        compact = getattr(namespace.get('Meta', None), 'compact', None)
+        if compact is None:
+            compact = any(base._schema.compact for base in bases
+                    if isinstance(base, _ModelMeta))
+
+        attributes = {}
+        if compact:
+            # NOTE: slots conflict with the attributes in class namespace
+            namespace = dict(namespace)
+            attributes = {attr_name: namespace.pop(attr_name)
+                    for attr_name, attr in list(namespace.items())
+                    if isinstance(attr, Attribute)}
+            base_classes = [_class for base in bases for _class in base.__mro__]
+            namespace['__slots__'] = tuple(slot_name
+                    for slot_name in ('key',) + tuple(attributes)
+                    if _find_member(base_classes, slot_name) is None)
+
+        cls = super().__new__(mcs, name, bases, namespace, **kwargs)
+        for attr_name, attr in attributes.items():
+            attr.__set_name__(cls, attr_name)
+            member = _find_member(cls.__mro__, attr_name)
+            setattr(cls, attr_name, _SlotAttribute(attr, member))
+
+        cls._schema = _Schema(cls, compact)
+        _model_classes[name] = cls
+        return cls
+
+
+class Model(BaseObject, metaclass=_ModelMeta):
+    """This class is to define the kind of objects by attributes.
+
+    The values of a model are stored in its ``__dict__``, or in slots if
+    compact, which is set by an inner class ``Meta`` and inherited::
+
+        class User(Model):
+            class Meta:
+                compact = True
+
+            name = StringAttribute()
+
+    A compact model takes less memory, about a fifth less for a model of 20
+    attributes including its values, but it has no attribute other than the
+    key and the attributes of its schema, and it is compact only if all of its
+    parent models are compact.
+    """
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         self.key = kwargs.pop('key', None)
         # set default value from Attribute
-        attributes = self._get_cls_attributes(only_kept=False)
-        for name, attr in attributes.items():
+        for name, attr in self._schema.attributes.items():
             if name not in kwargs:
                 kwargs[name] = attr.get_default()
 
         super().__init__(**kwargs)
 
     def __setattr__(self, name, value):
-        cls_dict = self.__class__.__dict__
-        if name in cls_dict and isinstance(cls_dict[name], Attribute):
+        attr = self._schema.attributes.get(name, None)
+        if attr is not None:
             try:
-                cls_dict[name]._do_validate_value(value)
+                attr._do_validate_value(value)
             except TypeError:
                 # NOTE: more readable error message
                 msg = "attribute '%s' type '%s' is not allowed" % (
@@ -201,94 +642,194 @@ class Model(BaseObject):
 
         return super().__setattr__(name, value)
 
-    def __getattribute__(self, name):
-        value = super().__getattribute__(name)
-        if (isinstance(value, Attribute)
-                and value == getattr(self.__class__, name)):
-            return value.get_default()
+    def _get_fields(self):
+        members = self._schema.members
+        if members is None:
+            return vars(self)
 
-        return value
+        # NOTE: the values of non-compact parent models are in __dict__
+        fields = dict(getattr(self, '__dict__', ()))
+        for name, member in members.items():
+            try:
+                fields[name] = member.__get__(self)
+            except AttributeError:
+                pass
+
+        return fields
 
     @classmethod
     def _get_cls_attributes(cls, only_kept=True):
-        cls_dict = cls.__dict__
-        attributes = {name: attr for name, attr in cls_dict.items()
-                if isinstance(attr, Attribute) and (attr.kept or not only_kept)}
-        return attributes
+        if only_kept:
+            return cls._schema.kept_attributes
+        return cls._schema.attributes
 
     def put(self):
-        kind = self.__class__.__name__
+        cls = type(self)
+        kind = cls.__name__
         table = _database_in_use.table(kind)
-        attributes = self._get_cls_attributes()
-        obj = self.to_dict(include=tuple(attributes.keys()), exclude=('key',))
-        for name, attr in attributes.items():
-            if name in obj:
-                obj[name] = attr.encode(obj[name])
-            else:
-                obj[name] = attr.get_default()
+        obj = cls._schema.encode(self._get_fields())
+        with table._lock.writer:
+            key = self.key
+            if not key:
+                # NOTE: the key is not an attribute to be validated
+                key = Key(kind, table._next_ids(1)[0])
+                object.__setattr__(self, 'key', key)
 
-        if self.key:
-            table.update_or_insert(self.key.object_id, obj)
-        else:
-            object_id = table.insert(obj)
-            self.key = Key(kind, object_id)
+            table._store_object(key.object_id, obj)
+
+        return key
+
+    async def put_async(self):
+        with _database_in_use.batch(commit=False):
+            key = self.put()
 
-        return self.key
+        await _database_in_use._auto_commit_async()
+        return key
 
     @classmethod
-    def query(cls, test_func=lambda obj: True):
-        return Query(cls.__name__, test_func)
+    def _put_multi(cls, models):
+        kind = cls.__name__
+        table = _database_in_use.table(kind)
+        # NOTE: encode all before storing any, and the encoded objects are new
+        encode = cls._schema.encode
+        objs = [encode(model._get_fields()) for model in models]
+        with table._batch():
+            object_ids = iter(table._next_ids(
+                    sum(1 for model in models if not model.key)))
+            for model, obj in zip(models, objs):
+                if not model.key:
+                    model.key = Key(kind, next(object_ids))
+                table._store_object(model.key.object_id, obj)
+
+        return [model.key for model in models]
+
+    @classmethod
+    def _from_stored(cls, key, obj):
+        # NOTE: stored values were validated on put, and obj is not referred
+        if cls.__init__ is not Model.__init__:
+            # NOTE: an overriding __init__ is called as the models are created
+            return cls(key=key, **cls._schema.decode(obj))
+
+        model = cls.__new__(cls)
+        schema = cls._schema
+        if schema.initialize is not None:
+            schema.initialize(model, key, obj)
+            return model
+        elif schema.members is None:
+            model_dict = vars(model)
+            model_dict['key'] = key
+            model_dict.update(schema.decode(obj))
+            return model
+
+        # NOTE: set the slots directly, not through the attributes
+        setters = schema._setters
+        setters['key'](model, key)
+        for name, value in schema.decode(obj).items():
+            setters[name](model, value)
+
+        return model
+
+    @classmethod
+    def _get_multi(cls, keys):
+        cache = _model_cache
+        if cache is None:
+            return cls._read_multi(keys)
+
+        kind = cls.__name__
+        models = [cache.get(kind, key.object_id) for key in keys]
+        positions = [i for i, model in enumerate(models) if model is None]
+        if positions:
+            read_models = cls._read_multi([keys[i] for i in positions], cache)
+            for i, model in zip(positions, read_models):
+                models[i] = model
+
+        return models
+
+    @classmethod
+    def _read_multi(cls, keys, cache=None):
+        if cache is not None:
+            # NOTE: models read before a change are not cached after it
+            generation = cache._generation
+
+        table = _database_in_use.table(cls.__name__)
+        # NOTE: the stored objects are replaced but not modified by writes, so
+        # they are decoded out of the lock
+        with table._lock.reader:
+            dictionary = table.dictionary
+            objs = [dictionary.get(key.object_id, None) for key in keys]
+
+        from_stored = cls._from_stored
+        models = [None if obj is None else from_stored(key, obj)
+                for key, obj in zip(keys, objs)]
+        if cache is not None:
+            kind = cls.__name__
+            for key, model in zip(keys, models):
+                if model is not None:
+                    cache._set(kind, key.object_id, model, generation)
+
+        return models
+
+    @classmethod
+    def _get_table(cls):
+        table = _database_in_use.table(cls.__name__)
+        for name, attr in cls._schema.indexed_attributes.items():
+            if name not in table.indexes:
+                table.create_index(name, ordered=attr._ordered,
+                        key=attr._get_order_key())
+
+        return table
+
+    @classmethod
+    def query(cls, test_func=_accept_all, raw=False):
+        return Query(cls.__name__, test_func, model_class=cls, raw=raw)
 
 
 class Key(BaseObject):
-    _classes_dict = {}
+    __slots__ = ('kind', 'object_id')
+    _classes_dict = _model_classes
 
     def __init__(self, kind, object_id):
         self.kind = kind
         self.object_id = object_id
 
+    def _get_fields(self):
+        return {'kind': self.kind, 'object_id': self.object_id}
+
     @classmethod
     def _get_class(cls, kind):
-        if kind not in cls._classes_dict:
-            # refresh _classes_dict
-            cls._classes_dict['Model'] = Model
-            queue = [Model]
-            while queue:
-                parent = queue.pop(0)
-                for child in parent.__subclasses__():
-                    if child.__name__ not in cls._classes_dict:
-                        cls._classes_dict[child.__name__] = child
-                        queue.append(child)
-
-        _class = cls._classes_dict.get(kind, None)
-        return _class
+        return cls._classes_dict.get(kind, None)
 
     def get(self):
-        table = _database_in_use.table(self.kind)
-        obj = table.get(self.object_id)
-        if obj is None:
-            return None
+        cache = _model_cache
+        if cache is not None:
+            model = cache.get(self.kind, self.object_id)
+            if model is not None:
+                return model
 
         cls = self._get_class(self.kind)
         if cls is None:
             return None
 
-        attributes = cls._get_cls_attributes()
-        for name, attr in attributes.items():
-            if name in obj:
-                obj[name] = attr.decode(obj[name])
-            else:
-                obj[name] = attr.get_default()
+        return cls._read_multi([self], cache)[0]
 
-        return cls(key=self, **obj)
+    async def get_async(self):
+        return self.get()
 
     def delete(self):
         table = _database_in_use.table(self.kind)
         table.delete(self.object_id, ignore_exception=True)
 
+    async def delete_async(self):
+        table = _database_in_use.table(self.kind)
+        await table.delete_async(self.object_id, ignore_exception=True)
+
 
 class KeyAttribute(DateAttribute):
     _allowed_classes = [Key]
+    _ordered = False
+
+    def _get_order_key(self):
+        return None
 
     def __init__(self, kind=None, **kwargs):
         super().__init__(**kwargs)
@@ -318,37 +859,447 @@ class KeyAttribute(DateAttribute):
 
 # NOTE: different interface from `core.Query`
 class Query(object):
-    def __init__(self, kind, test_func=lambda obj: True):
+    def __init__(self, kind, test_func=_accept_all, model_class=None,
+            raw=False):
         self.kind = kind
         self.test_func = test_func
-
-    def fetch(self, keys_only=False):
-        table = _database_in_use.table(self.kind)
-        keys = []
-        for object_id in table.dictionary.keys():
+        self.model_class = model_class or Key._get_class(kind)
+        # test the stored objects instead of the models
+        self.raw = raw
+        self.conditions = []
+        # callables tested on the models after the conditions
+        self.predicates = []
+        self.order = None
+
+    def _get_attribute(self, name):
+        attributes = self.model_class._get_cls_attributes()
+        if name not in attributes:
+            raise ValueError("'%s' is not a kept attribute of '%s'" % (
+                    name, self.kind))
+
+        return attributes[name]
+
+    def _add_condition(self, name, op, value):
+        self.conditions.append(self._get_attribute(name)._condition(op, value))
+
+    def filter(self, *conditions):
+        for condition in conditions:
+            if isinstance(condition, core.Condition):
+                # NOTE: only kept attributes are stored to be tested
+                self._get_attribute(condition.field)
+                self.conditions.append(condition)
+            elif callable(condition):
+                self.predicates.append(condition)
+            else:
+                raise TypeError("condition type '%s' is not allowed" % (
+                        type(condition).__name__))
+        return self
+
+    def equal(self, name, value):
+        self._add_condition(name, '==', value)
+        return self
+
+    def range(self, name, lower=None, upper=None, include_lower=True,
+            include_upper=False):
+        if lower is not None:
+            self._add_condition(name, '>=' if include_lower else '>', lower)
+        if upper is not None:
+            self._add_condition(name, '<=' if include_upper else '<', upper)
+        return self
+
+    def order_by(self, name, reverse=False):
+        attr = self._get_attribute(name)
+        self.order = (name, reverse, attr._get_order_key())
+        return self
+
+    def _get_table(self):
+        if self.model_class is None:
+            return _database_in_use.table(self.kind)
+
+        return self.model_class._get_table()
+
+    def _core_query(self):
+        query = self._get_table().query()
+        query.conditions.extend(self.conditions)
+        query.order = self.order
+        return query
+
+    def _test_funcs(self):
+        return [test_func for test_func in [self.test_func] + self.predicates
+                if test_func is not _accept_all]
+
+    def _tested_query(self):
+        # NOTE: the core query and the functions to test the models, which
+        # are tested by the core query instead if raw
+        query = self._core_query()
+        test_funcs = self._test_funcs()
+        if self.raw:
+            query.predicates.extend(test_funcs)
+            test_funcs = []
+
+        return query, test_funcs
+
+    def _iter_results(self, items, test_funcs, keys_only):
+        # NOTE: decode each object once, and only if a model is needed
+        cls = self.model_class
+        for object_id, obj in items:
             key = Key(self.kind, object_id)
-            if self.test_func(key.get()):
-                keys.append(key)
+            if keys_only and not test_funcs:
+                yield object_id, obj, key
+                continue
+
+            model = None if cls is None else cls._from_stored(key, obj)
+            if all(test_func(model) for test_func in test_funcs):
+                yield object_id, obj, key if keys_only else model
+
+    def iter(self, keys_only=False):
+        query, test_funcs = self._tested_query()
+        items = query._iter_locked(query._iter_tested())
+        for _, _, result in self._iter_results(items, test_funcs, keys_only):
+            yield result
+
+    def fetch(self, keys_only=False, parallel=None):
+        test_funcs = self._test_funcs()
+        cls = self.model_class
+        if parallel is None or not test_funcs or cls is None:
+            return list(self.iter(keys_only=keys_only))
+
+        # NOTE: the models are decoded to be tested in the workers, then the
+        # matches are decoded again
+        query = self._core_query()
+        if self.raw:
+            convert = functools.partial(core._copy_item, core.ReadOnlyDict)
+            matches = query._iter_parallel(parallel, test_funcs, convert,
+                    copied=True)
+        else:
+            convert = functools.partial(_decode_item, cls, self.kind)
+            matches = query._iter_parallel(parallel, test_funcs, convert)
 
+        matches = list(matches)
+        keys = [Key(self.kind, object_id) for object_id, _ in matches]
         if keys_only:
             return keys
 
-        return get_multi(keys)
+        return [cls._from_stored(key, obj)
+                for key, (_, obj) in zip(keys, matches)]
+
+    def fetch_page(self, page_size, start_cursor=None, keys_only=False):
+        query, test_funcs = self._tested_query()
+        query = query._paged_query(start_cursor, page_size + 1)
+        # NOTE: tested in order in the lock, only until the page is full
+        with query._read_locked():
+            results = list(itertools.islice(self._iter_results(
+                    query._iter_tested(), test_funcs, keys_only), page_size + 1))
+
+        more = len(results) > page_size
+        results = results[:page_size]
+        cursor = query._cursor(*results[-1][:2]) if results else None
+        return [result for _, _, result in results], cursor, more
+
+    def _extreme(self, name, reverse):
+        attr = self._get_attribute(name)
+        if self.test_func is _accept_all and not self.predicates:
+            query = self._core_query()
+            key = attr._get_order_key()
+            if reverse:
+                value = query.max(name, key=key)
+            else:
+                value = query.min(name, key=key)
+            return None if value is None else attr._post_decode(value)
+
+        values = []
+        for model in self.fetch():
+            value = getattr(model, name)
+            values.extend(value if attr.repeated else [value])
+
+        values = [value for value in values if value is not None]
+        if not values:
+            return None
+        return max(values) if reverse else min(values)
+
+    def min(self, name):
+        return self._extreme(name, reverse=False)
+
+    def max(self, name):
+        return self._extreme(name, reverse=True)
+
+    def _aggregated_query(self):
+        # NOTE: the core query to aggregate the stored objects, None if the
+        # models must be decoded to be tested
+        test_funcs = self._test_funcs()
+        if test_funcs and not self.raw:
+            return None
+
+        query = self._core_query()
+        query.predicates.extend(test_funcs)
+        return query
+
+    def _iter_values(self, name):
+        attr = self._get_attribute(name)
+        for model in self.iter():
+            value = getattr(model, name)
+            for element in (value if attr.repeated else [value]):
+                if element is not None:
+                    yield element
+
+    def count(self):
+        query = self._aggregated_query()
+        if query is None:
+            return sum(1 for _ in self.iter(keys_only=True))
+
+        return query.count()
+
+    def sum(self, name):
+        self._get_attribute(name)
+        query = self._aggregated_query()
+        if query is None:
+            return sum(self._iter_values(name))
+
+        return query.sum(name)
+
+    def group_by(self, name):
+        return GroupBy(self, name)
+
+
+def _group_key(attr, stored_value):
+    # NOTE: the decoded value, or the hashable stored one if not hashable
+    value = attr._post_decode(stored_value)
+    try:
+        hash(value)
+    except TypeError:
+        return indexes._hashable(stored_value)
+
+    return value
+
+
+class GroupBy(object):
+    def __init__(self, query, name):
+        self.query = query
+        self.name = name
+
+    def count(self):
+        attr = self.query._get_attribute(self.name)
+        query = self.query._aggregated_query()
+        if query is not None:
+            # NOTE: a list or dict value is hashable already, see
+            # `core.GroupBy.count`
+            return {value if isinstance(value, (tuple, frozenset))
+                    else _group_key(attr, value): count for value, count
+                    in query.group_by(self.name).count().items()}
+
+        counts = {}
+        for model in self.query.iter():
+            value = getattr(model, self.name)
+            values = value if attr.repeated else [value]
+            for group_key in {_group_key(attr, attr._post_encode(value))
+                    for value in values}:
+                counts[group_key] = counts.get(group_key, 0) + 1
+
+        return counts
+
+
+def _decode_item(cls, kind, item):
+    # NOTE: run in the workers of parallel queries, see `Query.fetch`
+    object_id, obj = item
+    return cls._from_stored(Key(kind, object_id), obj)
+
+
+def _group_by(items, group_func):
+    # NOTE: the positions of items in each group, in the order of first seen
+    groups = {}
+    for i, item in enumerate(items):
+        groups.setdefault(group_func(item), []).append(i)
+
+    return groups.items()
 
 
 def put_multi(models):
-    return [model.put() for model in models]
+    models = list(models)
+    keys = [model.key for model in models]
+    try:
+        with _database_in_use.batch():
+            for cls, positions in _group_by(models, type):
+                if cls.put is not Model.put:
+                    # NOTE: an overriding put is called for each model
+                    for i in positions:
+                        models[i].put()
+                else:
+                    cls._put_multi([models[i] for i in positions])
+    except BaseException:
+        # NOTE: inserted objects are rolled back, so are the keys of models
+        for model, key in zip(models, keys):
+            model.key = key
+        raise
+
+    return [model.key for model in models]
 
 
 def get_multi(keys):
-    return [key.get() for key in keys]
+    keys = list(keys)
+    models = [None] * len(keys)
+    for kind, positions in _group_by(keys, lambda key: key.kind):
+        cls = Key._get_class(kind)
+        if cls is None:
+            continue
+
+        kind_models = cls._get_multi([keys[i] for i in positions])
+        for i, model in zip(positions, kind_models):
+            models[i] = model
+
+    return models
 
 
 def delete_multi(keys):
-    for key in keys:
-        key.delete()
+    with _database_in_use.batch():
+        for key in keys:
+            key.delete()
+
+
+async def put_multi_async(models):
+    with _database_in_use.batch(commit=False):
+        keys = put_multi(models)
+
+    await _database_in_use._auto_commit_async()
+    return keys
+
+
+async def get_multi_async(keys):
+    return get_multi(keys)
+
+
+async def delete_multi_async(keys):
+    with _database_in_use.batch(commit=False):
+        delete_multi(keys)
+
+    await _database_in_use._auto_commit_async()
+
+
+class ModelCache(object):
+    """This class is to keep the models got by keys, so getting a key again
+    returns the same model without reading and decoding the stored object.
+
+    The cached models are shared by the callers getting the same key, like an
+    identity map, so a model should not be modified without being put. An
+    entry is invalidated when the stored object is changed in the database,
+    including by :py:meth:`Model.put`, :py:meth:`Key.delete`, the
+    ``*_multi`` functions and the writes of :py:class:`pydictdb.core.Table`.
+
+    Args:
+        max_size (int): The maximum number of models, where the least recently
+            used one is evicted, ``None`` to keep all of the models got.
+
+    Attributes:
+        hits (int): The number of gets returning a cached model.
+        misses (int): The number of gets without a cached model.
+        evictions (int): The number of models evicted for max_size.
+    """
+    def __init__(self, max_size=1024):
+        if max_size is not None and max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._models = collections.OrderedDict()
+        # NOTE: increased on each invalidation, so a model read before it is
+        # not cached after it, see `_set`
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._models)
+
+    def get(self, kind, object_id):
+        """Get a cached model, without the lock for a hit.
+
+        Args:
+            kind (str): The kind of the model.
+            object_id (object): The id of the model.
+
+        Returns:
+            (Model) -- The model, ``None`` if not cached.
+        """
+        cache_key = (kind, object_id)
+        model = self._models.get(cache_key, None)
+        if model is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        if self.max_size is not None:
+            try:
+                self._models.move_to_end(cache_key)
+            except KeyError:
+                # NOTE: invalidated or evicted by another thread
+                pass
+
+        return model
+
+    def _set(self, kind, object_id, model, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+
+            cache_key = (kind, object_id)
+            self._models[cache_key] = model
+            if self.max_size is not None:
+                self._models.move_to_end(cache_key)
+                while len(self._models) > self.max_size:
+                    self._models.popitem(last=False)
+                    self.evictions += 1
+
+    def invalidate(self, kind, object_id=None):
+        """Remove the cached model of an id, called on each change of the
+        database.
+
+        Args:
+            kind (str): The kind of the model.
+            object_id (object): The id of the model, ``None`` to remove all of
+                the models of the kind.
+        """
+        with self._lock:
+            self._generation += 1
+            if object_id is not None:
+                self._models.pop((kind, object_id), None)
+                return
+
+            for cache_key in [cache_key for cache_key in self._models
+                    if cache_key[0] == kind]:
+                del self._models[cache_key]
+
+    def clear(self):
+        """Remove all of the cached models.
+        """
+        with self._lock:
+            self._generation += 1
+            self._models.clear()
+
+    def stats(self):
+        """Get the counters of the cache.
+
+        Returns:
+            (dict) -- The hits, misses, evictions and size.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self._models)}
+
+
+def set_cache(cache):
+    # NOTE: the cache listens to the changes of the database in use
+    global _model_cache
+    if _model_cache is not None:
+        _database_in_use.remove_listener(_model_cache.invalidate)
+    if cache is not None:
+        cache.clear()
+        _database_in_use.add_listener(cache.invalidate)
+    _model_cache = cache
 
 
 def register_database(database):
     global _database_in_use
+    if _model_cache is not None:
+        _database_in_use.remove_listener(_model_cache.invalidate)
+        _model_cache.clear()
+        database.add_listener(_model_cache.invalidate)
     _database_in_use = database
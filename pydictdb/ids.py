@@ -0,0 +1,180 @@
+import abc
+import os
+import threading
+import time
+
+
+class IdGenerator(abc.ABC):
+    """This abstract class is to generate unique object ids for
+    :py:class:`pydictdb.core.Table`. Implemented in :py:meth:`next_ids`, and
+    safe to be called from threads.
+    """
+    def next_id(self):
+        """Generate an id.
+
+        Returns:
+            (str) -- The id.
+        """
+        return self.next_ids(1)[0]
+
+    @abc.abstractmethod
+    def next_ids(self, size):
+        raise NotImplementedError
+
+
+class CounterIdGenerator(IdGenerator):
+    """This class is to generate increasing integer ids. By default, the
+    counter starts from the current time in microseconds and never falls behind
+    it, so the ids look like the timestamps of insertion and are unique in the
+    process, but not across processes sharing a table, see
+    :py:class:`SnowflakeIdGenerator`.
+
+    Args:
+        start (int): The first id, ``None`` to follow the current time.
+    """
+    def __init__(self, start=None):
+        self._follow_time = start is None
+        self._last = -1 if start is None else start - 1
+        self._lock = threading.Lock()
+
+    def next_ids(self, size):
+        """Generate ids in bulk, by reserving a range of the counter.
+
+        Args:
+            size (int): The number of ids.
+
+        Returns:
+            (list) -- The ids in increasing order.
+        """
+        with self._lock:
+            start = self._last + 1
+            if self._follow_time:
+                start = max(start, time.time_ns() // 1000)
+            self._last = start + size - 1
+
+        if size == 1:
+            return [str(start)]
+        return list(map(str, range(start, start + size)))
+
+
+class SnowflakeIdGenerator(IdGenerator):
+    """This class is to generate ids composed of a timestamp in milliseconds, a
+    node id and a sequence number, which are unique across the processes of
+    different node ids, and ordered by time.
+
+    The 64-bit id is laid out as 41 bits of milliseconds since
+    :py:attr:`EPOCH`, 10 bits of node id and 12 bits of sequence. When the
+    4096 ids of a millisecond are used up, the ids of the next millisecond are
+    taken without waiting, and a clock going backward never reuses ids.
+
+    A node id derived from the process is wider, as 10 bits of the process id
+    followed by :py:attr:`RANDOM_BITS` random bits drawn once for each
+    process, since the process ids equal in 10 bits are common. The processes
+    of such ids collide only if the random bits are also equal, in chance of
+    one in 2 ** 20 for each pair of them, and the ids are 84-bit.
+
+    Args:
+        node_id (int): The node id in ``[0, 1024)``, ``None`` to derive it from
+            the current process, which is derived again after fork.
+    """
+    EPOCH = 1546300800000  # 2019-01-01T00:00:00Z in milliseconds
+    NODE_BITS = 10
+    RANDOM_BITS = 20
+    SEQUENCE_BITS = 12
+
+    def __init__(self, node_id=None):
+        if node_id is not None and not 0 <= node_id < (1 << self.NODE_BITS):
+            raise ValueError("node_id must be in [0, %d)" % (
+                    1 << self.NODE_BITS))
+
+        self._node_id = node_id
+        self._node_bits = self.NODE_BITS
+        if node_id is None:
+            self._node_bits += self.RANDOM_BITS
+        self._process_node_id = None
+        self._pid = None
+        self._last_time = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def _check_process(self):
+        # NOTE: called in the lock, and forked with the state of the parent
+        # process otherwise
+        pid = os.getpid()
+        if pid == self._pid:
+            return
+
+        self._pid = pid
+        self._last_time, self._sequence = -1, 0
+        random_bits = int.from_bytes(os.urandom(4), 'big')
+        self._process_node_id = (
+                (pid & ((1 << self.NODE_BITS) - 1)) << self.RANDOM_BITS
+                | random_bits & ((1 << self.RANDOM_BITS) - 1))
+
+    @property
+    def node_id(self):
+        """int: The node id given, or derived from the current process in
+        ``[0, 2 ** 30)``.
+        """
+        if self._node_id is not None:
+            return self._node_id
+
+        with self._lock:
+            self._check_process()
+            return self._process_node_id
+
+    def next_ids(self, size):
+        """Generate ids in bulk.
+
+        Args:
+            size (int): The number of ids.
+
+        Returns:
+            (list) -- The ids in increasing order.
+        """
+        max_sequence = 1 << self.SEQUENCE_BITS
+        ids = []
+        with self._lock:
+            self._check_process()
+            node_id = self._node_id
+            if node_id is None:
+                node_id = self._process_node_id
+            node_bits = node_id << self.SEQUENCE_BITS
+            time_shift = self._node_bits + self.SEQUENCE_BITS
+            now = time.time_ns() // 1000000 - self.EPOCH
+            if now > self._last_time:
+                self._last_time, self._sequence = now, 0
+
+            while size > 0:
+                count = min(size, max_sequence - self._sequence)
+                start = (self._last_time << time_shift) | node_bits | self._sequence
+                ids.extend(range(start, start + count))
+                self._sequence += count
+                size -= count
+                if self._sequence == max_sequence:
+                    self._last_time, self._sequence = self._last_time + 1, 0
+
+        return list(map(str, ids))
+
+
+class UuidIdGenerator(IdGenerator):
+    """This class is to generate random UUID4 ids in hex, which are unique
+    without any coordination, but not ordered.
+    """
+    # hex digit of the variant bits '10' with the 2 random bits of a digit
+    _variants = {'%x' % i: '%x' % (0x8 | (i & 0x3)) for i in range(16)}
+
+    def next_ids(self, size):
+        """Generate ids in bulk.
+
+        Args:
+            size (int): The number of ids.
+
+        Returns:
+            (list) -- The ids.
+        """
+        # NOTE: same as `uuid.uuid4().hex`, but random bytes are read at once
+        random_hex = os.urandom(16 * size).hex()
+        variants = self._variants
+        return [h[:12] + '4' + h[13:16] + variants[h[16]] + h[17:]
+                for h in (random_hex[i:i + 32] for i in range(0, 32 * size, 32))]
@@ -0,0 +1,441 @@
+import bisect
+import threading
+
+
+_MISSING = object()
+
+
+def _hashable(value):
+    if isinstance(value, dict):
+        return frozenset((k, _hashable(v)) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+
+    return value
+
+
+def field_values(obj, field):
+    """Get the values of a field in an object, where a list is taken as the
+    values of a repeated field.
+
+    Args:
+        obj (dict): The object.
+        field (str): The name of the field.
+
+    Returns:
+        (list or tuple) -- The values, empty if the field is missing.
+    """
+    value = obj.get(field, _MISSING)
+    if value is _MISSING:
+        return ()
+    elif isinstance(value, list):
+        return value
+
+    return (value,)
+
+
+def _id_key(object_id):
+    # NOTE: ids of different types are ordered by type name, then by id
+    return (type(object_id).__name__, object_id)
+
+
+def match_equal(obj, field, value):
+    """Test if the field of an object equals to a value, or contains the value
+    if the field is repeated.
+
+    Args:
+        obj (dict): The object.
+        field (str): The name of the field.
+        value (object): The value.
+
+    Returns:
+        (bool) -- True if matched.
+    """
+    for field_value in field_values(obj, field):
+        if field_value == value:
+            return True
+
+    return False
+
+
+class HashIndex(object):
+    """This class is to map each value of a field to the ids of objects, for
+    the equality lookup in O(1).
+
+    Each value of a repeated field is mapped to the object id. The ids of a
+    value are kept in the order of indexing.
+
+    Args:
+        field (str): The name of the indexed field.
+
+    Attributes:
+        _ids (dict): The ids of each value, as ``{value: {object_id: None}}``.
+    """
+    def __init__(self, field):
+        self.field = field
+        self._ids = {}
+
+    def build(self, dictionary):
+        """Index all of the objects in a dictionary from scratch.
+
+        Args:
+            dictionary (dict): The indexed objects as ``{object_id: obj}``.
+        """
+        self._ids = {}
+        for object_id, obj in dictionary.items():
+            self.add(object_id, obj)
+
+    def add(self, object_id, obj):
+        """Index an object.
+
+        Args:
+            object_id (object): The id of the object.
+            obj (dict): The object.
+        """
+        # NOTE: all of the values are hashed before any is indexed, so that an
+        # unhashable value leaves the index unchanged
+        values = {_hashable(value): None
+                for value in field_values(obj, self.field)}
+        for value in values:
+            self._ids.setdefault(value, {})[object_id] = None
+
+    def remove(self, object_id, obj):
+        """Remove an indexed object.
+
+        Args:
+            object_id (object): The id of the object.
+            obj (dict): The object, as it was indexed.
+        """
+        for value in field_values(obj, self.field):
+            value = _hashable(value)
+            object_ids = self._ids.get(value, None)
+            if object_ids is None:
+                continue
+
+            object_ids.pop(object_id, None)
+            if not object_ids:
+                del self._ids[value]
+
+    def lookup(self, value):
+        """Get the ids of objects whose field equals to or contains a value.
+
+        Args:
+            value (object): The value.
+
+        Returns:
+            (list) -- The object ids.
+        """
+        return list(self._ids.get(_hashable(value), ()))
+
+    def count(self, value):
+        """Count the objects whose field equals to or contains a value.
+
+        Args:
+            value (object): The value.
+
+        Returns:
+            (int) -- The number of objects.
+        """
+        return len(self._ids.get(_hashable(value), ()))
+
+    def counts(self):
+        """Count the objects of each value.
+
+        Returns:
+            (dict) -- The numbers of objects as ``{value: count}``, where a
+            list or dict value is converted to a tuple or frozenset.
+        """
+        return {value: len(object_ids) for value, object_ids in self._ids.items()}
+
+
+class OrderedIndex(object):
+    """This class is to keep the values of a field sorted with the ids of
+    objects, for the range scan, ordering, minimum and maximum in
+    O(log n + k).
+
+    ``None`` values are not indexed, and each value of a repeated field is
+    indexed with the object id. Objects of the same value are ordered by id.
+
+    The values, or their keys if ``key`` is given, are compared as they are,
+    so that they must be comparable with each other, as numbers or strings
+    are but not both. Unlike ids, values of mixed types are not ordered by
+    type name, which would order ``1.5`` before ``1``. An object of a value
+    incomparable with the indexed values raises :py:exc:`TypeError` on
+    indexing and is left unindexed, so that the table refuses to store it.
+
+    Args:
+        field (str): The name of the indexed field.
+        key (callable): The function to get the sort key of a value, ``None``
+            to sort the values themselves.
+
+    Attributes:
+        _entries (list): The sorted entries as
+            ``(sort key, id key, field value)``.
+        _keys (list): The sort keys of :py:attr:`_entries` for bisection.
+        _multi_valued (int): The number of objects indexed with more than
+            one value.
+    """
+    def __init__(self, field, key=None):
+        self.field = field
+        self.key = key
+        self._entries = []
+        self._keys = []
+        self._multi_valued = 0
+
+    def _sort_key(self, value):
+        if self.key is None:
+            return value
+        return self.key(value)
+
+    def _iter_entries(self, object_id, obj):
+        for value in field_values(obj, self.field):
+            if value is not None:
+                yield (self._sort_key(value), _id_key(object_id), value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def multi_valued(self):
+        """bool: True if an object is indexed with more than one value, then
+        the counts of values are not the numbers of objects.
+        """
+        return self._multi_valued > 0
+
+    def build(self, dictionary):
+        """Index all of the objects in a dictionary from scratch.
+
+        Args:
+            dictionary (dict): The indexed objects as ``{object_id: obj}``.
+        """
+        entries = []
+        self._multi_valued = 0
+        for object_id, obj in dictionary.items():
+            object_entries = list(self._iter_entries(object_id, obj))
+            if len(object_entries) > 1:
+                self._multi_valued += 1
+            entries.extend(object_entries)
+
+        self._entries = sorted(entries)
+        self._keys = [entry[0] for entry in self._entries]
+
+    def add(self, object_id, obj):
+        """Index an object, which is left unindexed if any of its values is
+        incomparable with the indexed values.
+
+        Args:
+            object_id (object): The id of the object.
+            obj (dict): The object.
+
+        Raises:
+            TypeError: If a value is incomparable.
+        """
+        # NOTE: the positions are all found before any insertion, and inserted
+        # from the last, so that the earlier positions are kept
+        entries = sorted(self._iter_entries(object_id, obj))
+        positions = [bisect.bisect_left(self._entries, entry)
+                for entry in entries]
+        if len(entries) > 1:
+            self._multi_valued += 1
+        for position, entry in reversed(list(zip(positions, entries))):
+            self._entries.insert(position, entry)
+            self._keys.insert(position, entry[0])
+
+    def remove(self, object_id, obj):
+        """Remove an indexed object.
+
+        Args:
+            object_id (object): The id of the object.
+            obj (dict): The object, as it was indexed.
+        """
+        entries = list(self._iter_entries(object_id, obj))
+        if len(entries) > 1:
+            self._multi_valued -= 1
+        for entry in entries:
+            position = bisect.bisect_left(self._entries, entry)
+            if (position < len(self._entries)
+                    and self._entries[position] == entry):
+                del self._entries[position]
+                del self._keys[position]
+
+    def _positions(self, lower=None, upper=None, include_lower=True,
+            include_upper=True):
+        start, stop = 0, len(self._keys)
+        if lower is not None:
+            bisect_func = bisect.bisect_left if include_lower else bisect.bisect_right
+            start = bisect_func(self._keys, self._sort_key(lower))
+        if upper is not None:
+            bisect_func = bisect.bisect_right if include_upper else bisect.bisect_left
+            stop = bisect_func(self._keys, self._sort_key(upper))
+
+        return start, max(start, stop)
+
+    def range(self, lower=None, upper=None, include_lower=True,
+            include_upper=True, reverse=False):
+        """Iterate over the ids of objects whose field is in a range, ordered
+        by the field value.
+
+        Args:
+            lower (object): The lower bound, ``None`` if unbounded.
+            upper (object): The upper bound, ``None`` if unbounded.
+            include_lower (bool): Include the objects equal to lower.
+            include_upper (bool): Include the objects equal to upper.
+            reverse (bool): Iterate in descending order.
+
+        Yields:
+            (object) -- The object id, once for each object.
+        """
+        start, stop = self._positions(
+                lower, upper, include_lower, include_upper)
+        positions = range(stop - 1, start - 1, -1) if reverse else range(start, stop)
+        entries = self._entries
+        yielded_ids = set()
+        for position in positions:
+            object_id = entries[position][1][1]
+            if object_id not in yielded_ids:
+                yielded_ids.add(object_id)
+                yield object_id
+
+    def count_range(self, lower=None, upper=None, include_lower=True,
+            include_upper=True):
+        """Count the indexed values in a range, which is the number of objects
+        unless the field is repeated.
+
+        Args:
+            lower (object): The lower bound, ``None`` if unbounded.
+            upper (object): The upper bound, ``None`` if unbounded.
+            include_lower (bool): Include the values equal to lower.
+            include_upper (bool): Include the values equal to upper.
+
+        Returns:
+            (int) -- The number of values.
+        """
+        start, stop = self._positions(
+                lower, upper, include_lower, include_upper)
+        return stop - start
+
+    def lookup(self, value):
+        """Get the ids of objects whose field equals to or contains a value.
+
+        Args:
+            value (object): The value.
+
+        Returns:
+            (list) -- The object ids.
+        """
+        return list(self.range(value, value))
+
+    def count(self, value):
+        """Count the objects whose field equals to or contains a value.
+
+        Args:
+            value (object): The value.
+
+        Returns:
+            (int) -- The number of values.
+        """
+        return self.count_range(value, value)
+
+    def min(self):
+        """Get the minimum value of the field.
+
+        Returns:
+            (object) -- The value, ``None`` if no value is indexed.
+        """
+        return self._entries[0][2] if self._entries else None
+
+    def max(self):
+        """Get the maximum value of the field.
+
+        Returns:
+            (object) -- The value, ``None`` if no value is indexed.
+        """
+        return self._entries[-1][2] if self._entries else None
+
+
+class IdIndex(object):
+    """This class is to keep the ids of objects sorted, for the pages of
+    queries ordered by id, which start after an id in O(log n + k).
+
+    Ids of different types are ordered by type name, then by id. The index is
+    built on the first use, see :py:meth:`ensure_built`, and kept by the
+    insertions and deletions after that, while updates never change it.
+
+    Attributes:
+        _keys (list): The sorted id keys as ``(type name, object_id)``,
+            ``None`` if not built.
+    """
+    def __init__(self):
+        self._keys = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys or ())
+
+    @property
+    def built(self):
+        """bool: True if the index is built.
+        """
+        return self._keys is not None
+
+    def reset(self):
+        """Drop the sorted ids, to be built again on the next use.
+        """
+        self._keys = None
+
+    def ensure_built(self, dictionary):
+        """Build the index from the ids of a dictionary if not built, which is
+        safe to be called from the threads reading the dictionary.
+
+        Args:
+            dictionary (dict): The indexed objects as ``{object_id: obj}``.
+        """
+        if self._keys is not None:
+            return
+
+        with self._lock:
+            if self._keys is None:
+                self._keys = sorted(map(_id_key, dictionary))
+
+    def add(self, object_id):
+        """Index an inserted id if built.
+
+        Args:
+            object_id (object): The id of the object.
+        """
+        if self._keys is None:
+            return
+
+        key = _id_key(object_id)
+        position = bisect.bisect_left(self._keys, key)
+        if position == len(self._keys) or self._keys[position] != key:
+            self._keys.insert(position, key)
+
+    def remove(self, object_id):
+        """Remove a deleted id if built.
+
+        Args:
+            object_id (object): The id of the object.
+        """
+        if self._keys is None:
+            return
+
+        key = _id_key(object_id)
+        position = bisect.bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            del self._keys[position]
+
+    def range(self, after=None):
+        """Iterate over the ids in order.
+
+        Args:
+            after (tuple): The id key to start after, ``None`` to start from
+                the first id.
+
+        Yields:
+            (object) -- The object id.
+        """
+        keys = self._keys
+        start = 0 if after is None else bisect.bisect_right(keys, after)
+        for position in range(start, len(keys)):
+            yield keys[position][1]
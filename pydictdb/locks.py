@@ -0,0 +1,125 @@
+import contextlib
+import threading
+
+
+class _Holding(object):
+    __slots__ = ('_acquire', '_release')
+
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._release()
+
+
+class ReadWriteLock(object):
+    """This class is to let many threads read at the same time, while a
+    writing thread excludes all of the others.
+
+    The lock is reentrant: a thread holding the write lock can acquire the
+    read or write lock again, and a thread holding the read lock can acquire
+    the read lock again, even if a writer is waiting. Waiting writers go
+    before the new readers, so writers never starve.
+
+    Attributes:
+        reader (object): The context manager to hold the read lock.
+        writer (object): The context manager to hold the write lock.
+    """
+    def __init__(self):
+        # NOTE: the mutex is the lock of the condition, entered in C
+        self._mutex = threading.Lock()
+        self._condition = threading.Condition(self._mutex)
+        self._readers = 0
+        self._writer = None
+        self._write_depth = 0
+        self._waiting_writers = 0
+        # NOTE: for each read lock held by the thread, if it is counted in
+        # self._readers, i.e. not acquired by the writer
+        self._local = threading.local()
+        self.reader = _Holding(self.acquire_read, self.release_read)
+        self.writer = _Holding(self.acquire_write, self.release_write)
+
+    def _read_stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def holds_read(self):
+        """Test if the current thread holds the read lock, which is not
+        acquired in the write lock, so that no thread is writing.
+
+        Returns:
+            (bool) -- True if held.
+        """
+        return any(self._read_stack())
+
+    def acquire_read(self):
+        stack = self._read_stack()
+        ident = threading.get_ident()
+        with self._mutex:
+            counted = self._writer != ident
+            if counted:
+                # NOTE: a reentrant reader never waits, or it deadlocks with
+                # the waiting writer
+                while not stack and (self._writer is not None
+                        or self._waiting_writers):
+                    self._condition.wait()
+                self._readers += 1
+
+        stack.append(counted)
+
+    def release_read(self):
+        counted = self._read_stack().pop()
+        if counted:
+            with self._mutex:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    def acquire_write(self):
+        ident = threading.get_ident()
+        with self._mutex:
+            if self._writer == ident:
+                self._write_depth += 1
+                return
+
+            if any(self._read_stack()):
+                raise RuntimeError("cannot acquire the write lock while "
+                        "holding the read lock")
+
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+
+            self._writer = ident
+            self._write_depth = 1
+
+    def release_write(self):
+        with self._mutex:
+            if self._writer != threading.get_ident():
+                raise RuntimeError("cannot release the write lock not held")
+
+            self._write_depth -= 1
+            if not self._write_depth:
+                self._writer = None
+                self._condition.notify_all()
+
+
+class NullLock(object):
+    """This class is to provide the interface of :py:class:`ReadWriteLock`
+    without locking, for a database used in a thread.
+    """
+    reader = contextlib.nullcontext()
+    writer = contextlib.nullcontext()
+
+    def holds_read(self):
+        return False
@@ -1,7 +1,110 @@
 import abc
+import array
+import bz2
+import collections.abc
+import concurrent.futures
+import contextlib
 import copy
 import json
+import lzma
+import marshal
+import mmap
 import os
+import pickle
+import struct
+import sys
+import threading
+import urllib.parse
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+DURABILITY_NONE = 'none'
+DURABILITY_FLUSH = 'flush'
+DURABILITY_FSYNC = 'fsync'
+DURABILITIES = (DURABILITY_NONE, DURABILITY_FLUSH, DURABILITY_FSYNC)
+
+
+# NOTE: each module provides compress and decompress of bytes
+COMPRESSIONS = {'zlib': zlib, 'lzma': lzma, 'bz2': bz2}
+
+
+def _validate_durability(durability):
+    if durability not in DURABILITIES:
+        raise ValueError("invalid durability %s, must be one of %s" % (
+                repr(durability), ', '.join(map(repr, DURABILITIES))))
+
+
+def _sync(fp, durability):
+    # NOTE: 'none' leaves the content in the buffer of the file object,
+    # 'flush' hands it to the OS, and 'fsync' waits until it is on the disk
+    if durability == DURABILITY_NONE:
+        return
+
+    fp.flush()
+    if durability == DURABILITY_FSYNC:
+        os.fsync(fp.fileno())
+
+
+def _fsync_directory(path):
+    # NOTE: a renamed file survives a crash only if its directory is synced
+    try:
+        fd = os.open(os.path.dirname(path), os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class _LockFile(object):
+    """This class is to lock a storage across processes by :py:func:`fcntl.flock`
+    on a file, which also holds the generation of the storage increased by
+    each write.
+
+    The lock is advisory, and only excludes the processes, so the threads of a
+    process are serialized by the caller.
+
+    Args:
+        path (str): The path of the lock file, created if not existed.
+    """
+    _size = 20
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise NotImplementedError("fcntl is not supported on this platform")
+
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    @contextlib.contextmanager
+    def hold(self, shared=False):
+        fcntl.flock(self._fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def generation(self):
+        content = os.pread(self._fd, self._size, 0)
+        return int(content) if content.strip() else 0
+
+    def increase(self):
+        # NOTE: written in place at a fixed width, held by the write lock
+        os.pwrite(self._fd, b'%020d' % (self.generation() + 1), 0)
 
 
 class Storage(abc.ABC):
@@ -16,6 +119,103 @@ class Storage(abc.ABC):
     def write(self, data):
         raise NotImplementedError
 
+    def write_changes(self, changes):
+        """Write only the changed objects, optional for the storages which can
+        apply deltas, otherwise :py:meth:`write` is called with the whole data.
+
+        Args:
+            changes (dict): The changed objects as
+                ``{kind: {object_id: obj}}``, where ``obj`` is ``None`` if the
+                object is deleted.
+
+        Raises:
+            NotImplementedError: If the storage can not apply deltas.
+        """
+        raise NotImplementedError
+
+    def kinds(self):
+        """List the stored kinds, optional for the storages which can read a
+        kind alone by :py:meth:`read_kind`, then a database reads each kind
+        when it is first used instead of :py:meth:`read` at once.
+
+        Returns:
+            (list) -- The kinds.
+
+        Raises:
+            NotImplementedError: If the storage can not read a kind alone.
+        """
+        raise NotImplementedError
+
+    def read_kind(self, kind):
+        """Read the objects of a kind, see :py:meth:`kinds`.
+
+        Args:
+            kind (str): The kind.
+
+        Returns:
+            (dict) -- The objects as ``{object_id: obj}``.
+
+        Raises:
+            NotImplementedError: If the storage can not read a kind alone.
+        """
+        raise NotImplementedError
+
+    def write_kinds(self, tables):
+        """Write the whole objects of some kinds and leave the other kinds
+        unchanged, optional for the storages which store the kinds apart,
+        otherwise :py:meth:`write` is called with the whole data.
+
+        Args:
+            tables (dict): The objects of the written kinds, as
+                ``{kind: {object_id: obj}}``.
+
+        Raises:
+            NotImplementedError: If the storage can not write a kind alone.
+        """
+        raise NotImplementedError
+
+    def lock(self, shared=False):
+        """Lock the storage across processes, optional for the storages which
+        can be shared by processes, see :py:meth:`version`.
+
+        Args:
+            shared (bool): Take the shared lock for reading instead of the
+                exclusive one for writing.
+
+        Returns:
+            (contextlib.AbstractContextManager) -- The context holding the
+            lock.
+
+        Raises:
+            NotImplementedError: If the storage can not be shared.
+        """
+        raise NotImplementedError
+
+    def version(self):
+        """Get the version of the stored data, which changes on each write
+        of any process once :py:meth:`lock` is used, so a process reads the
+        storage again only if the version changes.
+
+        Returns:
+            (object) -- The version.
+
+        Raises:
+            NotImplementedError: If the storage can not be shared.
+        """
+        raise NotImplementedError
+
+    def kind_versions(self):
+        """Get the version of each kind, optional for the storages which can
+        read a kind alone, so only the changed kinds are read again.
+
+        Returns:
+            (dict) -- The versions as ``{kind: version}``.
+
+        Raises:
+            NotImplementedError: If the storage has no version of a kind.
+        """
+        raise NotImplementedError
+
 
 class MemoryStorage(Storage):
     """This class is to read and write data in an isolated dict in memory.
@@ -45,6 +245,21 @@ class MemoryStorage(Storage):
 
         self._memory = copy.deepcopy(data)
 
+    def write_changes(self, changes):
+        """Write the changed objects to the memory.
+
+        Args:
+            changes (dict): The changed objects, see
+                :py:meth:`Storage.write_changes`.
+        """
+        for kind, objects in changes.items():
+            table = self._memory.setdefault(kind, {})
+            for object_id, obj in objects.items():
+                if obj is None:
+                    table.pop(object_id, None)
+                else:
+                    table[object_id] = copy.deepcopy(obj)
+
 
 class FileStorage(Storage):
     """This class is to read and write data in a file.
@@ -52,22 +267,91 @@ class FileStorage(Storage):
     Args:
         path (str): The absolute or relative path of the file, created if not
             existed.
+        durability (str): How far a write goes before it returns, one of
+            ``'none'`` (buffered in the process), ``'flush'`` (handed to the
+            OS) and ``'fsync'`` (on the disk), see below.
+        atomic (bool): Write a temporary file and rename it over the file, so
+            a crash never leaves a partially written file.
+        compression (str): Compress the encoded content by one of ``'zlib'``,
+            ``'lzma'`` and ``'bz2'``, ``None`` to write it as it is.
+
+    What a crash can lose by the durability:
+
+    * ``'none'``: the writes still buffered are lost if the process crashes.
+      The whole file is rewritten by each write, so its content is always
+      flushed after the truncation, and ``'none'`` is the same as
+      ``'flush'`` here. The appended records of
+      :py:class:`JournalStorage` are buffered, and the ones not flushed are
+      lost.
+    * ``'flush'``: nothing is lost if the process crashes, but the writes
+      not on the disk yet are lost if the OS crashes or the power fails.
+    * ``'fsync'``: nothing written is lost, as the file, and the directory
+      of a renamed file, are on the disk before the write returns.
+
+    A crash while writing in place without ``atomic`` can still leave a
+    partially written file, whatever the durability.
 
     Attributes:
-        _fp (io.TextIOWrapper): An I/O wrapper to handle a file.
+        binary (bool): The class attribute, True if :py:meth:`encode` returns
+            bytes instead of str.
+        _fp (io.IOBase): An I/O wrapper to handle a file, in binary mode if
+            the content is bytes or compressed.
     """
-    def __init__(self, path):
-        path = os.path.abspath(path)
+    binary = False
+
+    def __init__(self, path, durability=DURABILITY_FLUSH, atomic=False,
+            compression=None):
+        _validate_durability(durability)
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError("invalid compression %s, must be one of %s" % (
+                    repr(compression), ', '.join(map(repr, COMPRESSIONS))))
+
+        self.path = path = os.path.abspath(path)
+        self.durability = durability
+        self.atomic = atomic
+        self.compression = compression
+        self._mode = 'r+b' if self.binary or compression else 'r+'
         # create if not existed
         if not os.path.exists(path):
             open(path, 'w').close()
 
-        self._fp = open(path, 'r+')
+        self._fp = open(path, self._mode)
+        # created on the first lock, see `lock`
+        self._lock_file = None
 
     def close(self):
         """Close the attribute :py:attr:`_fp`.
         """
         self._fp.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+
+    def lock(self, shared=False):
+        """Lock the file across processes by a lock file of the suffix
+        ``.lock``, see :py:meth:`Storage.lock`.
+
+        Args:
+            shared (bool): Take the shared lock instead of the exclusive one.
+
+        Returns:
+            (contextlib.AbstractContextManager) -- The context holding the
+            lock.
+        """
+        if self._lock_file is None:
+            self._lock_file = _LockFile(self.path + '.lock')
+
+        return self._lock_file.hold(shared=shared)
+
+    def version(self):
+        """Get the generation in the lock file, see :py:meth:`Storage.version`.
+
+        Returns:
+            (int) -- The generation.
+        """
+        if self._lock_file is None:
+            self._lock_file = _LockFile(self.path + '.lock')
+
+        return self._lock_file.generation()
 
     def read(self):
         """Read and decode content from the file, which call :py:meth:`decode`
@@ -76,8 +360,15 @@ class FileStorage(Storage):
         Returns:
             (dict) -- The decoded data.
         """
+        self._reopen_if_replaced()
         self._fp.seek(0)
         content = self._fp.read()
+        if self.compression is not None:
+            if content:
+                content = COMPRESSIONS[self.compression].decompress(content)
+            if not self.binary:
+                content = content.decode('utf-8')
+
         return self.__class__.decode(content)
 
     def write(self, data):
@@ -88,10 +379,52 @@ class FileStorage(Storage):
             data (dict): The data to be written.
         """
         content = self.__class__.encode(data)
-        self._fp.seek(0)
-        self._fp.truncate()
-        self._fp.write(content)
-        self._fp.flush()
+        if self.compression is not None:
+            if not self.binary:
+                content = content.encode('utf-8')
+            content = COMPRESSIONS[self.compression].compress(content)
+
+        if self.atomic:
+            self._write_atomic(content)
+        else:
+            self._reopen_if_replaced()
+            self._fp.seek(0)
+            self._fp.truncate()
+            self._fp.write(content)
+            # NOTE: the truncated file is never left empty with the content
+            # in the buffer, so it is flushed even if the durability is 'none'
+            _sync(self._fp, self.durability if self.durability == DURABILITY_FSYNC
+                    else DURABILITY_FLUSH)
+
+        if self._lock_file is not None:
+            self._lock_file.increase()
+
+    def _reopen_if_replaced(self):
+        # NOTE: the file is replaced by the atomic writes of other processes
+        # sharing it, then the opened one is stale
+        try:
+            replaced = (os.stat(self.path).st_ino
+                    != os.fstat(self._fp.fileno()).st_ino)
+        except FileNotFoundError:
+            return
+
+        if replaced:
+            self._fp.close()
+            self._fp = open(self.path, self._mode)
+
+    def _write_atomic(self, content):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, self._mode.replace('r+', 'w')) as fp:
+            fp.write(content)
+            # NOTE: the content is always flushed before the rename
+            _sync(fp, self.durability if self.durability == DURABILITY_FSYNC
+                    else DURABILITY_FLUSH)
+
+        self._fp.close()
+        os.replace(temp_path, self.path)
+        self._fp = open(self.path, self._mode)
+        if self.durability == DURABILITY_FSYNC:
+            _fsync_directory(self.path)
 
     @classmethod
     def decode(cls, content):
@@ -147,3 +480,837 @@ class JsonStorage(FileStorage):
             (str) -- The encoded text content.
         """
         return json.dumps(data)
+
+
+class PickleStorage(FileStorage):
+    """This class is to read and write data in a binary file by
+    :py:mod:`pickle` of protocol 5, which keeps the types of ids and values
+    and decodes faster than JSON, but must be read only from trusted files.
+    """
+    binary = True
+
+    @classmethod
+    def decode(cls, content):
+        """Decode bytes to dict.
+
+        Args:
+            content (bytes): The encoded content.
+
+        Returns:
+            (dict) -- The decoded data.
+        """
+        if content:
+            return pickle.loads(content)
+
+        return {}
+
+    @classmethod
+    def encode(cls, data):
+        """Encode dict to bytes.
+
+        Args:
+            data (dict): The decoded data.
+
+        Returns:
+            (bytes) -- The encoded content.
+        """
+        return pickle.dumps(data, protocol=5)
+
+
+class MarshalStorage(FileStorage):
+    """This class is to read and write data in a binary file by
+    :py:mod:`marshal`, the fastest codec of the builtin types, whose format
+    may change between versions of Python.
+    """
+    binary = True
+
+    @classmethod
+    def decode(cls, content):
+        """Decode bytes to dict.
+
+        Args:
+            content (bytes): The encoded content.
+
+        Returns:
+            (dict) -- The decoded data.
+        """
+        if content:
+            return marshal.loads(content)
+
+        return {}
+
+    @classmethod
+    def encode(cls, data):
+        """Encode dict to bytes.
+
+        Args:
+            data (dict): The decoded data.
+
+        Returns:
+            (bytes) -- The encoded content.
+        """
+        return marshal.dumps(data)
+
+
+class JsonLinesStorage(Storage):
+    """This class is to read and write data in a JSON Lines file, where each
+    line is the record of an object, as ``{"kind": ..., "id": ..., "obj":
+    ...}``, so the file is read line by line without holding its whole
+    content, and can be processed by line-oriented tools. A kind without
+    objects is not stored.
+
+    The lines of a table are also streamed by
+    :py:meth:`pydictdb.core.Table.iter_export`.
+
+    Args:
+        path (str): The absolute or relative path of the file, created if not
+            existed.
+        durability (str): How far a write goes before it returns, see
+            :py:class:`FileStorage`.
+    """
+    def __init__(self, path, durability=DURABILITY_FLUSH):
+        _validate_durability(durability)
+        self.path = os.path.abspath(path)
+        self.durability = durability
+        if not os.path.exists(self.path):
+            open(self.path, 'w').close()
+
+    @staticmethod
+    def encode_line(kind, object_id, obj):
+        """Encode the record of an object to a line.
+
+        Args:
+            kind (str): The kind of the object.
+            object_id (object): The id of the object.
+            obj (dict): The object.
+
+        Returns:
+            (str) -- The line, ended with a newline.
+        """
+        return '{"kind": %s, "id": %s, "obj": %s}\n' % (
+                json.dumps(kind), json.dumps(object_id), json.dumps(obj))
+
+    def iter_records(self):
+        """Iterate over the records in the file, reading a line at a time.
+
+        Yields:
+            (tuple) -- The kind, id and object of each record.
+        """
+        with open(self.path, 'r') as fp:
+            for line in fp:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record['kind'], record['id'], record['obj']
+
+    def read(self):
+        """Read the records in the file line by line.
+
+        Returns:
+            (dict) -- The data.
+        """
+        data = {}
+        for kind, object_id, obj in self.iter_records():
+            data.setdefault(kind, {})[object_id] = obj
+
+        return data
+
+    def write(self, data):
+        """Write a line for each object to a temporary file, and rename it over
+        the file.
+
+        Args:
+            data (dict): The written data.
+        """
+        if not isinstance(data, dict):
+            raise TypeError("argument 'data' must be dict, but %s" % (type(data).__name__))
+
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as fp:
+            fp.writelines(self.encode_line(kind, object_id, obj)
+                    for kind, objects in data.items()
+                    for object_id, obj in objects.items())
+            _sync(fp, self.durability if self.durability == DURABILITY_FSYNC
+                    else DURABILITY_FLUSH)
+
+        os.replace(temp_path, self.path)
+        if self.durability == DURABILITY_FSYNC:
+            _fsync_directory(self.path)
+
+
+class JournalStorage(Storage):
+    """This class is to store data as an append-only journal of object records,
+    so a commit appends only the changed objects instead of rewriting the whole
+    file.
+
+    Each line of the file is a JSON record, either
+    ``{"op": "put", "kind": ..., "id": ..., "obj": ...}`` or
+    ``{"op": "delete", "kind": ..., "id": ...}``. :py:meth:`read` replays the
+    records in order, and :py:meth:`compact` rewrites the journal as a snapshot
+    holding one ``put`` record per live object.
+
+    Args:
+        path (str): The absolute or relative path of the file, created if not
+            existed.
+        compact_threshold (int): Compact the journal once the size of the
+            overwritten and deleted records exceeds both this threshold and
+            the size of the live records, ``None`` to compact only on demand.
+        background (bool): Compact in a background thread instead of the
+            writing one.
+        durability (str): How far an append goes before it returns, see
+            :py:class:`FileStorage`.
+
+    Attributes:
+        _fp (io.TextIOWrapper): An I/O wrapper to append records to the file.
+        _records (dict): The encoded object of each live record, as
+            ``{kind: {object_id: str}}``.
+    """
+    def __init__(self, path, compact_threshold=4 * 1024 * 1024,
+            background=False, durability=DURABILITY_FLUSH):
+        _validate_durability(durability)
+        self.path = os.path.abspath(path)
+        self.durability = durability
+        self.compact_threshold = compact_threshold
+        self.background = background
+        self._fp = open(self.path, 'a+')
+        self._records = {}
+        self._size = 0
+        self._live_size = 0
+        self._lock = threading.RLock()
+        # lines appended while a background compaction is writing the snapshot
+        self._pending_lines = None
+        self._compaction = None
+
+    def close(self):
+        """Wait for any background compaction and close the attribute
+        :py:attr:`_fp`.
+        """
+        self.wait()
+        self._fp.close()
+
+    @staticmethod
+    def _put_line(kind, object_id, encoded_obj):
+        return '{"op": "put", "kind": %s, "id": %s, "obj": %s}\n' % (
+                json.dumps(kind), json.dumps(object_id), encoded_obj)
+
+    @staticmethod
+    def _delete_line(kind, object_id):
+        return '{"op": "delete", "kind": %s, "id": %s}\n' % (
+                json.dumps(kind), json.dumps(object_id))
+
+    def read(self):
+        """Replay the records in the file.
+
+        A truncated last record, left by an interrupted append, is ignored and
+        cut from the file.
+
+        Returns:
+            (dict) -- The replayed data.
+        """
+        with self._lock:
+            self._fp.seek(0)
+            lines = self._fp.read().splitlines(keepends=True)
+            data = {}
+            self._records = {}
+            self._size = 0
+            self._live_size = 0
+            # NOTE: the size of the complete records in bytes
+            end = 0
+            for index, line in enumerate(lines):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    if index == len(lines) - 1:
+                        # NOTE: or the next append is glued to the torn one
+                        self._fp.truncate(end)
+                        break
+                    raise
+
+                if not line.endswith('\n'):
+                    # NOTE: complete but the newline is not written
+                    self._fp.write('\n')
+                    _sync(self._fp, self.durability)
+                    line += '\n'
+
+                end += len(line.encode('utf-8'))
+                self._size += len(line)
+                kind, object_id = record['kind'], record['id']
+                if record['op'] == 'put':
+                    data.setdefault(kind, {})[object_id] = record['obj']
+                    self._set_record(kind, object_id, json.dumps(record['obj']))
+                else:
+                    data.get(kind, {}).pop(object_id, None)
+                    self._set_record(kind, object_id, None)
+
+            return data
+
+    def write(self, data):
+        """Append a record for each object which differs from the last written
+        data, and a ``delete`` record for each object which is not in data.
+
+        Args:
+            data (dict): The written data.
+        """
+        if not isinstance(data, dict):
+            raise TypeError("argument 'data' must be dict, but %s" % (type(data).__name__))
+
+        changes = []
+        with self._lock:
+            for kind, records in self._records.items():
+                table = data.get(kind, {})
+                for object_id in records:
+                    if object_id not in table:
+                        changes.append((kind, object_id, None))
+
+            for kind, table in data.items():
+                records = self._records.get(kind, {})
+                for object_id, obj in table.items():
+                    encoded_obj = json.dumps(obj)
+                    if records.get(object_id, None) != encoded_obj:
+                        changes.append((kind, object_id, encoded_obj))
+
+            self._append(changes)
+
+    def write_changes(self, changes):
+        """Append a record for each changed object.
+
+        Args:
+            changes (dict): The changed objects, see
+                :py:meth:`Storage.write_changes`.
+        """
+        records = []
+        with self._lock:
+            for kind, objects in changes.items():
+                last_records = self._records.get(kind, {})
+                for object_id, obj in objects.items():
+                    if obj is None:
+                        if object_id in last_records:
+                            records.append((kind, object_id, None))
+                        continue
+
+                    encoded_obj = json.dumps(obj)
+                    if last_records.get(object_id, None) != encoded_obj:
+                        records.append((kind, object_id, encoded_obj))
+
+            self._append(records)
+
+    def _set_record(self, kind, object_id, encoded_obj):
+        records = self._records.setdefault(kind, {})
+        old_line_size = 0
+        if object_id in records:
+            old_line_size = len(
+                    self._put_line(kind, object_id, records[object_id]))
+
+        if encoded_obj is None:
+            records.pop(object_id, None)
+            self._live_size -= old_line_size
+        else:
+            records[object_id] = encoded_obj
+            self._live_size += len(
+                    self._put_line(kind, object_id, encoded_obj)) - old_line_size
+
+    def _append(self, changes):
+        if not changes:
+            return
+
+        lines = []
+        for kind, object_id, encoded_obj in changes:
+            if encoded_obj is None:
+                lines.append(self._delete_line(kind, object_id))
+            else:
+                lines.append(self._put_line(kind, object_id, encoded_obj))
+            self._set_record(kind, object_id, encoded_obj)
+
+        content = ''.join(lines)
+        self._fp.write(content)
+        _sync(self._fp, self.durability)
+        self._size += len(content)
+        if self._pending_lines is not None:
+            self._pending_lines.extend(lines)
+
+        if self._needs_compaction():
+            if self.background:
+                self.compact_in_background()
+            else:
+                self.compact()
+
+    def _needs_compaction(self):
+        if self.compact_threshold is None or self._compaction is not None:
+            return False
+
+        garbage_size = self._size - self._live_size
+        return garbage_size > max(self.compact_threshold, self._live_size)
+
+    def _snapshot_lines(self):
+        return [self._put_line(kind, object_id, encoded_obj)
+                for kind, records in self._records.items()
+                for object_id, encoded_obj in records.items()]
+
+    def _write_snapshot(self, lines):
+        temp_path = self.path + '.compact'
+        with open(temp_path, 'w') as fp:
+            fp.writelines(lines)
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        return temp_path
+
+    def _replace_file(self, temp_path, size):
+        self._fp.close()
+        os.replace(temp_path, self.path)
+        self._fp = open(self.path, 'a+')
+        self._size = size
+        if self.durability == DURABILITY_FSYNC:
+            _fsync_directory(self.path)
+
+    def compact(self):
+        """Rewrite the journal as a snapshot of the live records.
+        """
+        self.wait()
+        with self._lock:
+            lines = self._snapshot_lines()
+            temp_path = self._write_snapshot(lines)
+            self._replace_file(temp_path, sum(len(line) for line in lines))
+
+    def compact_in_background(self):
+        """Rewrite the journal as a snapshot of the live records in a
+        background thread, while records can still be appended.
+        """
+        with self._lock:
+            if self._compaction is not None:
+                return
+
+            lines = self._snapshot_lines()
+            self._pending_lines = []
+            self._compaction = threading.Thread(
+                    target=self._compact_in_background, args=(lines,),
+                    daemon=True)
+            self._compaction.start()
+
+    def _compact_in_background(self, lines):
+        try:
+            temp_path = self._write_snapshot(lines)
+            with self._lock:
+                pending_lines = self._pending_lines
+                with open(temp_path, 'a') as fp:
+                    fp.writelines(pending_lines)
+
+                self._replace_file(temp_path, sum(len(line) for line in lines)
+                        + sum(len(line) for line in pending_lines))
+        finally:
+            with self._lock:
+                self._pending_lines = None
+                self._compaction = None
+
+    def wait(self):
+        """Wait for the running background compaction, if any.
+        """
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
+
+
+_UNLOADED = object()
+
+
+class _MappedObjects(collections.abc.MutableMapping):
+    """This class is to hold the objects of a kind in a file mapped by
+    :py:class:`MmapStorage`, decoding each object on first access.
+
+    The ids and record offsets of the kind are read on first use of the
+    mapping, and a record is decoded once when its object is got, then the
+    decoded object replaces the record in the mapping.
+
+    Args:
+        buffer (mmap.mmap): The mapped file.
+        ids_offset (int): The offset of the ids of the kind in buffer.
+        ids_length (int): The length of the ids of the kind.
+        offsets_offset (int): The offset of the record offsets of the kind.
+
+    Attributes:
+        _objects (dict): The objects as ``{object_id: obj}``, where ``obj`` is
+            ``_UNLOADED`` until decoded, ``None`` until the ids are read.
+        _positions (dict): The position of each object in the records as
+            read, as ``{object_id: position}``.
+        _offsets (array.array): The offsets of the records, and the end of the
+            last one.
+    """
+    def __init__(self, buffer, ids_offset, ids_length, offsets_offset):
+        self._buffer = buffer
+        self._spans = (ids_offset, ids_length, offsets_offset)
+        self._objects = None
+        self._positions = None
+        self._offsets = None
+
+    def _load(self):
+        if self._objects is None:
+            ids_offset, ids_length, offsets_offset = self._spans
+            object_ids = json.loads(
+                    self._buffer[ids_offset:ids_offset + ids_length])
+            offsets = array.array('Q')
+            offsets.frombytes(self._buffer[offsets_offset:
+                    offsets_offset + (len(object_ids) + 1) * offsets.itemsize])
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+
+            self._offsets = offsets
+            self._positions = dict(zip(object_ids, range(len(object_ids))))
+            self._objects = dict.fromkeys(object_ids, _UNLOADED)
+
+        return self._objects
+
+    def _record(self, object_id):
+        position = self._positions[object_id]
+        return self._buffer[
+                self._offsets[position]:self._offsets[position + 1]]
+
+    def __getitem__(self, object_id):
+        objects = self._load()
+        obj = objects[object_id]
+        if obj is _UNLOADED:
+            # NOTE: the position is kept, so readers in parallel may both
+            # decode it
+            obj = objects[object_id] = json.loads(self._record(object_id))
+
+        return obj
+
+    def get(self, object_id, default=None):
+        try:
+            return self[object_id]
+        except KeyError:
+            return default
+
+    def __setitem__(self, object_id, obj):
+        self._load()[object_id] = obj
+
+    def __delitem__(self, object_id):
+        del self._load()[object_id]
+
+    def __contains__(self, object_id):
+        return object_id in self._load()
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __copy__(self):
+        # NOTE: the copy shares the buffer and decodes objects on its own
+        mapped = self.__class__(self._buffer, *self._spans)
+        if self._objects is not None:
+            mapped._objects = dict(self._objects)
+            mapped._positions = self._positions
+            mapped._offsets = self._offsets
+
+        return mapped
+
+    def __repr__(self):
+        return '%s(%d objects)' % (self.__class__.__name__, len(self))
+
+    def _iter_records(self):
+        # NOTE: the records not decoded yet are copied without decoding
+        for object_id, obj in self._load().items():
+            if obj is _UNLOADED:
+                yield object_id, self._record(object_id)
+            else:
+                yield object_id, MmapStorage.encode_object(obj)
+
+
+class MmapStorage(Storage):
+    """This class is to store data in a binary file which is mapped in memory
+    and decoded lazily, so opening a database reads only the list of kinds,
+    and an object is decoded when it is first accessed.
+
+    The file starts with a header of the magic bytes ``PYDICTDB``, the offset
+    and the length of the kind index, as 64-bit little-endian integers. The
+    records of each kind, which are the JSON encoded objects, are followed by
+    the JSON array of their ids, and the offsets of the records and the end of
+    the last one, as 64-bit little-endian integers. The kind index is a JSON
+    object locating them, as ``{kind: [ids_offset, ids_length,
+    offsets_offset]}``.
+
+    :py:meth:`read` returns a mapping for each kind in place of dict, see
+    :py:class:`_MappedObjects`, and :py:meth:`write` rewrites the file as a
+    temporary one which is renamed over the file, copying the records of the
+    objects never decoded as they are.
+
+    Args:
+        path (str): The absolute or relative path of the file, created if not
+            existed.
+        durability (str): How far a write goes before it returns, see
+            :py:class:`FileStorage`.
+    """
+    MAGIC = b'PYDICTDB'
+    _header = struct.Struct('<8sQQ')
+
+    def __init__(self, path, durability=DURABILITY_FLUSH):
+        _validate_durability(durability)
+        self.path = os.path.abspath(path)
+        self.durability = durability
+        if not os.path.exists(self.path):
+            self.write({})
+
+    @staticmethod
+    def encode_object(obj):
+        """Encode an object to a record.
+
+        Args:
+            obj (dict): The object.
+
+        Returns:
+            (bytes) -- The record.
+        """
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+    def read(self):
+        """Map the file and read the kind index.
+
+        Returns:
+            (dict) -- The objects of each kind, as
+            ``{kind: _MappedObjects}``.
+        """
+        with open(self.path, 'rb') as fp:
+            buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic = buffer[:len(self.MAGIC)]
+        if len(buffer) < self._header.size or magic != self.MAGIC:
+            raise ValueError("not a file of %s: %s" % (
+                    self.__class__.__name__, self.path))
+
+        _, offset, length = self._header.unpack_from(buffer)
+        kinds = json.loads(buffer[offset:offset + length])
+        return {kind: _MappedObjects(buffer, *spans)
+                for kind, spans in kinds.items()}
+
+    def write(self, data):
+        """Write data to a temporary file and rename it over the file.
+
+        Args:
+            data (dict): The written data, of which each kind is a dict or a
+                mapping returned by :py:meth:`read`.
+        """
+        if not isinstance(data, dict):
+            raise TypeError("argument 'data' must be dict, but %s" % (type(data).__name__))
+
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as fp:
+            fp.write(self._header.pack(self.MAGIC, 0, 0))
+            position = self._header.size
+            kinds = {}
+            for kind, objects in data.items():
+                if isinstance(objects, _MappedObjects):
+                    records = objects._iter_records()
+                else:
+                    records = ((object_id, self.encode_object(obj))
+                            for object_id, obj in objects.items())
+
+                object_ids = []
+                offsets = array.array('Q')
+                for object_id, record in records:
+                    fp.write(record)
+                    object_ids.append(object_id)
+                    offsets.append(position)
+                    position += len(record)
+                offsets.append(position)
+
+                encoded_ids = json.dumps(
+                        object_ids, separators=(',', ':')).encode()
+                fp.write(encoded_ids)
+                kinds[kind] = [position, len(encoded_ids),
+                        position + len(encoded_ids)]
+                if sys.byteorder != 'little':
+                    offsets.byteswap()
+                fp.write(offsets.tobytes())
+                position += len(encoded_ids) + len(offsets) * offsets.itemsize
+
+            index = json.dumps(kinds).encode()
+            fp.write(index)
+            fp.seek(0)
+            fp.write(self._header.pack(self.MAGIC, position, len(index)))
+            _sync(fp, self.durability if self.durability == DURABILITY_FSYNC
+                    else DURABILITY_FLUSH)
+
+        # NOTE: the mappings of the replaced file stay valid
+        os.replace(temp_path, self.path)
+        if self.durability == DURABILITY_FSYNC:
+            _fsync_directory(self.path)
+
+
+class DirectoryStorage(Storage):
+    """This class is to store each kind in a JSON file of a directory, so a
+    kind is read when a database first uses it, and a commit rewrites only
+    the files of the changed kinds, in parallel on a thread pool.
+
+    The file of a kind is named by the kind quoted for URLs, with the
+    extension ``.json``, and written as a temporary file renamed over it.
+
+    Args:
+        path (str): The absolute or relative path of the directory, created if
+            not existed.
+        max_workers (int): The maximum number of threads writing files,
+            ``None`` for the default of
+            :py:class:`concurrent.futures.ThreadPoolExecutor`.
+        durability (str): How far a write goes before it returns, see
+            :py:class:`FileStorage`.
+    """
+    EXTENSION = '.json'
+
+    def __init__(self, path, max_workers=None, durability=DURABILITY_FLUSH):
+        _validate_durability(durability)
+        self.path = os.path.abspath(path)
+        self.max_workers = max_workers
+        self.durability = durability
+        os.makedirs(self.path, exist_ok=True)
+        self._executor = None
+        self._lock = threading.Lock()
+        # created on the first lock, see `lock`
+        self._lock_file = None
+
+    def close(self):
+        """Shut down the threads writing files.
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+            if self._lock_file is not None:
+                self._lock_file.close()
+
+    def _get_lock_file(self):
+        with self._lock:
+            if self._lock_file is None:
+                # NOTE: not ended with the extension, so never taken as a kind
+                self._lock_file = _LockFile(os.path.join(self.path, '.lock'))
+
+            return self._lock_file
+
+    def lock(self, shared=False):
+        """Lock the directory across processes by the lock file ``.lock`` in
+        it, see :py:meth:`Storage.lock`.
+
+        Args:
+            shared (bool): Take the shared lock instead of the exclusive one.
+
+        Returns:
+            (contextlib.AbstractContextManager) -- The context holding the
+            lock.
+        """
+        return self._get_lock_file().hold(shared=shared)
+
+    def version(self):
+        """Get the generation in the lock file, see :py:meth:`Storage.version`.
+
+        Returns:
+            (int) -- The generation.
+        """
+        return self._get_lock_file().generation()
+
+    def kind_versions(self):
+        """Get the modification time, size and inode of the file of each kind,
+        which change on each write as the file is replaced.
+
+        Returns:
+            (dict) -- The versions as ``{kind: (mtime_ns, size, inode)}``.
+        """
+        versions = {}
+        for kind in self.kinds():
+            try:
+                stat = os.stat(self._kind_path(kind))
+            except FileNotFoundError:
+                continue
+            versions[kind] = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+        return versions
+
+    def _kind_path(self, kind):
+        return os.path.join(self.path,
+                urllib.parse.quote(kind, safe='') + self.EXTENSION)
+
+    def kinds(self):
+        """List the kinds of the files in the directory.
+
+        Returns:
+            (list) -- The kinds.
+        """
+        return [urllib.parse.unquote(name[:-len(self.EXTENSION)])
+                for name in sorted(os.listdir(self.path))
+                if name.endswith(self.EXTENSION)]
+
+    def read_kind(self, kind):
+        """Read the file of a kind.
+
+        Args:
+            kind (str): The kind.
+
+        Returns:
+            (dict) -- The objects, empty if the file is not existed.
+        """
+        try:
+            with open(self._kind_path(kind), 'r') as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            return {}
+
+    def read(self):
+        """Read the files of all of the kinds.
+
+        Returns:
+            (dict) -- The data.
+        """
+        return {kind: self.read_kind(kind) for kind in self.kinds()}
+
+    def write(self, data):
+        """Write the file of each kind in data, and remove the files of the
+        other kinds.
+
+        Args:
+            data (dict): The written data.
+        """
+        if not isinstance(data, dict):
+            raise TypeError("argument 'data' must be dict, but %s" % (type(data).__name__))
+
+        self.write_kinds(data)
+        for kind in self.kinds():
+            if kind not in data:
+                os.remove(self._kind_path(kind))
+
+    def write_kinds(self, tables):
+        """Write the files of some kinds in parallel.
+
+        Args:
+            tables (dict): The objects of the written kinds, see
+                :py:meth:`Storage.write_kinds`.
+        """
+        if len(tables) <= 1:
+            for kind, objects in tables.items():
+                self._write_kind(kind, objects)
+        else:
+            self._write_kinds_in_parallel(tables)
+
+        if self._lock_file is not None:
+            self._lock_file.increase()
+
+    def _write_kinds_in_parallel(self, tables):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix='pydictdb-storage')
+            futures = [self._executor.submit(self._write_kind, kind, objects)
+                    for kind, objects in tables.items()]
+
+        for future in futures:
+            future.result()
+
+    def _write_kind(self, kind, objects):
+        path = self._kind_path(kind)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as fp:
+            json.dump(objects if isinstance(objects, dict) else dict(objects),
+                    fp)
+            _sync(fp, self.durability if self.durability == DURABILITY_FSYNC
+                    else DURABILITY_FLUSH)
+
+        os.replace(temp_path, path)
+        if self.durability == DURABILITY_FSYNC:
+            _fsync_directory(path)
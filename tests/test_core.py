@@ -1,9 +1,31 @@
+import asyncio
+import copy
+import json
+import os
+import shutil
+import threading
 import unittest
 
 from pydictdb import core
+from pydictdb import ids
+from pydictdb import indexes
 from pydictdb import storages
 
 
+class RecordingStorage(storages.MemoryStorage):
+    def __init__(self):
+        super().__init__()
+        self.written = []
+
+    def write(self, data):
+        self.written.append(('write', data))
+        super().write(data)
+
+    def write_changes(self, changes):
+        self.written.append(('write_changes', changes))
+        super().write_changes(changes)
+
+
 class DatabaseTestCase(unittest.TestCase):
     def test_init_commit(self):
         sto = storages.MemoryStorage()
@@ -17,6 +39,376 @@ class DatabaseTestCase(unittest.TestCase):
         database.commit()
         self.assertEqual(database._tables, sto._memory)
 
+    def test_commit_changes(self):
+        sto = RecordingStorage()
+        database = core.Database(storage=sto)
+        table = database.table('User')
+        table.update_or_insert('001', {'name': 'Sam'})
+        # the first commit writes all of the tables
+        self.assertEqual(sto.written.pop(),
+                ('write', {'User': {'001': {'name': 'Sam'}}}))
+
+        table.update_or_insert('002', {'name': 'Tom'})
+        self.assertEqual(sto.written.pop(),
+                ('write_changes', {'User': {'002': {'name': 'Tom'}}}))
+
+        table.delete('001')
+        self.assertEqual(sto.written.pop(),
+                ('write_changes', {'User': {'001': None}}))
+
+        database.table('Group')
+        database.commit()
+        self.assertEqual(sto.written.pop(), ('write_changes', {'Group': {}}))
+        self.assertEqual(sto.read(), database._tables)
+
+    def test_commit_without_write_changes(self):
+        class FullStorage(storages.MemoryStorage):
+            def write_changes(self, changes):
+                raise NotImplementedError
+
+        sto = FullStorage()
+        database = core.Database(storage=sto)
+        database.table('User').insert({'name': 'Sam'})
+        database.table('User').insert({'name': 'Tom'})
+        self.assertEqual(sto.read(), database._tables)
+
+    def test_batch(self):
+        sto = RecordingStorage()
+        database = core.Database(storage=sto)
+        table = database.table('User')
+        with database.batch():
+            table.update_or_insert('001', {'name': 'Sam'})
+            table.update_or_insert('002', {'name': 'Tom'})
+            with database.batch():
+                table.update('001', {'name': 'John'})
+            self.assertEqual(sto.written, [])
+
+        self.assertEqual(len(sto.written), 1)
+        self.assertEqual(sto.read(), {'User': {
+            '001': {'name': 'John'}, '002': {'name': 'Tom'},
+        }})
+
+    def test_batch_rollback(self):
+        sto = RecordingStorage()
+        database = core.Database(storage=sto)
+        table = database.table('User')
+        table.update_or_insert('001', {'name': 'Sam'})
+        tables = copy.deepcopy(database._tables)
+        del sto.written[:]
+
+        with self.assertRaises(ValueError):
+            with database.batch():
+                table.update('001', {'name': 'Tom'})
+                table.insert({'name': 'John'})
+                with database.batch():
+                    table.delete('001')
+                raise ValueError
+
+        self.assertEqual(database._tables, tables)
+        self.assertEqual(sto.written, [])
+
+        # rollback only the inner batch
+        with database.batch():
+            table.update('001', {'name': 'Tom'})
+            with self.assertRaises(ValueError):
+                with database.batch():
+                    table.update('001', {'name': 'John'})
+                    table.insert({'name': 'John'})
+                    raise ValueError
+
+        self.assertEqual(database._tables, {'User': {'001': {'name': 'Tom'}}})
+        self.assertEqual(sto.read(), database._tables)
+
+    def test_multi_methods_in_batch(self):
+        sto = RecordingStorage()
+        database = core.Database(storage=sto)
+        table = database.table('User')
+        object_ids = table.insert_multi([{'name': 'Sam'}, {'name': 'Tom'}])
+        table.update_multi(object_ids, [{'name': 'John'}, {'name': 'Tom'}])
+        table.update_or_insert_multi(['001'], [{'name': 'Sam'}])
+        table.delete_multi(object_ids)
+        self.assertEqual(len(sto.written), 4)
+        self.assertEqual(sto.read(), {'User': {'001': {'name': 'Sam'}}})
+
+    def test_thread_safe(self):
+        path = os.path.abspath('.storage')
+        with open(path, 'w'):
+            pass
+        self.addCleanup(os.remove, path)
+
+        database = core.Database(storage=storages.JsonStorage(path),
+                thread_safe=True)
+        table = database.table('User')
+        table.create_index('score', ordered=True)
+
+        def write(n):
+            for i in range(50):
+                object_id = table.insert({'name': 'Sam', 'score': i})
+                table.update(object_id, {'name': 'Tom', 'score': n})
+                table.query().range('score', 0, 10).fetch()
+                table.get(object_id)
+            table.insert_multi([{'score': n}] * 10)
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with open(path) as f:
+            self.assertEqual(json.load(f), database._tables)
+        self.assertEqual(len(table.dictionary), 8 * 60)
+        self.assertEqual(len(table.indexes['score']), 8 * 60)
+        self.assertEqual(table.query().max('score'), 7)
+
+    def test_thread_safe_table_in_query(self):
+        sto = storages.MemoryStorage()
+        sto.write({'User': {'001': {'group': '001'}},
+                'Group': {'001': {'name': 'admin'}}})
+        database = core.Database(storage=sto, thread_safe=True)
+
+        # the table of a loaded kind is got in the read lock of the query
+        def has_group(obj):
+            return database.table('Group').get(obj['group']) is not None
+
+        query = database.table('User').query(has_group)
+        self.assertEqual(query.fetch(ids_only=True), ['001'])
+        self.assertIs(database.table('Group'), database.table('Group'))
+
+        # a new kind is created in the read lock
+        def has_item(obj):
+            return database.table('Item').get(obj['group']) is not None
+
+        self.assertEqual(database.table('User').query(has_item).fetch(), [])
+        self.assertIn('Item', database._tables)
+
+        # a kind is loaded in the read lock
+        path = os.path.abspath('.storage')
+        self.addCleanup(shutil.rmtree, path)
+        sto = storages.DirectoryStorage(path)
+        sto.write({'User': {'001': {'group': '001'}},
+                'Group': {'001': {'name': 'admin'}}})
+        database = core.Database(storage=sto, thread_safe=True)
+        query = database.table('User').query(has_group)
+        self.assertEqual(query.fetch(ids_only=True), ['001'])
+        self.assertEqual(database.table('Group').get('001'), {'name': 'admin'})
+
+    def test_background_commit(self):
+        sto = RecordingStorage()
+        database = core.Database(storage=sto, commit_threshold=3)
+        self.addCleanup(database.close)
+        self.assertTrue(database.thread_safe)
+        self.assertFalse(database.auto_commit)
+
+        table = database.table('User')
+        object_ids = table.insert_multi([{'name': 'Sam'}, {'name': 'Tom'}])
+        database.flush()
+        self.assertEqual(sto.read(), {'User': {
+            object_ids[0]: {'name': 'Sam'},
+            object_ids[1]: {'name': 'Tom'},
+        }})
+
+        # NOTE: the threshold wakes up the flusher
+        written = len(sto.written)
+        table.insert_multi([{'name': 'John'}] * 3)
+        for _ in range(100):
+            if len(sto.written) > written:
+                break
+            threading.Event().wait(0.01)
+        database.flush()
+        self.assertEqual(sto.read(), database._tables)
+
+        table.delete(object_ids[0])
+        database.close()
+        self.assertNotIn(object_ids[0], sto.read()['User'])
+
+        with self.assertRaises(ValueError):
+            core.Database(storage=sto, commit_interval=0)
+
+    def test_background_commit_interval(self):
+        sto = RecordingStorage()
+        database = core.Database(storage=sto, commit_interval=0.01)
+        self.addCleanup(database.close)
+        # nothing is written before any write
+        threading.Event().wait(0.05)
+        self.assertEqual(sto.written, [])
+
+        table = database.table('User')
+        object_id = table.insert({'name': 'Sam'})
+        for _ in range(100):
+            if sto.read():
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(sto.read(), {'User': {object_id: {'name': 'Sam'}}})
+
+        # nothing is written without changes
+        written = len(sto.written)
+        threading.Event().wait(0.05)
+        self.assertEqual(len(sto.written), written)
+
+    def test_shared(self):
+        path = os.path.abspath('.storage')
+        with open(path, 'w'):
+            pass
+        self.addCleanup(os.remove, path)
+        self.addCleanup(os.remove, path + '.lock')
+
+        database_1 = core.Database(storage=storages.JsonStorage(path),
+                shared=True)
+        database_2 = core.Database(storage=storages.JsonStorage(path),
+                shared=True)
+        table_1 = database_1.table('User')
+        table_2 = database_2.table('User')
+        table_2.create_index('name')
+        self.assertFalse(database_2.refresh())
+
+        table_1.update_or_insert('001', {'name': 'Sam'})
+        self.assertTrue(database_2.refresh())
+        self.assertFalse(database_2.refresh())
+        self.assertEqual(table_2.query().equal('name', 'Sam').fetch(),
+                [{'name': 'Sam'}])
+
+        # the commit reads the changes of the other database before writing
+        table_2.update_or_insert('002', {'name': 'Tom'})
+        table_1.update_or_insert('003', {'name': 'John'})
+        with open(path) as fp:
+            self.assertEqual(len(json.load(fp)['User']), 3)
+
+        # the changes not committed are kept
+        database_2.refresh()
+        with database_2.batch(commit=False):
+            table_2.update('001', {'name': 'Mary'})
+            table_2.delete('003')
+        table_1.update('002', {'name': 'Ann'})
+        self.assertTrue(database_2.refresh())
+        self.assertEqual(table_2.dictionary,
+                {'001': {'name': 'Mary'}, '002': {'name': 'Ann'}})
+        self.assertEqual(table_2.query().equal('name', 'Sam').fetch(), [])
+        database_2.commit()
+        database_1.refresh()
+        self.assertEqual(database_1._tables, database_2._tables)
+
+        with self.assertRaises(ValueError):
+            core.Database(storage=storages.MemoryStorage(), shared=True)
+        with self.assertRaises(ValueError):
+            core.Database(storage=storages.MemoryStorage()).refresh()
+
+    def test_shared_conflict(self):
+        path = os.path.abspath('.storage')
+        with open(path, 'w'):
+            pass
+        self.addCleanup(os.remove, path)
+        self.addCleanup(os.remove, path + '.lock')
+
+        database_1 = core.Database(storage=storages.JsonStorage(path),
+                shared=True)
+        database_2 = core.Database(storage=storages.JsonStorage(path),
+                shared=True)
+        table_1 = database_1.table('User')
+        table_2 = database_2.table('User')
+        table_1.update_or_insert('001', {'name': 'Sam'})
+        database_2.refresh()
+
+        with database_2.batch(commit=False):
+            table_2.update('001', {'name': 'Mary'})
+            table_2.update_or_insert('002', {'name': 'Tom'})
+            table_2.update_or_insert('003', {'name': 'John'})
+        table_1.update('001', {'name': 'Ann'})
+        table_1.update_or_insert('002', {'name': 'Jack'})
+        # the same change is not a conflict
+        table_1.update_or_insert('003', {'name': 'John'})
+        with self.assertRaises(core.ConflictError) as context:
+            database_2.commit()
+        self.assertEqual(context.exception.conflicts, {'User': ['001', '002']})
+        # the committed objects are kept instead of the local changes
+        self.assertEqual(table_2.dictionary, {'001': {'name': 'Ann'},
+                '002': {'name': 'Jack'}, '003': {'name': 'John'}})
+
+        table_2.update('001', {'name': 'Mary'})
+        database_1.refresh()
+        self.assertEqual(table_1.get('001'), {'name': 'Mary'})
+
+    def test_shared_atomic(self):
+        path = os.path.abspath('.storage')
+        with open(path, 'w'):
+            pass
+        self.addCleanup(os.remove, path)
+        self.addCleanup(os.remove, path + '.lock')
+
+        database_1 = core.Database(
+                storage=storages.JsonStorage(path, atomic=True), shared=True)
+        database_2 = core.Database(
+                storage=storages.JsonStorage(path, atomic=True), shared=True)
+        database_1.table('User').update_or_insert('001', {'name': 'Sam'})
+        # the file replaced by the other database is opened again
+        self.assertTrue(database_2.refresh())
+        self.assertEqual(database_2.table('User').dictionary,
+                {'001': {'name': 'Sam'}})
+
+        database_2.table('User').update_or_insert('002', {'name': 'Tom'})
+        database_1.table('User').update_or_insert('003', {'name': 'John'})
+        with open(path) as fp:
+            self.assertEqual(sorted(json.load(fp)['User']),
+                    ['001', '002', '003'])
+
+    def test_shared_kinds(self):
+        path = os.path.abspath('.storage')
+        self.addCleanup(shutil.rmtree, path)
+        sto_1 = storages.DirectoryStorage(path)
+        sto_2 = storages.DirectoryStorage(path)
+        database_1 = core.Database(storage=sto_1, shared=True)
+        database_1.table('User').insert({'name': 'Sam'})
+        database_1.table('Group').insert({'name': 'admin'})
+
+        database_2 = core.Database(storage=sto_2, shared=True)
+        self.assertEqual(len(database_2.table('User').dictionary), 1)
+        database_1.table('User').insert({'name': 'Tom'})
+        database_1.table('Group').insert({'name': 'guest'})
+        database_1.table('Item').insert({'name': 'book'})
+
+        read_kinds = []
+        read_kind = sto_2.read_kind
+        sto_2.read_kind = lambda kind: read_kinds.append(kind) or read_kind(kind)
+        self.assertTrue(database_2.refresh())
+        # only the loaded kind is read again
+        self.assertEqual(read_kinds, ['User'])
+        self.assertEqual(len(database_2.table('User').dictionary), 2)
+        self.assertEqual(len(database_2.table('Item').dictionary), 1)
+
+    def test_shared_processes(self):
+        import multiprocessing
+
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            self.skipTest('fork is not supported')
+
+        path = os.path.abspath('.storage')
+        with open(path, 'w'):
+            pass
+        self.addCleanup(os.remove, path)
+        self.addCleanup(os.remove, path + '.lock')
+
+        def insert(n):
+            database = core.Database(storage=storages.JsonStorage(path),
+                    shared=True)
+            table = database.table('User')
+            for i in range(20):
+                table.update_or_insert('%d-%d' % (n, i), {'score': i})
+            # the generated ids are unique across the processes
+            table.insert_multi([{'score': i} for i in range(500)])
+
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=insert, args=(n,))
+                for n in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        with open(path) as fp:
+            self.assertEqual(len(json.load(fp)['User']), 4 * (20 + 500))
+        self.assertIsInstance(core.Database(storage=storages.JsonStorage(path),
+                shared=True).id_generator, ids.SnowflakeIdGenerator)
+
     def test_table(self):
         database = core.Database()
         kind = 'User'
@@ -106,6 +498,122 @@ class TableTestCase(unittest.TestCase):
         for object_id in object_ids:
             self.assertFalse(object_id in self.table.dictionary)
 
+    def test_copy_policy(self):
+        obj = {'name': 'Sam', 'groups': ['A', 'B'], 'profile': {'age': 20}}
+        database = core.Database(copy_policy=core.COPY_READONLY)
+        table = database.table(self.kind)
+        self.assertEqual(table.copy_policy, core.COPY_READONLY)
+        table.update_or_insert(0, obj)
+        obj['groups'].remove('A')
+        self.assertEqual(table.dictionary[0]['groups'], ['A', 'B'])
+
+        readonly_obj = table.get(0)
+        self.assertIsInstance(readonly_obj, core.ReadOnlyDict)
+        self.assertEqual(readonly_obj, table.dictionary[0])
+        self.assertEqual(readonly_obj['groups'], ['A', 'B'])
+        self.assertEqual(readonly_obj['groups'], ('A', 'B'))
+        self.assertEqual(dict(readonly_obj['profile']), {'age': 20})
+        with self.assertRaises(TypeError):
+            readonly_obj['name'] = 'Tom'
+        with self.assertRaises(AttributeError):
+            readonly_obj['groups'].append('C')
+        with self.assertRaises(TypeError):
+            readonly_obj['profile']['age'] = 30
+        self.assertEqual(copy.deepcopy(readonly_obj), table.dictionary[0])
+        self.assertIsInstance(copy.deepcopy(readonly_obj), dict)
+
+        table = core.Table(self.kind, table.dictionary, database,
+                copy_policy=core.COPY_SHALLOW)
+        shallow_obj = table.get(0)
+        self.assertIsInstance(shallow_obj, dict)
+        shallow_obj['name'] = 'Tom'
+        self.assertEqual(table.dictionary[0]['name'], 'Sam')
+        self.assertIs(shallow_obj['groups'], table.dictionary[0]['groups'])
+
+        with self.assertRaises(ValueError):
+            core.Table(self.kind, copy_policy='none')
+
+    def test_index(self):
+        self.table.update_or_insert_multi(['001', '002'],
+                [{'name': 'Sam'}, {'name': 'Tom'}])
+        index = self.table.create_index('name')
+        self.assertIs(self.table.create_index('name'), index)
+        self.assertEqual(list(index.lookup('Sam')), ['001'])
+
+        self.table.update('002', {'name': 'Sam'})
+        self.table.insert({'name': 'Tom'})
+        self.table.delete('001')
+        self.assertEqual(list(index.lookup('Sam')), ['002'])
+        self.assertEqual(index.count('Tom'), 1)
+
+        # rebuild on binding another dictionary
+        self.table.dictionary = {'003': {'name': 'Sam'}}
+        self.assertEqual(list(index.lookup('Sam')), ['003'])
+
+        self.table.drop_index('name')
+        self.assertEqual(self.table.indexes, {})
+
+        index = self.table.create_index('name', ordered=True)
+        self.assertIsInstance(index, indexes.OrderedIndex)
+        self.assertIs(self.table.create_index('name', ordered=True), index)
+        self.assertIsInstance(self.table.create_index('name'),
+                indexes.HashIndex)
+
+    def test_index_in_database(self):
+        database = core.Database(storage=storages.MemoryStorage())
+        table = database.table(self.kind)
+        self.assertIs(database.table(self.kind), table)
+        index = table.create_index('name')
+        table.update_or_insert('001', {'name': 'Sam'})
+        with self.assertRaises(ValueError):
+            with database.batch():
+                table.update('001', {'name': 'Tom'})
+                table.update_or_insert('002', {'name': 'Tom'})
+                raise ValueError
+
+        self.assertEqual(list(index.lookup('Sam')), ['001'])
+        self.assertEqual(index.count('Tom'), 0)
+
+    def test_index_refused(self):
+        database = core.Database(storage=storages.MemoryStorage())
+        table = database.table(self.kind)
+        name_index = table.create_index('name')
+        score_index = table.create_index('score', ordered=True)
+        table.update_or_insert('001', {'name': 'Sam', 'score': 1})
+        table.update_or_insert('003', {'score': 3})
+        database.commit()
+
+        # the hash index is restored after the ordered index refuses
+        with self.assertRaises(TypeError):
+            table.update_or_insert('002', {'name': 'Tom', 'score': 'A'})
+        with self.assertRaises(TypeError):
+            table.update('001', {'name': 'Tom', 'score': 'A'})
+        self.assertEqual(table.dictionary, {'001': {'name': 'Sam', 'score': 1},
+                '003': {'score': 3}})
+        self.assertEqual(list(name_index.lookup('Sam')), ['001'])
+        self.assertEqual(name_index.count('Tom'), 0)
+        self.assertEqual(list(score_index.range()), ['001', '003'])
+        self.assertFalse(database._changes)
+        self.assertEqual(table.query().equal('name', 'Tom').count(), 0)
+
+    def test_id_generator(self):
+        object_ids = self.table.insert_multi({'index': i} for i in range(10000))
+        self.assertEqual(len(self.table.dictionary), 10000)
+        self.assertEqual(len(set(object_ids)), 10000)
+
+        generator = ids.CounterIdGenerator(start=1)
+        database = core.Database(storage=storages.MemoryStorage(),
+                id_generator=generator)
+        table = database.table(self.kind)
+        self.assertIs(table.id_generator, generator)
+        self.assertEqual(table.insert({}), '1')
+        # existing ids are skipped
+        table.update_or_insert('3', {})
+        self.assertEqual(table.insert_multi([{}, {}]), ['2', '4'])
+
+        table = core.Table(self.kind, id_generator=ids.UuidIdGenerator())
+        self.assertEqual(len(table.insert({})), 32)
+
     def test_query(self):
         self.table.insert({'name': 'Sam'})
         query = self.table.query()
@@ -113,7 +621,102 @@ class TableTestCase(unittest.TestCase):
         self.assertEqual(query.dictionary, self.table.dictionary)
 
 
+def is_multiple_of_7(obj):
+    return obj['score'] % 7 == 0
+
+
+class FailingStorage(storages.MemoryStorage):
+    def __init__(self):
+        super().__init__()
+        self.failing = False
+
+    def write_changes(self, changes):
+        if self.failing:
+            raise OSError
+        super().write_changes(changes)
+
+
+class AsyncTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_table(self):
+        sto = RecordingStorage()
+        database = core.Database(storage=sto)
+        database.commit()
+        table = database.table('User')
+        object_id = await table.insert_async({'name': 'Sam'})
+        self.assertEqual(await table.get_async(object_id), {'name': 'Sam'})
+        await table.update_async(object_id, {'name': 'Tom'})
+        self.assertEqual(await table.get_multi_async([object_id]),
+                [{'name': 'Tom'}])
+        object_ids = await table.insert_multi_async([{'name': 'John'}])
+        await table.delete_multi_async(object_ids)
+        await table.delete_async(object_id)
+        self.assertEqual(sto.read(), {'User': {}})
+        self.assertEqual(len(sto.written), 6)
+        self.assertEqual(table.insert_async.__name__, 'insert_async')
+
+    async def test_coalesce(self):
+        sto = RecordingStorage()
+        database = core.Database(storage=sto)
+        database.commit()
+        table = database.table('User')
+        object_ids = await asyncio.gather(*[
+                table.insert_async({'name': str(i)}) for i in range(10)])
+        # NOTE: the inserts share a commit
+        self.assertEqual(len(sto.written), 2)
+        self.assertEqual(len(sto.written[1][1]['User']), 10)
+
+        # in order with the commits in the executor
+        table.update(object_ids[0], {'name': 'Sam'})
+        await table.delete_async(object_ids[0])
+        self.assertNotIn(object_ids[0], sto.read()['User'])
+
+        with database.batch(commit=False):
+            table.insert({'name': 'Tom'})
+        self.assertEqual(len(sto.written), 4)
+        await database.commit_async()
+        self.assertEqual(len(sto.read()['User']), 10)
+
+    async def test_failure(self):
+        sto = FailingStorage()
+        database = core.Database(storage=sto)
+        database.commit()
+        table = database.table('User')
+        sto.failing = True
+        results = await asyncio.gather(table.insert_async({'name': 'Sam'}),
+                table.insert_async({'name': 'Tom'}), return_exceptions=True)
+        self.assertEqual([type(result) for result in results], [OSError] * 2)
+
+        # NOTE: all are written after the failure
+        sto.failing = False
+        await database.commit_async()
+        self.assertEqual(sto.read(), database._tables)
+
+
 class QueryTestCase(unittest.TestCase):
+    def test_fetch_parallel(self):
+        database = core.Database(storage=storages.MemoryStorage(),
+                thread_safe=True)
+        table = database.table('User')
+        table.create_index('score', ordered=True)
+        table.update_or_insert_multi(list(range(2000)),
+                [{'score': i % 100, 'rank': i} for i in range(2000)])
+
+        query = table.query(is_multiple_of_7).range('score', 10)
+        expected = query.fetch(ids_only=True)
+        # by processes, and by threads for a lambda
+        self.assertEqual(query.fetch(ids_only=True, parallel=2), expected)
+        query = table.query(lambda obj: obj['score'] % 7 == 0).range(
+                'score', 10)
+        self.assertEqual(query.fetch(ids_only=True, parallel=2), expected)
+        self.assertEqual(query.fetch(parallel=2, offset=5, limit=300),
+                query.fetch(offset=5, limit=300))
+
+        # in order
+        query = table.query().filter(is_multiple_of_7).order_by(
+                'rank', reverse=True)
+        self.assertEqual(query.fetch(parallel=3), query.fetch())
+        self.assertEqual(len(query.fetch(parallel=3)), 300)
+
     def test_fetch(self):
         import logging
         kind = 'User'
@@ -135,8 +738,392 @@ class QueryTestCase(unittest.TestCase):
             obj['score'] /= 10
             return obj['score'] >= 6
 
-        # edit attribute in function, but remain unchanged in dictionary
+        # function gets a read-only view, and the dictionary remains unchanged
         query = table.query(test_func)
-        self.assertEqual(query.fetch(),
-                [{'name': 'Tom', 'score': 6.0}, {'name': 'John', 'score': 7.0}])
+        with self.assertRaises(TypeError):
+            query.fetch()
         self.assertEqual(table.get_multi(object_ids), objects)
+
+        # only the matches are copied, as the objects returned
+        query = table.query(lambda obj: isinstance(obj, core.ReadOnlyDict)
+                and obj['score'] >= 60)
+        results = query.fetch()
+        self.assertEqual(results, objects[1:])
+        self.assertIs(type(results[0]), dict)
+        results[0]['score'] = 0
+        self.assertEqual(table.get(object_ids[1]), objects[1])
+
+    def test_iter(self):
+        table = core.Table('User')
+        object_ids = table.insert_multi([{'score': score} for score in range(10)])
+        tested = []
+
+        def test_func(obj):
+            tested.append(obj['score'])
+            return obj['score'] % 2 == 0
+
+        results = table.query(test_func).iter()
+        self.assertEqual(next(results), {'score': 0})
+        self.assertEqual(next(results), {'score': 2})
+        # stop scanning once enough objects are yielded
+        self.assertEqual(tested, [0, 1, 2])
+
+        ids = table.query(test_func).iter(ids_only=True)
+        self.assertEqual(list(ids), object_ids[::2])
+
+    def test_fetch_limit_offset(self):
+        table = core.Table('User')
+        objects = [{'score': score} for score in range(10)]
+        object_ids = table.insert_multi(objects)
+        query = table.query(lambda obj: obj['score'] >= 3)
+        self.assertEqual(query.fetch(limit=2), objects[3:5])
+        self.assertEqual(query.fetch(limit=2, offset=5), objects[8:])
+        self.assertEqual(query.fetch(offset=6), objects[9:])
+        self.assertEqual(query.fetch(ids_only=True, limit=1), object_ids[3:4])
+        self.assertEqual(table.query().fetch(ids_only=True, limit=3),
+                object_ids[:3])
+
+    def test_fetch_copy_policy(self):
+        table = core.Table('User', copy_policy=core.COPY_READONLY)
+        table.insert_multi([{'score': score} for score in range(3)])
+        results = table.query(lambda obj: obj['score'] > 0).fetch()
+        self.assertEqual(results, [{'score': 1}, {'score': 2}])
+        self.assertIsInstance(results[0], core.ReadOnlyDict)
+
+    def test_fetch_equal(self):
+        class ScanDict(dict):
+            scannable = True
+
+            def items(self):
+                if not self.scannable:
+                    raise AssertionError('scanned')
+                return super().items()
+
+        table = core.Table('User', ScanDict())
+        table.update_or_insert_multi(['001', '002', '003'], [
+            {'name': 'Sam', 'score': 50, 'tags': ['A']},
+            {'name': 'Tom', 'score': 60, 'tags': ['A', 'B']},
+            {'name': 'Sam', 'score': 70, 'tags': ['B']},
+        ])
+        table.create_index('name')
+        table.dictionary.scannable = False
+        query = table.query().equal('name', 'Sam')
+        self.assertEqual(query.fetch(ids_only=True), ['001', '003'])
+        query = table.query(lambda obj: obj['score'] > 60).equal('name', 'Sam')
+        self.assertEqual(query.fetch(), [table.get('003')])
+        # not indexed field is tested on the candidates
+        query = table.query().equal('name', 'Sam').equal('tags', 'B')
+        self.assertEqual(query.fetch(ids_only=True), ['003'])
+
+        table = core.Table('User', dict(table.dictionary))
+        query = table.query().equal('tags', 'A').equal('score', 60)
+        self.assertEqual(query.fetch(ids_only=True), ['002'])
+
+    def test_condition(self):
+        condition = core.Condition('score', '>=', 60)
+        self.assertTrue(condition.match({'score': 60}))
+        self.assertFalse(condition.match({'score': 50}))
+        self.assertFalse(condition.match({'score': None}))
+        self.assertFalse(condition.match({'score': 'A'}))
+        self.assertFalse(condition.match({}))
+        self.assertTrue(condition.match({'score': [50, 70]}))
+        self.assertTrue(core.Condition('score', '==', None).match(
+                {'score': None}))
+        self.assertTrue(core.Condition('score', '!=', None).match(
+                {'score': 60}))
+        condition = core.Condition('date', '<', '01-2020',
+                key=lambda value: value.split('-')[::-1])
+        self.assertTrue(condition.match({'date': '12-2019'}))
+
+        with self.assertRaises(ValueError):
+            core.Condition('score', '~', 60)
+        with self.assertRaises(ValueError):
+            core.Condition('score', '<', None)
+
+    def test_range_order(self):
+        table = core.Table('User')
+        table.update_or_insert_multi(['001', '002', '003', '004', '005'], [
+            {'name': 'Sam', 'score': 70},
+            {'name': 'Tom', 'score': 50},
+            {'name': 'John', 'score': 90},
+            {'name': 'Sam', 'score': 60},
+            {'name': 'Tom'},
+        ])
+        for ordered in (False, True):
+            if ordered:
+                table.create_index('score', ordered=True)
+
+            query = table.query().range('score', 60, 90)
+            self.assertEqual(sorted(query.fetch(ids_only=True)),
+                    ['001', '004'])
+            query = table.query().range('score', 60, 90, include_lower=False,
+                    include_upper=True).order_by('score')
+            self.assertEqual(query.fetch(ids_only=True), ['001', '003'])
+            query = table.query().order_by('score', reverse=True)
+            self.assertEqual(query.fetch(ids_only=True),
+                    ['003', '001', '004', '002'])
+            query = table.query().equal('name', 'Sam').order_by('score')
+            self.assertEqual(query.fetch(ids_only=True), ['004', '001'])
+            query = table.query(lambda obj: obj['name'] != 'Sam')
+            self.assertEqual(query.order_by('score').fetch(limit=1),
+                    [{'name': 'Tom', 'score': 50}])
+
+            self.assertEqual(table.query().min('score'), 50)
+            self.assertEqual(table.query().max('score'), 90)
+            self.assertEqual(table.query().equal('name', 'Sam').min('score'),
+                    60)
+            query = table.query(lambda obj: obj['name'] != 'John')
+            self.assertEqual(query.max('score'), 70)
+            self.assertIsNone(table.query().equal('name', 'A').max('score'))
+
+    def test_fetch_page(self):
+        table = core.Table('User')
+        table.update_or_insert_multi(['005', '003', '001', '004', '002'], [
+            {'score': 70},
+            {'score': 50},
+            {'score': 90},
+            {'score': 50},
+            {},
+        ])
+        # ordered by id
+        results, cursor, more = table.query().fetch_page(2, ids_only=True)
+        self.assertEqual((results, more), (['001', '002'], True))
+        # the sorted ids are kept by the table for the next pages
+        self.assertEqual(len(table._id_index), 5)
+        results, cursor, more = table.query().fetch_page(2, cursor)
+        self.assertEqual(results, [{'score': 50}, {'score': 50}])
+        self.assertTrue(more)
+        results, cursor, more = table.query().fetch_page(2, cursor,
+                ids_only=True)
+        self.assertEqual((results, more), (['005'], False))
+        self.assertEqual(table.query().fetch_page(2, cursor), ([], None, False))
+
+        # the ids inserted and deleted after the first page
+        _, cursor, _ = table.query().fetch_page(2)
+        table.update_or_insert_multi(['000', '0025', '006'], [{}, {}, {}])
+        table.delete('003')
+        results, _, more = table.query().fetch_page(2, cursor, ids_only=True)
+        self.assertEqual((results, more), (['0025', '004'], True))
+        table.delete_multi(['000', '0025', '006'])
+        table.update_or_insert('003', {'score': 50})
+
+        # candidates of another index are ordered by id as well
+        table.create_index('score')
+        results, cursor, _ = table.query().equal('score', 50).fetch_page(1,
+                ids_only=True)
+        self.assertEqual(results, ['003'])
+        results, _, more = table.query().equal('score', 50).fetch_page(1,
+                cursor, ids_only=True)
+        self.assertEqual((results, more), (['004'], False))
+
+        # pages ordered by a field need an ordered index
+        with self.assertRaises(ValueError):
+            table.query().order_by('score').fetch_page(1)
+        table.create_index('score', ordered=True)
+        pages = []
+        cursor, more = None, True
+        while more:
+            query = table.query().order_by('score')
+            results, cursor, more = query.fetch_page(1, cursor, ids_only=True)
+            pages.append(results)
+        self.assertEqual(pages, [['003'], ['004'], ['005'], ['001']])
+
+        query = table.query().order_by('score', reverse=True)
+        results, cursor, _ = query.fetch_page(2, ids_only=True)
+        self.assertEqual(results, ['001', '005'])
+        # resumed after the cursor, even if the objects before are changed
+        table.delete('001')
+        table.update_or_insert('006', {'score': 60})
+        results, cursor, more = query.fetch_page(5, cursor, ids_only=True)
+        self.assertEqual((results, more), (['006', '004', '003'], False))
+
+        with self.assertRaises(ValueError):
+            table.query().fetch_page(2, 'invalid')
+        _, cursor, _ = table.query().fetch_page(2)
+        with self.assertRaises(ValueError):
+            table.query().order_by('score').fetch_page(2, cursor)
+
+    def test_fetch_page_resumed(self):
+        tested = []
+
+        def test_func(obj):
+            tested.append(obj['score'])
+            return obj['score'] % 2 == 0
+
+        table = core.Table('User')
+        table.update_or_insert_multi(list(range(1000)),
+                [{'score': 999 - i} for i in range(1000)])
+        query = table.query(test_func)
+        _, cursor, _ = query.fetch_page(10)
+        self.assertEqual(len(tested), 22)
+
+        del tested[:]
+        results, _, _ = query.fetch_page(10, cursor, ids_only=True)
+        # only the objects after the cursor are tested
+        self.assertEqual(results, list(range(21, 40, 2)))
+        self.assertEqual(tested, list(range(979, 957, -1)))
+
+        table.create_index('score', ordered=True)
+        query = table.query(test_func).order_by('score')
+        _, cursor, _ = query.fetch_page(10)
+        del tested[:]
+        results, _, _ = query.fetch_page(10, cursor)
+        self.assertEqual(results, [{'score': score}
+                for score in range(20, 40, 2)])
+        self.assertEqual(tested, list(range(19, 41)))
+
+    def test_fetch_page_by_index(self):
+        table = core.Table('User')
+        table.update_or_insert_multi(list(range(1000)),
+                [{'parity': i % 2, 'score': i % 100} for i in range(1000)])
+        table.create_index('parity')
+        table.create_index('score', ordered=True)
+
+        def fail(*args):
+            raise AssertionError('all candidates are sorted')
+
+        # half of the objects are candidates, then the sorted ids are scanned
+        original_iter_by_id = core._iter_by_id
+        core._iter_by_id = fail
+        self.addCleanup(setattr, core, '_iter_by_id', original_iter_by_id)
+        _, cursor, _ = table.query().equal('parity', 1).fetch_page(5)
+        results, _, _ = table.query().equal('parity', 1).fetch_page(5, cursor,
+                ids_only=True)
+        self.assertEqual(results, [11, 13, 15, 17, 19])
+
+        query = table.query().equal('parity', 1).order_by('score')
+        query._sort = fail
+        _, cursor, _ = query.fetch_page(5)
+        results, _, _ = query.fetch_page(5, cursor, ids_only=True)
+        self.assertEqual(results, [501, 601, 701, 801, 901])
+
+        # a few candidates are sorted
+        core._iter_by_id = original_iter_by_id
+        results, _, _ = table.query().equal('score', 7).fetch_page(3,
+                ids_only=True)
+        self.assertEqual(results, [7, 107, 207])
+
+    def test_aggregate(self):
+        table = core.Table('User')
+        table.update_or_insert_multi(['001', '002', '003', '004', '005'], [
+            {'name': 'Sam', 'score': 70, 'tags': ['A', 'B']},
+            {'name': 'Tom', 'score': 50, 'tags': ['B']},
+            {'name': 'John', 'score': 90},
+            {'name': 'Sam', 'score': 60, 'tags': ['B', 'B']},
+            {'name': 'Tom'},
+        ])
+        for indexed in (False, True):
+            if indexed:
+                table.create_index('name')
+                table.create_index('score', ordered=True)
+
+            self.assertEqual(table.query().count(), 5)
+            self.assertEqual(table.query().equal('name', 'Sam').count(), 2)
+            self.assertEqual(table.query().range('score', 60, 90,
+                    include_upper=False).count(), 2)
+            query = table.query(lambda obj: obj['name'] != 'John')
+            self.assertEqual(query.range('score', 60).count(), 2)
+
+            self.assertEqual(table.query().sum('score'), 270)
+            self.assertEqual(table.query().equal('name', 'Sam').sum('score'),
+                    130)
+            self.assertEqual(table.query().sum('missing'), 0)
+
+            self.assertEqual(table.query().group_by('name').count(),
+                    {'Sam': 2, 'Tom': 2, 'John': 1})
+            self.assertEqual(table.query().range('score', 60).group_by(
+                    'name').count(), {'Sam': 2, 'John': 1})
+
+        # each object is counted once for each value it contains
+        self.assertEqual(table.query().group_by('tags').count(),
+                {'A': 1, 'B': 3})
+        self.assertEqual(table.query().equal('tags', 'B').count(), 3)
+
+    def test_aggregate_by_index(self):
+        table = core.Table('User')
+        table.update_or_insert_multi(list(range(100)),
+                [{'score': score, 'group': score % 10} for score in range(100)])
+        table.create_index('group')
+        table.create_index('score', ordered=True)
+
+        def fail():
+            raise AssertionError('scanned')
+
+        query = table.query()
+        query._iter_unordered = fail
+        self.assertEqual(query.count(), 100)
+        query = table.query().equal('group', 1)
+        query._iter_unordered = fail
+        self.assertEqual(query.count(), 10)
+        query = table.query().range('score', 10, 20, include_upper=False)
+        query._iter_unordered = fail
+        self.assertEqual(query.count(), 10)
+        query = table.query().group_by('group')
+        query.query._iter_unordered = fail
+        self.assertEqual(query.count(), {i: 10 for i in range(10)})
+
+        # not covered by the index
+        query = table.query().equal('group', 1).range('score', 50)
+        self.assertEqual(query.count(), 5)
+        self.assertEqual(query.sum('score'), 51 + 61 + 71 + 81 + 91)
+
+        # the values of a repeated field are not the numbers of objects
+        table.create_index('tags', ordered=True)
+        table.update_or_insert_multi([100, 101],
+                [{'tags': [1, 2]}, {'tags': [2, 3]}])
+        self.assertEqual(table.query().range('tags', 1, 3).count(), 2)
+        self.assertEqual(table.query().equal('tags', 2).count(), 2)
+
+    def test_filter(self):
+        table = core.Table('User')
+        table.update_or_insert_multi(['001', '002', '003'], [
+            {'name': 'Sam', 'score': 70, 'country': 'TW'},
+            {'name': 'Tom', 'score': 50, 'country': 'TW'},
+            {'name': 'John', 'score': 90, 'country': 'US'},
+        ])
+        query = table.query().filter(
+                core.Condition('score', '>=', 60),
+                core.Condition('country', '==', 'TW'))
+        self.assertEqual(query.fetch(ids_only=True), ['001'])
+
+        query = table.query(lambda obj: obj['score'] > 60).filter(
+                lambda obj: obj['country'] == 'US')
+        self.assertEqual(query.fetch(ids_only=True), ['003'])
+
+        with self.assertRaises(TypeError):
+            table.query().filter(('score', '>=', 60))
+
+    def test_plan(self):
+        class CountingCondition(core.Condition):
+            matched = 0
+
+            def match(self, obj):
+                CountingCondition.matched += 1
+                return super().match(obj)
+
+        table = core.Table('User')
+        table.update_or_insert_multi(list(range(100)),
+                [{'score': score, 'group': score % 10} for score in range(100)])
+        query = table.query().filter(
+                CountingCondition('score', '!=', 0),
+                CountingCondition('group', '==', 1))
+        self.assertEqual(len(query.fetch()), 10)
+        # the more selective condition is tested first
+        self.assertEqual(CountingCondition.matched, 100 + 10)
+
+        CountingCondition.matched = 0
+        table.create_index('group')
+        table.create_index('score', ordered=True)
+        query = table.query().filter(
+                CountingCondition('score', '>=', 50),
+                CountingCondition('group', '==', 1))
+        self.assertEqual(len(query.fetch()), 5)
+        # the candidates are the 10 objects of group 1, matched on score only
+        self.assertEqual(CountingCondition.matched, 10)
+
+        CountingCondition.matched = 0
+        query = table.query().filter(
+                CountingCondition('score', '>=', 95),
+                CountingCondition('group', '==', 1))
+        self.assertEqual(len(query.fetch()), 0)
+        self.assertEqual(CountingCondition.matched, 5 * 2)
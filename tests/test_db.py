@@ -3,6 +3,7 @@ import unittest
 
 from pydictdb import core
 from pydictdb import db
+from pydictdb import indexes
 from pydictdb import storages
 
 
@@ -11,6 +12,16 @@ class ModelInTestDB(db.Model):
     score = db.IntegerAttribute()
 
 
+class ModelInTestDBParallel(db.Model):
+    score = db.IntegerAttribute()
+    birth = db.DateAttribute()
+
+
+def is_born_in_leap_year(model):
+    year = model.birth.year
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
 class AttributeTestCase(unittest.TestCase):
     def test_validate_value(self):
         def test_attribute(attr, allowed, not_allowed):
@@ -84,6 +95,30 @@ class AttributeTestCase(unittest.TestCase):
         self.assertEqual(attr.encode([now]), [now_str])
         self.assertEqual(attr.decode([now_str]), [now])
 
+    def test_iso_encode_decode(self):
+        def assert_same(attr, values, generic_values):
+            encoder = attr._get_value_encoder()
+            decoder = attr._get_value_decoder()
+            for value in values:
+                self.assertEqual(encoder(value), attr._post_encode(value))
+            for generic_value in generic_values:
+                self.assertEqual(decoder(generic_value),
+                        attr._post_decode(generic_value))
+
+        utc = datetime.timezone.utc
+        now = datetime.datetime(2019, 1, 2, 3, 4, 5, 67)
+        assert_same(db.DateAttribute(),
+                [now.date(), now, datetime.date(999, 1, 1), None],
+                ['2019-01-02', '2019-1-2', None])
+        assert_same(db.DatetimeAttribute(),
+                [now, now.replace(microsecond=0), now.replace(tzinfo=utc),
+                        now.date(), None],
+                ['2019-01-02 03:04:05.000067', '2019-01-02 03:04:05.6', None])
+        assert_same(db.DatetimeAttribute(fmt='%Y-%m-%d %H:%M:%S'),
+                [now, now.replace(microsecond=0)], ['2019-01-02 03:04:05'])
+        assert_same(db.DatetimeAttribute(fmt='%d/%m/%Y'),
+                [now], ['02/01/2019'])
+
     def test_choices(self):
         db.IntegerAttribute(choices=None)
         with self.assertRaises(TypeError):
@@ -157,6 +192,100 @@ class ModelTestCase(unittest.TestCase):
         self.assertEqual(ModelInTestCase().name, 'Sam')
         self.assertEqual(ModelInTestCase().score, 100)
 
+        model = ModelInTestCase(score=90)
+        del model.score
+        self.assertEqual(model.score, 100)
+        self.assertIsInstance(ModelInTestCase.score, db.Attribute)
+
+    def test_compact(self):
+        class ModelInTestCase17(db.Model):
+            name = db.StringAttribute(default='Sam')
+            score = db.IntegerAttribute(indexed=True)
+            birth = db.DateAttribute()
+            note = db.StringAttribute(kept=False)
+
+        class ModelInTestCase18(db.Model):
+            class Meta:
+                compact = True
+
+            name = db.StringAttribute(default='Sam')
+            score = db.IntegerAttribute(indexed=True)
+            birth = db.DateAttribute()
+            note = db.StringAttribute(kept=False)
+
+        class ModelInTestCase19(ModelInTestCase18):
+            name = db.StringAttribute(default='Tom')
+            tags = db.StringAttribute(repeated=True)
+
+        database = core.Database(storage=storages.MemoryStorage())
+        db.register_database(database)
+        birth = datetime.date(2009, 1, 1)
+        model = ModelInTestCase17(score=90, birth=birth)
+        compact_model = ModelInTestCase18(score=90, birth=birth)
+        self.assertFalse(hasattr(compact_model, '__dict__'))
+        self.assertEqual(compact_model.to_dict(), model.to_dict())
+        self.assertEqual(repr(compact_model), repr(model).replace('17', '18'))
+        self.assertIsInstance(ModelInTestCase18.name, db.Attribute)
+        with self.assertRaises(TypeError):
+            compact_model.score = '90'
+        with self.assertRaises(AttributeError):
+            compact_model.age = 18
+
+        del compact_model.name
+        self.assertEqual(compact_model.name, 'Sam')
+        self.assertNotIn('name', compact_model.to_dict())
+        compact_model.name = 'Sam'
+
+        key = compact_model.put()
+        self.assertEqual(key.get(), compact_model)
+        self.assertEqual(ModelInTestCase18.query().filter(
+                ModelInTestCase18.score == 90).fetch(), [compact_model])
+
+        # NOTE: compact is inherited, and no slot is added for overriding
+        self.assertTrue(ModelInTestCase19._schema.compact)
+        self.assertEqual(ModelInTestCase19.__slots__, ('tags',))
+        inherited_model = ModelInTestCase19(tags=['a'])
+        self.assertEqual(inherited_model.name, 'Tom')
+        self.assertFalse(hasattr(inherited_model, '__dict__'))
+        inherited_model.put()
+        self.assertEqual(inherited_model.key.get(), inherited_model)
+
+        # a stored object of missing fields, as stored before a change of the
+        # schema
+        database.table('ModelInTestCase19').update_or_insert('001',
+                {'score': 80})
+        stored_model = db.Key('ModelInTestCase19', '001').get()
+        self.assertEqual((stored_model.name, stored_model.score,
+                stored_model.birth, stored_model.tags), ('Tom', 80, None, []))
+        self.assertIsNone(stored_model.note)
+
+    def test_inherited_attr(self):
+        class ModelInTestCase12(db.Model):
+            name = db.StringAttribute(default='Sam')
+            note = db.StringAttribute(kept=False)
+
+        class ModelInTestCase13(ModelInTestCase12):
+            score = db.IntegerAttribute(indexed=True)
+            note = None
+
+        schema = ModelInTestCase13._schema
+        self.assertEqual(set(schema.attributes), {'name', 'score'})
+        self.assertEqual(set(schema.indexed_attributes), {'score'})
+        self.assertEqual(set(ModelInTestCase12._schema.kept_attributes),
+                {'name'})
+        with self.assertRaises(TypeError):
+            schema.attributes['age'] = db.IntegerAttribute()
+
+        db.register_database(core.Database(storage=storages.MemoryStorage()))
+        model = ModelInTestCase13(score=90)
+        self.assertEqual(model.name, 'Sam')
+        with self.assertRaises(TypeError):
+            model.name = 100
+
+        model.put()
+        self.assertEqual(model.key.get(), model)
+        self.assertIn('score', ModelInTestCase13._get_table().indexes)
+
     def test_encode_when_put(self):
         class ModelInTestCase01(db.Model):
             birth = db.DateAttribute()
@@ -195,12 +324,276 @@ class ModelTestCase(unittest.TestCase):
                 lambda m: m.birth >= datetime.date(2010, 1, 1))
         self.assertEqual(models[1:], query.fetch())
 
+    def test_query_equal(self):
+        class ModelInTestCase07(db.Model):
+            name = db.StringAttribute(indexed=True)
+            birth = db.DateAttribute()
+            tags = db.StringAttribute(repeated=True, indexed=True)
+
+        db.register_database(core.Database())
+        models = [
+            ModelInTestCase07(name='Sam', birth=datetime.date(2009, 1, 1),
+                    tags=['A']),
+            ModelInTestCase07(name='Tom', birth=datetime.date(2010, 1, 1),
+                    tags=['A', 'B']),
+            ModelInTestCase07(name='Sam', birth=datetime.date(2011, 1, 1)),
+        ]
+        db.put_multi(models)
+        query = ModelInTestCase07.query().equal('name', 'Sam')
+        self.assertEqual(query.fetch(), [models[0], models[2]])
+        self.assertIn('name', db._database_in_use.table(
+                'ModelInTestCase07').indexes)
+
+        query = ModelInTestCase07.query().equal('tags', 'A')
+        self.assertEqual(query.fetch(), models[:2])
+
+        query = ModelInTestCase07.query().equal(
+                'birth', datetime.date(2010, 1, 1))
+        self.assertEqual(query.fetch(keys_only=True), [models[1].key])
+
+        with self.assertRaises(ValueError):
+            ModelInTestCase07.query().equal('height', 180)
+
+    def test_query_range_order(self):
+        class ModelInTestCase08(db.Model):
+            score = db.IntegerAttribute(indexed=True)
+            created_at = db.DatetimeAttribute(indexed=True)
+            birth = db.DateAttribute(fmt='%d/%m/%Y', indexed=True)
+
+        db.register_database(core.Database())
+        models = [
+            ModelInTestCase08(score=70,
+                    created_at=datetime.datetime(2019, 1, 1, 12),
+                    birth=datetime.date(2009, 2, 1)),
+            ModelInTestCase08(score=50,
+                    created_at=datetime.datetime(2019, 1, 1, 8),
+                    birth=datetime.date(2010, 1, 1)),
+            ModelInTestCase08(score=90,
+                    created_at=datetime.datetime(2019, 1, 2),
+                    birth=datetime.date(2009, 1, 2)),
+        ]
+        db.put_multi(models)
+        table = db._database_in_use.table('ModelInTestCase08')
+        query = ModelInTestCase08.query().range('score', 60).order_by('score')
+        self.assertEqual(query.fetch(), [models[0], models[2]])
+        self.assertIsInstance(table.indexes['score'], indexes.OrderedIndex)
+
+        query = ModelInTestCase08.query().range('created_at',
+                datetime.datetime(2019, 1, 1), datetime.datetime(2019, 1, 2))
+        self.assertEqual(query.order_by('created_at', reverse=True).fetch(),
+                [models[0], models[1]])
+
+        query = ModelInTestCase08.query().order_by('birth')
+        self.assertEqual(query.fetch(), [models[2], models[0], models[1]])
+        query = ModelInTestCase08.query().range('birth',
+                upper=datetime.date(2009, 12, 31))
+        self.assertEqual(query.fetch(keys_only=True),
+                [models[2].key, models[0].key])
+
+        query = ModelInTestCase08.query()
+        self.assertEqual(query.min('score'), 50)
+        self.assertEqual(query.max('birth'), datetime.date(2010, 1, 1))
+        self.assertEqual(query.min('created_at'),
+                datetime.datetime(2019, 1, 1, 8))
+        query = ModelInTestCase08.query(lambda m: m.score < 90)
+        self.assertEqual(query.max('score'), 70)
+
+    def test_query_filter(self):
+        class ModelInTestCase09(db.Model):
+            name = db.StringAttribute()
+            age = db.IntegerAttribute(indexed=True)
+            country = db.StringAttribute(indexed=True)
+            birth = db.DateAttribute()
+            height = db.FloatAttribute(kept=False)
+
+        self.assertEqual(ModelInTestCase09.age.name, 'age')
+        self.assertIsInstance(ModelInTestCase09.age >= 18, core.Condition)
+        self.assertEqual(ModelInTestCase09().age, None)
+
+        db.register_database(core.Database())
+        models = [
+            ModelInTestCase09(name='Sam', age=20, country='TW',
+                    birth=datetime.date(1999, 1, 1)),
+            ModelInTestCase09(name='Tom', age=17, country='TW',
+                    birth=datetime.date(2002, 1, 1)),
+            ModelInTestCase09(name='John', age=30, country='US',
+                    birth=datetime.date(1989, 1, 1)),
+        ]
+        db.put_multi(models)
+        query = ModelInTestCase09.query().filter(
+                ModelInTestCase09.age >= 18, ModelInTestCase09.country == 'TW')
+        self.assertEqual(query.fetch(), models[:1])
+
+        query = ModelInTestCase09.query().filter(
+                ModelInTestCase09.birth < datetime.date(2000, 1, 1),
+                ModelInTestCase09.name != 'Sam')
+        self.assertEqual(query.fetch(), models[2:])
+
+        query = ModelInTestCase09.query().filter(
+                ModelInTestCase09.country == 'TW', lambda m: m.name == 'Tom')
+        self.assertEqual(query.fetch(), models[1:2])
+
+        with self.assertRaises(ValueError):
+            ModelInTestCase09.query().filter(ModelInTestCase09.height > 170.0)
+        with self.assertRaises(TypeError):
+            ModelInTestCase09.query().filter(('age', '>=', 18))
+
+    def test_query_decode_once(self):
+        class CountingAttribute(db.IntegerAttribute):
+            decoded = 0
+
+            def _post_decode(self, generic_value):
+                CountingAttribute.decoded += 1
+                return super()._post_decode(generic_value)
+
+        class ModelInTestCase10(db.Model):
+            score = CountingAttribute()
+
+        db.register_database(core.Database())
+        models = [ModelInTestCase10(score=score) for score in range(10)]
+        db.put_multi(models)
+        query = ModelInTestCase10.query(lambda m: m.score >= 5)
+        self.assertEqual(query.fetch(), models[5:])
+        self.assertEqual(CountingAttribute.decoded, 10)
+
+        CountingAttribute.decoded = 0
+        self.assertEqual(ModelInTestCase10.query().fetch(keys_only=True),
+                [model.key for model in models])
+        self.assertEqual(CountingAttribute.decoded, 0)
+
+    def test_query_raw(self):
+        class ModelInTestCase11(db.Model):
+            score = db.IntegerAttribute()
+            birth = db.DateAttribute()
+
+        db.register_database(core.Database())
+        models = [
+            ModelInTestCase11(score=90, birth=datetime.date(2009, 1, 1)),
+            ModelInTestCase11(score=80, birth=datetime.date(2010, 1, 1)),
+        ]
+        db.put_multi(models)
+        tested = []
+
+        def test_func(obj):
+            tested.append(obj)
+            return obj['birth'] >= '2010-01-01'
+
+        query = ModelInTestCase11.query(test_func, raw=True)
+        self.assertEqual(query.fetch(keys_only=True), [models[1].key])
+        self.assertEqual(tested, [
+            {'score': 90, 'birth': '2009-01-01'},
+            {'score': 80, 'birth': '2010-01-01'},
+        ])
+        self.assertEqual(query.fetch(), models[1:])
+
+    def test_query_aggregate(self):
+        class ModelInTestCase22(db.Model):
+            score = db.IntegerAttribute(indexed=True)
+            birth = db.DateAttribute(indexed=True)
+            tags = db.StringAttribute(repeated=True)
+
+        db.register_database(core.Database())
+        models = [
+            ModelInTestCase22(score=70, birth=datetime.date(2009, 1, 1),
+                    tags=['A', 'B']),
+            ModelInTestCase22(score=50, birth=datetime.date(2010, 1, 1),
+                    tags=['B']),
+            ModelInTestCase22(score=90, birth=datetime.date(2009, 1, 1)),
+        ]
+        db.put_multi(models)
+
+        query = ModelInTestCase22.query()
+        self.assertEqual(query.count(), 3)
+        self.assertEqual(query.sum('score'), 210)
+        self.assertEqual(query.group_by('birth').count(),
+                {datetime.date(2009, 1, 1): 2, datetime.date(2010, 1, 1): 1})
+        self.assertEqual(query.group_by('tags').count(), {'A': 1, 'B': 2})
+        query = ModelInTestCase22.query().range('score', 60)
+        self.assertEqual(query.count(), 2)
+        self.assertEqual(query.sum('score'), 160)
+
+        # the models are decoded to be tested
+        query = ModelInTestCase22.query(lambda m: m.birth.year == 2009)
+        self.assertEqual(query.count(), 2)
+        self.assertEqual(query.sum('score'), 160)
+        self.assertEqual(query.group_by('birth').count(),
+                {datetime.date(2009, 1, 1): 2})
+        self.assertEqual(query.group_by('tags').count(), {'A': 1, 'B': 1})
+        query = ModelInTestCase22.query(lambda obj: obj['score'] > 60,
+                raw=True)
+        self.assertEqual(query.count(), 2)
+        self.assertEqual(query.group_by('score').count(), {70: 1, 90: 1})
+
+        with self.assertRaises(ValueError):
+            ModelInTestCase22.query().sum('height')
+
+    def test_query_fetch_page(self):
+        class ModelInTestCase23(db.Model):
+            score = db.IntegerAttribute()
+            birth = db.DateAttribute(indexed=True)
+
+        db.register_database(core.Database())
+        models = [ModelInTestCase23(key=db.Key('ModelInTestCase23', '%03d' % i),
+                score=i, birth=datetime.date(2000 + i % 3, 1, 1))
+                for i in range(6)]
+        db.put_multi(models)
+
+        query = ModelInTestCase23.query()
+        results, cursor, more = query.fetch_page(4)
+        self.assertEqual((results, more), (models[:4], True))
+        results, cursor, more = query.fetch_page(4, cursor, keys_only=True)
+        self.assertEqual(results, [model.key for model in models[4:]])
+        self.assertFalse(more)
+
+        query = ModelInTestCase23.query(lambda m: m.score != 3).order_by(
+                'birth', reverse=True)
+        results, cursor, more = query.fetch_page(2)
+        self.assertEqual(results, [models[5], models[2]])
+        results, cursor, more = query.fetch_page(2, cursor)
+        self.assertEqual(results, [models[4], models[1]])
+        results, cursor, more = query.fetch_page(2, cursor)
+        self.assertEqual((results, more), ([models[0]], False))
+
+    def test_query_parallel(self):
+        db.register_database(core.Database(storage=storages.MemoryStorage()))
+        models = [ModelInTestDBParallel(score=i % 50,
+                birth=datetime.date(1900 + i % 200, 1, 1)) for i in range(1000)]
+        db.put_multi(models)
+        expected = [model for model in models if is_born_in_leap_year(model)]
+
+        # by processes, and by threads for a lambda
+        query = ModelInTestDBParallel.query(is_born_in_leap_year)
+        self.assertEqual(query.fetch(parallel=2), expected)
+        query = ModelInTestDBParallel.query().filter(
+                lambda model: is_born_in_leap_year(model)).order_by('score')
+        self.assertEqual(query.fetch(parallel=2), query.fetch())
+        query = ModelInTestDBParallel.query(
+                lambda obj: obj['score'] == 1, raw=True)
+        self.assertEqual(query.fetch(keys_only=True, parallel=2),
+                [model.key for model in models if model.score == 1])
+
 
 class KeyTestCase(unittest.TestCase):
+    def test_slots(self):
+        key = db.Key('ModelInTestDB', 'abc')
+        self.assertFalse(hasattr(key, '__dict__'))
+        self.assertEqual(key, db.Key('ModelInTestDB', 'abc'))
+        self.assertEqual(key.to_dict(),
+                {'kind': 'ModelInTestDB', 'object_id': 'abc'})
+
     def test_get_class(self):
         self.assertEqual(db.Key._get_class('ModelInTestDB'), ModelInTestDB)
         self.assertIsNone(db.Key._get_class('abcdefghijklmnopqrstuvwxyz'))
 
+        # NOTE: registered on class creation, and the latest one is taken
+        class ModelInTestCase14(db.Model):
+            pass
+        self.assertIs(db.Key._get_class('ModelInTestCase14'), ModelInTestCase14)
+
+        class ModelInTestCase14(db.Model):
+            pass
+        self.assertIs(db.Key._get_class('ModelInTestCase14'), ModelInTestCase14)
+
     def test_get(self):
         model = ModelInTestDB(name='Sam', score=90)
         key = model.put()
@@ -226,6 +619,19 @@ class KeyTestCase(unittest.TestCase):
         self.assertEqual(key.get().birth, birth)
         self.assertEqual(key.get().created_at, created_at)
 
+    def test_get_readonly(self):
+        class ModelInTestCase06(db.Model):
+            name = db.StringAttribute()
+            birth = db.DateAttribute(repeated=True)
+
+        db.register_database(core.Database(copy_policy=core.COPY_READONLY))
+        model = ModelInTestCase06(name='Sam',
+                birth=[datetime.date(2009, 1, 1)])
+        key = model.put()
+        self.assertEqual(key.get(), model)
+        key.get().birth.append(datetime.date(2010, 1, 1))
+        self.assertEqual(key.get(), model)
+
     def test_delete(self):
         class ModelInTestCase01(db.Model):
             pass
@@ -261,6 +667,91 @@ class FunctionTestCase(unittest.TestCase):
         # pass
         db.delete_multi(keys)
 
+    def test_multi_kinds(self):
+        class ModelInTestCase15(db.Model):
+            name = db.StringAttribute()
+            birth = db.DateAttribute(default=datetime.date(2009, 1, 1))
+            note = db.StringAttribute(kept=False, default='note')
+
+        class ModelInTestCase16(db.Model):
+            score = db.IntegerAttribute(repeated=True)
+
+        database = core.Database(storage=storages.MemoryStorage())
+        db.register_database(database)
+        models = [ModelInTestCase15(name='Sam'), ModelInTestCase16(score=[1]),
+                ModelInTestCase15(name='Tom', note='kept')]
+        del models[2].birth
+        keys = db.put_multi(models)
+        self.assertEqual([model.key for model in models], keys)
+        self.assertEqual(database._tables['ModelInTestCase15'][
+                keys[2].object_id], {'name': 'Tom', 'birth': '2009-01-01'})
+
+        missing_key = db.Key('ModelInTestCase16', 'abc')
+        models[2].birth, models[2].note = datetime.date(2009, 1, 1), 'note'
+        self.assertEqual(db.get_multi(keys + [missing_key]), models + [None])
+
+        # NOTE: stored objects are never referred by models
+        database._tables['ModelInTestCase16'][keys[1].object_id]['extra'] = [1]
+        model = keys[1].get()
+        model.score.append(2)
+        model.extra.append(2)
+        self.assertEqual(database._tables['ModelInTestCase16'][
+                keys[1].object_id], {'score': [1], 'extra': [1]})
+
+    def test_multi_overriding_put(self):
+        class ModelInTestCase24(db.Model):
+            name = db.StringAttribute()
+            version = db.IntegerAttribute(default=0)
+
+            def put(self):
+                self.version += 1
+                return super().put()
+
+        db.register_database(core.Database())
+        models = [ModelInTestCase24(name='Sam'), ModelInTestCase24(name='Tom')]
+        keys = db.put_multi(models)
+        self.assertEqual([key.get().version for key in keys], [1, 1])
+
+    def test_overriding_init(self):
+        class ModelInTestCase25(db.Model):
+            name = db.StringAttribute()
+            created = 0
+
+            def __init__(self, **kwargs):
+                super().__init__(**kwargs)
+                ModelInTestCase25.created += 1
+
+        db.register_database(core.Database())
+        keys = db.put_multi([ModelInTestCase25(name='Sam'),
+                ModelInTestCase25(name='Tom')])
+        ModelInTestCase25.created = 0
+        self.assertEqual(keys[0].get().name, 'Sam')
+        self.assertEqual([model.name for model in db.get_multi(keys)],
+                ['Sam', 'Tom'])
+        self.assertEqual(len(ModelInTestCase25.query().fetch()), 2)
+        self.assertEqual(ModelInTestCase25.created, 5)
+
+    def test_multi_in_batch(self):
+        class ModelInTestCase05(db.Model):
+            name = db.IntegerAttribute()
+
+        database = core.Database(storage=storages.MemoryStorage())
+        db.register_database(database)
+        models = [ModelInTestCase05(name=1), ModelInTestCase05(name=2)]
+        keys = db.put_multi(models)
+        self.assertEqual(db.get_multi(keys), models)
+
+        models[1].name = 3
+        models.append(ModelInTestCase05(name=4))
+        # invalid model in the middle, nothing is put
+        models.insert(2, object())
+        with self.assertRaises(AttributeError):
+            db.put_multi(models)
+
+        self.assertEqual(keys[1].get().name, 2)
+        self.assertIsNone(models[3].key)
+        self.assertEqual(len(database._tables['ModelInTestCase05']), 2)
+
     def test_register_database(self):
         class ModelInTestCase04(db.Model):
             name = db.StringAttribute()
@@ -281,3 +772,82 @@ class FunctionTestCase(unittest.TestCase):
 
         db.register_database(database_2)
         self.assertEqual(db.get_multi(keys), [None] * len(keys))
+
+
+class ModelCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.database = core.Database(storage=storages.MemoryStorage())
+        db.register_database(self.database)
+        self.cache = db.ModelCache(max_size=2)
+        db.set_cache(self.cache)
+        self.addCleanup(db.set_cache, None)
+
+    def test_get(self):
+        class ModelInTestCase21(db.Model):
+            name = db.StringAttribute()
+
+        models = [ModelInTestCase21(name='Sam'), ModelInTestCase21(name='Tom'),
+                ModelInTestCase21(name='John')]
+        keys = db.put_multi(models)
+        model = keys[0].get()
+        self.assertIs(keys[0].get(), model)
+        self.assertIs(db.get_multi(keys[:1])[0], model)
+        self.assertEqual(self.cache.stats(),
+                {'hits': 2, 'misses': 1, 'evictions': 0, 'size': 1})
+
+        # the least recently used model is evicted
+        self.assertEqual(db.get_multi(keys[1:]), models[1:])
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertIsNot(keys[0].get(), model)
+
+        # invalidated by the writes
+        model = keys[2].get()
+        model.name = 'Mary'
+        model.put()
+        self.assertIsNot(keys[2].get(), model)
+        self.assertEqual(keys[2].get().name, 'Mary')
+        self.database.table('ModelInTestCase21').update(
+                keys[2].object_id, {'name': 'Ann'})
+        self.assertEqual(keys[2].get().name, 'Ann')
+        keys[2].delete()
+        self.assertIsNone(keys[2].get())
+        db.delete_multi(keys[:1])
+        self.assertIsNone(keys[0].get())
+
+        # the rolled back objects are invalidated
+        model = keys[1].get()
+        with self.assertRaises(ValueError):
+            with self.database.batch():
+                ModelInTestCase21(key=keys[1], name='Jack').put()
+                self.assertEqual(keys[1].get().name, 'Jack')
+                raise ValueError
+        self.assertEqual(keys[1].get(), model)
+
+        # cleared with the database
+        db.register_database(core.Database(storage=storages.MemoryStorage()))
+        self.assertEqual(len(self.cache), 0)
+        self.assertIsNone(keys[1].get())
+
+        with self.assertRaises(ValueError):
+            db.ModelCache(max_size=0)
+
+
+class AsyncTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_model(self):
+        class ModelInTestCase20(db.Model):
+            name = db.StringAttribute()
+
+        sto = storages.MemoryStorage()
+        db.register_database(core.Database(storage=sto))
+        model = ModelInTestCase20(name='Sam')
+        key = await model.put_async()
+        self.assertEqual(await key.get_async(), model)
+        self.assertEqual(sto.read(), {'ModelInTestCase20': {
+                key.object_id: {'name': 'Sam'}}})
+
+        models = [ModelInTestCase20(name='Tom'), ModelInTestCase20(name='John')]
+        keys = await db.put_multi_async(models)
+        self.assertEqual(await db.get_multi_async(keys), models)
+        await db.delete_multi_async(keys)
+        await key.delete_async()
+        self.assertEqual(sto.read(), {'ModelInTestCase20': {}})
@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+from pydictdb import ids
+
+
+class IdGeneratorTestCase(unittest.TestCase):
+    def test_init(self):
+        with self.assertRaises(TypeError):
+            ids.IdGenerator()
+
+    def assertUniqueInThreads(self, generator):
+        results = []
+
+        def generate():
+            results.extend(generator.next_id() for _ in range(1000))
+            results.extend(generator.next_ids(1000))
+
+        threads = [threading.Thread(target=generate) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(results)), 8000)
+
+
+class CounterIdGeneratorTestCase(IdGeneratorTestCase):
+    def test_next_ids(self):
+        generator = ids.CounterIdGenerator(start=10)
+        self.assertEqual(generator.next_id(), '10')
+        self.assertEqual(generator.next_ids(3), ['11', '12', '13'])
+        self.assertEqual(generator.next_ids(0), [])
+        self.assertEqual(generator.next_id(), '14')
+
+    def test_follow_time(self):
+        generator = ids.CounterIdGenerator()
+        now = time.time_ns() // 1000
+        object_ids = [int(object_id) for object_id in generator.next_ids(100)]
+        self.assertGreaterEqual(object_ids[0], now)
+        self.assertEqual(object_ids, list(range(object_ids[0],
+                object_ids[0] + 100)))
+        self.assertGreater(int(generator.next_id()), object_ids[-1])
+
+    def test_threads(self):
+        self.assertUniqueInThreads(ids.CounterIdGenerator())
+
+
+class SnowflakeIdGeneratorTestCase(IdGeneratorTestCase):
+    def test_node_id(self):
+        generator = ids.SnowflakeIdGenerator(node_id=5)
+        object_id = int(generator.next_id())
+        self.assertEqual((object_id >> 12) & 0x3ff, 5)
+        self.assertEqual(object_id & 0xfff, 0)
+        node_id = ids.SnowflakeIdGenerator().node_id
+        self.assertLess(node_id, 1 << 30)
+        self.assertEqual(node_id >> 20, os.getpid() & 0x3ff)
+
+        with self.assertRaises(ValueError):
+            ids.SnowflakeIdGenerator(node_id=1024)
+        with self.assertRaises(ValueError):
+            ids.SnowflakeIdGenerator(node_id=-1)
+
+    def test_next_ids(self):
+        generator = ids.SnowflakeIdGenerator(node_id=1)
+        object_ids = [int(object_id) for object_id in generator.next_ids(10000)]
+        self.assertEqual(object_ids, sorted(set(object_ids)))
+        # sequence overflow takes the next milliseconds
+        self.assertGreater(object_ids[-1] >> 22, object_ids[0] >> 22)
+
+        other_ids = ids.SnowflakeIdGenerator(node_id=2).next_ids(10000)
+        self.assertFalse(set(map(str, object_ids)) & set(other_ids))
+
+    def test_colliding_pids(self):
+        # the processes of pids equal in 10 bits in the same millisecond
+        object_ids = []
+        with mock.patch('time.time_ns', return_value=1600000000000000000):
+            for pid in (5, 5 + 1024):
+                with mock.patch('os.getpid', return_value=pid):
+                    generator = ids.SnowflakeIdGenerator()
+                    self.assertEqual(generator.node_id >> 20, 5)
+                    object_ids.extend(generator.next_ids(100))
+        self.assertEqual(len(set(object_ids)), 200)
+
+    def test_threads(self):
+        self.assertUniqueInThreads(ids.SnowflakeIdGenerator())
+
+
+class UuidIdGeneratorTestCase(IdGeneratorTestCase):
+    def test_next_ids(self):
+        generator = ids.UuidIdGenerator()
+        self.assertEqual(len(generator.next_id()), 32)
+        self.assertEqual(len(set(generator.next_ids(100))), 100)
+
+    def test_threads(self):
+        self.assertUniqueInThreads(ids.UuidIdGenerator())
@@ -0,0 +1,170 @@
+import unittest
+
+from pydictdb import indexes
+
+
+class FunctionTestCase(unittest.TestCase):
+    def test_field_values(self):
+        self.assertEqual(indexes.field_values({'name': 'Sam'}, 'name'),
+                ('Sam',))
+        self.assertEqual(indexes.field_values({'tags': ['A', 'B']}, 'tags'),
+                ['A', 'B'])
+        self.assertEqual(indexes.field_values({}, 'name'), ())
+
+    def test_match_equal(self):
+        self.assertTrue(indexes.match_equal({'name': 'Sam'}, 'name', 'Sam'))
+        self.assertFalse(indexes.match_equal({'name': 'Sam'}, 'name', 'Tom'))
+        self.assertTrue(indexes.match_equal({'tags': ['A', 'B']}, 'tags', 'B'))
+        self.assertFalse(indexes.match_equal({}, 'name', None))
+        self.assertTrue(indexes.match_equal({'name': None}, 'name', None))
+
+
+class HashIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dictionary = {
+            '001': {'name': 'Sam', 'tags': ['A', 'B']},
+            '002': {'name': 'Tom', 'tags': ['B']},
+            '003': {'name': 'Sam', 'group': {'kind': 'Group', 'id': '001'}},
+        }
+
+    def test_build_lookup(self):
+        index = indexes.HashIndex('name')
+        index.build(self.dictionary)
+        self.assertEqual(list(index.lookup('Sam')), ['001', '003'])
+        self.assertEqual(list(index.lookup('John')), [])
+        self.assertEqual(index.count('Sam'), 2)
+        self.assertEqual(index.count('John'), 0)
+
+    def test_repeated(self):
+        index = indexes.HashIndex('tags')
+        index.build(self.dictionary)
+        self.assertEqual(list(index.lookup('A')), ['001'])
+        self.assertEqual(list(index.lookup('B')), ['001', '002'])
+        self.assertEqual(index.counts(), {'A': 1, 'B': 2})
+
+    def test_unhashable(self):
+        index = indexes.HashIndex('group')
+        index.build(self.dictionary)
+        self.assertEqual(list(index.lookup({'id': '001', 'kind': 'Group'})),
+                ['003'])
+
+    def test_add_remove(self):
+        index = indexes.HashIndex('name')
+        index.build(self.dictionary)
+        index.remove('001', self.dictionary['001'])
+        self.assertEqual(list(index.lookup('Sam')), ['003'])
+        index.remove('003', self.dictionary['003'])
+        self.assertEqual(index._ids, {'Tom': {'002': None}})
+
+        index.add('004', {'name': 'Tom'})
+        self.assertEqual(list(index.lookup('Tom')), ['002', '004'])
+
+        with self.assertRaises(TypeError):
+            index.add('005', {'name': ['Tom', bytearray(b'Sam')]})
+        self.assertEqual(list(index.lookup('Tom')), ['002', '004'])
+
+
+class OrderedIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dictionary = {
+            '001': {'score': 70, 'tags': [3, 1]},
+            '002': {'score': 50, 'tags': [2]},
+            '003': {'score': 90},
+            '004': {'score': 70},
+            '005': {'score': None},
+        }
+        self.index = indexes.OrderedIndex('score')
+        self.index.build(self.dictionary)
+
+    def test_build(self):
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(list(self.index.range()),
+                ['002', '001', '004', '003'])
+        self.assertEqual(list(self.index.range(reverse=True)),
+                ['003', '004', '001', '002'])
+
+    def test_range(self):
+        self.assertEqual(list(self.index.range(50, 70)),
+                ['002', '001', '004'])
+        self.assertEqual(list(self.index.range(50, 70, include_lower=False)),
+                ['001', '004'])
+        self.assertEqual(list(self.index.range(50, 70, include_upper=False)),
+                ['002'])
+        self.assertEqual(list(self.index.range(lower=60)),
+                ['001', '004', '003'])
+        self.assertEqual(list(self.index.range(upper=60, reverse=True)),
+                ['002'])
+        self.assertEqual(list(self.index.range(80, 60)), [])
+        self.assertEqual(self.index.count_range(lower=60), 3)
+        self.assertEqual(self.index.lookup(70), ['001', '004'])
+        self.assertEqual(self.index.count(70), 2)
+
+    def test_min_max(self):
+        self.assertEqual(self.index.min(), 50)
+        self.assertEqual(self.index.max(), 90)
+        self.assertIsNone(indexes.OrderedIndex('score').min())
+        self.assertIsNone(indexes.OrderedIndex('score').max())
+
+    def test_add_remove(self):
+        self.index.remove('001', self.dictionary['001'])
+        self.index.add('006', {'score': 60})
+        self.index.remove('007', {'score': 60})
+        self.assertEqual(list(self.index.range()), ['002', '006', '004', '003'])
+        self.assertEqual(self.index._keys, [50, 60, 70, 90])
+
+    def test_incomparable(self):
+        with self.assertRaises(TypeError):
+            self.index.add('006', {'score': 'A'})
+        index = indexes.OrderedIndex('tags')
+        index.build(self.dictionary)
+        with self.assertRaises(TypeError):
+            index.add('006', {'tags': [4, 'A']})
+        self.assertEqual(index._keys, [1, 2, 3])
+        self.assertEqual(index._multi_valued, 1)
+        self.assertEqual(self.index._keys, [50, 70, 70, 90])
+
+    def test_repeated(self):
+        index = indexes.OrderedIndex('tags')
+        index.build(self.dictionary)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(list(index.range()), ['001', '002'])
+        self.assertEqual(list(index.range(reverse=True)), ['001', '002'])
+        self.assertEqual(list(index.range(2, 2)), ['002'])
+        self.assertTrue(index.multi_valued)
+        self.assertFalse(self.index.multi_valued)
+
+        index.remove('001', self.dictionary['001'])
+        self.assertFalse(index.multi_valued)
+        index.add('001', self.dictionary['001'])
+        self.assertTrue(index.multi_valued)
+
+    def test_key(self):
+        index = indexes.OrderedIndex('date',
+                key=lambda value: value.split('-')[::-1])
+        index.build({'001': {'date': '21-2019'}, '002': {'date': '12-2020'}})
+        self.assertEqual(list(index.range()), ['001', '002'])
+        self.assertEqual(list(index.range(lower='01-2020')), ['002'])
+        self.assertEqual(index.max(), '12-2020')
+
+
+class IdIndexTestCase(unittest.TestCase):
+    def test_range(self):
+        index = indexes.IdIndex()
+        index.add('001')
+        self.assertFalse(index.built)
+        index.ensure_built({'003': {}, 2: {}, '001': {}})
+        self.assertTrue(index.built)
+        # ordered by type name, then by id
+        self.assertEqual(list(index.range()), [2, '001', '003'])
+        self.assertEqual(list(index.range(after=indexes._id_key('001'))),
+                ['003'])
+
+        index.add('002')
+        index.add('002')
+        index.remove(2)
+        index.remove(4)
+        self.assertEqual(list(index.range()), ['001', '002', '003'])
+        self.assertEqual(len(index), 3)
+
+        index.reset()
+        self.assertFalse(index.built)
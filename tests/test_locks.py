@@ -0,0 +1,116 @@
+import threading
+import time
+import unittest
+
+from pydictdb import locks
+
+
+class ReadWriteLockTestCase(unittest.TestCase):
+    def run_threads(self, *targets):
+        threads = [threading.Thread(target=target) for target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+    def test_readers_in_parallel(self):
+        lock = locks.ReadWriteLock()
+        barrier = threading.Barrier(2, timeout=5)
+        passed = []
+
+        def read():
+            with lock.reader:
+                # NOTE: broken if the readers exclude each other
+                barrier.wait()
+                passed.append(True)
+
+        self.run_threads(read, read)
+        self.assertEqual(passed, [True, True])
+
+    def test_writer_excludes(self):
+        lock = locks.ReadWriteLock()
+        events = []
+
+        def write():
+            with lock.writer:
+                events.append('write')
+                time.sleep(0.05)
+                events.append('written')
+
+        def read():
+            time.sleep(0.01)
+            with lock.reader:
+                events.append('read')
+
+        self.run_threads(write, read, read)
+        self.assertEqual(events, ['write', 'written', 'read', 'read'])
+
+    def test_writer_first(self):
+        lock = locks.ReadWriteLock()
+        events = []
+        lock.acquire_read()
+
+        def write():
+            with lock.writer:
+                events.append('write')
+
+        def read():
+            time.sleep(0.02)
+            with lock.reader:
+                events.append('read')
+
+        threads = [threading.Thread(target=write), threading.Thread(target=read)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        # NOTE: the new reader waits for the waiting writer
+        self.assertEqual(events, [])
+        lock.release_read()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(events, ['write', 'read'])
+
+    def test_reentrant(self):
+        lock = locks.ReadWriteLock()
+        with lock.writer:
+            with lock.writer:
+                with lock.reader:
+                    pass
+            self.assertEqual(lock._writer, threading.get_ident())
+        self.assertIsNone(lock._writer)
+
+        with lock.reader:
+            with lock.reader:
+                pass
+            with self.assertRaises(RuntimeError):
+                lock.acquire_write()
+        self.assertEqual(lock._readers, 0)
+
+        with self.assertRaises(RuntimeError):
+            lock.release_write()
+
+    def test_holds_read(self):
+        lock = locks.ReadWriteLock()
+        self.assertFalse(lock.holds_read())
+        with lock.reader:
+            self.assertTrue(lock.holds_read())
+            with lock.reader:
+                self.assertTrue(lock.holds_read())
+            self.assertTrue(lock.holds_read())
+        self.assertFalse(lock.holds_read())
+        with lock.writer:
+            self.assertFalse(lock.holds_read())
+
+        results = []
+        with lock.reader:
+            self.run_threads(lambda: results.append(lock.holds_read()))
+        self.assertEqual(results, [False])
+
+
+class NullLockTestCase(unittest.TestCase):
+    def test_lock(self):
+        lock = locks.NullLock()
+        self.assertFalse(lock.holds_read())
+        with lock.writer:
+            with lock.reader:
+                pass
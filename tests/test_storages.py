@@ -1,3 +1,4 @@
+import json
 import os
 import unittest
 
@@ -25,6 +26,19 @@ class MemoryStorageTestCase(unittest.TestCase):
         data['User']['001']['score'] = 200
         self.assertNotEqual(sto._memory, data)
 
+    def test_write_changes(self):
+        sto = storages.MemoryStorage()
+        sto.write({'User': {'001': {'name': 'Sam'}, '002': {'name': 'Tom'}}})
+        obj = {'name': 'John'}
+        sto.write_changes({'User': {'001': None, '003': obj}, 'Group': {}})
+        self.assertEqual(sto.read(), {
+            'User': {'002': {'name': 'Tom'}, '003': {'name': 'John'}},
+            'Group': {},
+        })
+
+        obj['name'] = 'Sam'
+        self.assertEqual(sto._memory['User']['003'], {'name': 'John'})
+
 
 class FileStorageTestCase(unittest.TestCase):
     def setUp(self):
@@ -56,6 +70,28 @@ class FileStorageTestCase(unittest.TestCase):
         self.assertEqual(fp.read(), content)
         fp.close()
 
+    def test_durability(self):
+        for durability in storages.DURABILITIES:
+            sto = storages.FileStorage(self.path, durability=durability)
+            sto.write(durability)
+            # the rewritten file is never left truncated before closing
+            with open(self.path) as fp:
+                self.assertEqual(fp.read(), durability)
+            sto.close()
+
+        with self.assertRaises(ValueError):
+            storages.FileStorage(self.path, durability='sync')
+
+    def test_write_atomic(self):
+        sto = storages.FileStorage(self.path, durability='fsync', atomic=True)
+        sto.write('content')
+        sto.write('new')
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        self.assertEqual(sto.read(), 'new')
+        with open(self.path) as fp:
+            self.assertEqual(fp.read(), 'new')
+        sto.close()
+
     def test_close(self):
         sto = storages.FileStorage(self.path)
         self.assertFalse(sto._fp.closed)
@@ -175,3 +211,369 @@ class JsonStorageTestCase(unittest.TestCase):
                 },
             },
         })
+
+
+class BinaryStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.abspath('.storage')
+        self.data = {'User': {
+            1: {'name': 'Sam', 'score': 100.5, 'tags': ['a', 'b']},
+            '002': {'name': 'Tom', 'admin': True, 'group': None},
+        }}
+
+    def tearDown(self):
+        for path in (self.path, self.path + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_read_write(self):
+        for storage_class in (storages.PickleStorage, storages.MarshalStorage):
+            for compression in (None,) + tuple(storages.COMPRESSIONS):
+                sto = storage_class(self.path, compression=compression)
+                self.assertEqual(sto.read(), {})
+                sto.write(self.data)
+                sto.close()
+
+                sto = storage_class(self.path, atomic=True,
+                        compression=compression)
+                self.assertEqual(sto.read(), self.data)
+                sto.write({})
+                self.assertEqual(sto.read(), {})
+                sto.close()
+                os.remove(self.path)
+
+    def test_compression(self):
+        data = {'User': {str(i): {'name': 'Sam'} for i in range(100)}}
+        sto = storages.JsonStorage(self.path, compression='zlib')
+        sto.write(data)
+        self.assertLess(os.path.getsize(self.path),
+                len(storages.JsonStorage.encode(data)) / 2)
+        self.assertEqual(sto.read(), data)
+        sto.close()
+
+        with self.assertRaises(ValueError):
+            storages.JsonStorage(self.path, compression='gzip')
+
+
+class JsonLinesStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.abspath('.storage')
+        self.data = {
+            'User': {'001': {'name': 'Sam'}, 2: {'name': 'Tom'}},
+            'Group': {'001': {'name': 'admin', 'user_ids': ['001', 2]}},
+        }
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_read_write(self):
+        sto = storages.JsonLinesStorage(self.path)
+        self.assertEqual(sto.read(), {})
+        sto.write(self.data)
+        with open(self.path) as fp:
+            lines = fp.read().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[1]),
+                {'kind': 'User', 'id': 2, 'obj': {'name': 'Tom'}})
+        self.assertEqual(sto.read(), self.data)
+        self.assertEqual(next(sto.iter_records()),
+                ('User', '001', {'name': 'Sam'}))
+
+    def test_iter_export(self):
+        from pydictdb import core
+
+        database = core.Database(storage=storages.MemoryStorage())
+        for kind, objects in self.data.items():
+            table = database.table(kind)
+            table.update_or_insert_multi(list(objects), list(objects.values()))
+
+        with open(self.path, 'w') as fp:
+            for kind in self.data:
+                fp.writelines(database.table(kind).iter_export())
+        self.assertEqual(storages.JsonLinesStorage(self.path).read(),
+                self.data)
+
+
+class JournalStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.abspath('.storage')
+        self.data = {'User': {
+            '001': {'name': 'Sam', 'score': 100},
+            '002': {'name': 'Tom', 'score': 90},
+        }}
+
+    def tearDown(self):
+        for path in (self.path, self.path + '.compact'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def read_lines(self):
+        with open(self.path, 'r') as fp:
+            return fp.read().splitlines()
+
+    def test_durability(self):
+        sto = storages.JournalStorage(self.path, durability='fsync')
+        sto.write(self.data)
+        sto.compact()
+        self.assertEqual(len(self.read_lines()), 2)
+        sto.close()
+        self.assertEqual(storages.JournalStorage(self.path).read(), self.data)
+
+        with self.assertRaises(ValueError):
+            storages.JournalStorage(self.path, durability=None)
+
+    def test_read_write(self):
+        sto = storages.JournalStorage(self.path)
+        self.assertEqual(sto.read(), {})
+        sto.write(self.data)
+        self.assertEqual(len(self.read_lines()), 2)
+        sto.close()
+
+        sto = storages.JournalStorage(self.path)
+        self.assertEqual(sto.read(), self.data)
+        sto.close()
+
+    def test_append_only_changes(self):
+        sto = storages.JournalStorage(self.path)
+        sto.write(self.data)
+        self.data['User']['001']['score'] = 99
+        del self.data['User']['002']
+        sto.write(self.data)
+        lines = self.read_lines()
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(json.loads(lines[2]),
+                {'op': 'delete', 'kind': 'User', 'id': '002'})
+        self.assertEqual(json.loads(lines[3]), {'op': 'put', 'kind': 'User',
+                'id': '001', 'obj': {'name': 'Sam', 'score': 99}})
+
+        # nothing appended without changes
+        sto.write(self.data)
+        self.assertEqual(len(self.read_lines()), 4)
+        sto.close()
+
+        sto = storages.JournalStorage(self.path)
+        self.assertEqual(sto.read(), self.data)
+        sto.close()
+
+    def test_write_changes(self):
+        sto = storages.JournalStorage(self.path)
+        sto.write(self.data)
+        sto.write_changes({'User': {
+            '001': {'name': 'Sam', 'score': 99},
+            '002': {'name': 'Tom', 'score': 90},
+            '003': None,
+        }})
+        lines = self.read_lines()
+        # unchanged and non-existed objects are not appended
+        self.assertEqual(len(lines), 3)
+
+        sto.write_changes({'User': {'002': None}})
+        self.assertEqual(len(self.read_lines()), 4)
+        sto.close()
+
+        sto = storages.JournalStorage(self.path)
+        self.assertEqual(sto.read(),
+                {'User': {'001': {'name': 'Sam', 'score': 99}}})
+        sto.close()
+
+    def test_truncated_record(self):
+        sto = storages.JournalStorage(self.path)
+        sto.write(self.data)
+        sto.close()
+        with open(self.path, 'a') as fp:
+            fp.write('{"op": "put", "kind": "User", "id": "003", "ob')
+
+        sto = storages.JournalStorage(self.path)
+        self.assertEqual(sto.read(), self.data)
+        # appended after the complete records
+        self.data['User']['003'] = {'name': 'John'}
+        self.data['User']['004'] = {'name': 'Mary'}
+        sto.write(self.data)
+        sto.close()
+
+        sto = storages.JournalStorage(self.path)
+        self.assertEqual(sto.read(), self.data)
+        sto.close()
+
+        # a complete record without the newline
+        with open(self.path, 'rb+') as fp:
+            fp.seek(-1, os.SEEK_END)
+            fp.truncate()
+        sto = storages.JournalStorage(self.path)
+        self.assertEqual(sto.read(), self.data)
+        del self.data['User']['003']
+        sto.write(self.data)
+        sto.close()
+
+        sto = storages.JournalStorage(self.path)
+        self.assertEqual(sto.read(), self.data)
+        sto.close()
+
+    def test_compact(self):
+        sto = storages.JournalStorage(self.path, compact_threshold=None)
+        sto.write(self.data)
+        for score in range(10):
+            self.data['User']['001']['score'] = score
+            sto.write(self.data)
+        self.assertEqual(len(self.read_lines()), 12)
+
+        sto.compact()
+        self.assertEqual(len(self.read_lines()), 2)
+        self.assertEqual(sto.read(), self.data)
+
+        self.data['User']['002']['score'] = 0
+        sto.write(self.data)
+        self.assertEqual(len(self.read_lines()), 3)
+        sto.close()
+
+        sto = storages.JournalStorage(self.path)
+        self.assertEqual(sto.read(), self.data)
+        sto.close()
+
+    def test_compact_threshold(self):
+        for background in (False, True):
+            sto = storages.JournalStorage(self.path, compact_threshold=0,
+                    background=background)
+            sto.write(self.data)
+            for score in range(10):
+                self.data['User']['001']['score'] = score
+                sto.write(self.data)
+            sto.wait()
+            self.assertLess(len(self.read_lines()), 12)
+            sto.close()
+
+            sto = storages.JournalStorage(self.path)
+            self.assertEqual(sto.read(), self.data)
+            sto.close()
+            os.remove(self.path)
+
+
+class MmapStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.abspath('.storage')
+        self.data = {
+            'User': {
+                '001': {'name': 'Sam', 'score': 100},
+                2: {'name': 'Tom', 'tags': ['a', 'b']},
+            },
+            'Group': {},
+        }
+
+    def tearDown(self):
+        for path in (self.path, self.path + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_read_write(self):
+        sto = storages.MmapStorage(self.path)
+        self.assertEqual(sto.read(), {})
+        sto.write(self.data)
+        data = storages.MmapStorage(self.path).read()
+        self.assertEqual(data, self.data)
+
+        os.remove(self.path)
+        with open(self.path, 'wb') as fp:
+            fp.write(b'{}')
+        with self.assertRaises(ValueError):
+            sto.read()
+
+    def test_lazy(self):
+        sto = storages.MmapStorage(self.path)
+        sto.write(self.data)
+        users = sto.read()['User']
+        self.assertIsNone(users._objects)
+
+        self.assertEqual(users['001'], {'name': 'Sam', 'score': 100})
+        self.assertIs(users._objects[2], storages._UNLOADED)
+        self.assertIn(2, users)
+        self.assertIsNone(users.get(3))
+
+        users[3] = {'name': 'John'}
+        del users['001']
+        self.assertEqual(len(users), 2)
+
+        # the records never decoded are copied as they are
+        sto.write({'User': users})
+        self.assertIs(users._objects[2], storages._UNLOADED)
+        self.assertEqual(sto.read(), {'User': {
+            2: {'name': 'Tom', 'tags': ['a', 'b']},
+            3: {'name': 'John'},
+        }})
+
+    def test_database(self):
+        from pydictdb import core
+
+        storages.MmapStorage(self.path).write(self.data)
+        database = core.Database(storage=storages.MmapStorage(self.path))
+        table = database.table('User')
+        self.assertEqual(table.get(2), self.data['User'][2])
+        table.update('001', {'name': 'Sam', 'score': 90})
+        table.create_index('score', ordered=True)
+        self.assertEqual(table.query().max('score'), 90)
+
+        data = storages.MmapStorage(self.path).read()
+        self.assertEqual(data['User']['001'], {'name': 'Sam', 'score': 90})
+        self.assertEqual(data, database._tables)
+
+
+class DirectoryStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.abspath('.storage')
+        self.data = {
+            'User': {'001': {'name': 'Sam'}, '002': {'name': 'Tom'}},
+            'Group/Admin': {'001': {'name': 'admin'}},
+        }
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            for name in os.listdir(self.path):
+                os.remove(os.path.join(self.path, name))
+            os.rmdir(self.path)
+
+    def test_read_write(self):
+        sto = storages.DirectoryStorage(self.path)
+        self.assertEqual(sto.read(), {})
+        sto.write(self.data)
+        self.assertEqual(sorted(os.listdir(self.path)),
+                ['Group%2FAdmin.json', 'User.json'])
+        self.assertEqual(sorted(sto.kinds()), ['Group/Admin', 'User'])
+        self.assertEqual(sto.read(), self.data)
+        self.assertEqual(sto.read_kind('Item'), {})
+
+        sto.write({'User': {}})
+        self.assertEqual(sto.read(), {'User': {}})
+        sto.close()
+
+    def test_write_kinds(self):
+        sto = storages.DirectoryStorage(self.path, max_workers=2)
+        sto.write(self.data)
+        sto.write_kinds({'User': {}, 'Item': {'001': {'name': 'book'}}})
+        self.assertEqual(sto.read(), {
+            'User': {},
+            'Group/Admin': self.data['Group/Admin'],
+            'Item': {'001': {'name': 'book'}},
+        })
+        sto.close()
+
+    def test_database(self):
+        from pydictdb import core
+
+        storages.DirectoryStorage(self.path).write(self.data)
+        sto = storages.DirectoryStorage(self.path)
+        database = core.Database(storage=sto)
+        self.assertEqual(database._tables, {})
+
+        table = database.table('User')
+        self.assertEqual(database._tables, {'User': self.data['User']})
+        self.assertEqual(table.get('001'), {'name': 'Sam'})
+
+        # only the file of the changed kind is rewritten
+        group_path = os.path.join(self.path, 'Group%2FAdmin.json')
+        os.remove(group_path)
+        table.update('001', {'name': 'John'})
+        database.table('Item').insert({'name': 'book'})
+        self.assertFalse(os.path.exists(group_path))
+        self.assertEqual(sto.read_kind('User')['001'], {'name': 'John'})
+        self.assertEqual(len(sto.read_kind('Item')), 1)
+        database.close()